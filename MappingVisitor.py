@@ -5,38 +5,51 @@ from MineScriptVisitor import MineScriptVisitor
 
 
 class MappingVisitor(MineScriptVisitor):
+    # Only indexes function signatures: statements are never descended into
+    # except for top-level blocks, so function bodies are walked once (by
+    # Visitor) instead of twice
     def __init__(self, name, filename):
         self.logger = Logger(filename)
         self.igfunctions = {}
         self.igmemory = {}
-        self.igfunc = None
+        self.declarations = {}
+        
+    def visitProg(self, ctx):
+        for stat in ctx.stat():
+            self.visit(stat)
+            
+    def visitStat(self, ctx):
+        if ctx.functionDeclaration() is not None:
+            self.visit(ctx.functionDeclaration())
+        else:
+            for stat in ctx.stat():
+                self.visit(stat)
         
     def visitFunctionDeclaration(self, ctx):
         type_ = ctx.type_.text
         name = ctx.WORD().getText()
         
-        if self.igfunc is not None:
-            line = ctx.start.line
-            char = ctx.start.column
-            self.logger.log(f"Nested functions not supported ('{name}' inside '{self.igfunc}')", line, char, "error")
-            raise Exception()
-        
         if name in self.igfunctions:
             line = ctx.start.line
             char = ctx.start.column
             self.logger.log(f"Multiple definitions of function '{name}'", line, char, "error")
-            raise Exception()
+            raise MappingException()
         
+        self.declarations[name] = ctx
         self.igfunctions[name] = {
             "code" : [],
-            "args": []
+            "args": [],
+            "line": ctx.start.line,
+            "column": ctx.start.column,
+            # Run from outside the pack, so kept even if nothing in it calls it
+            "export": ctx.K_EXPORT() is not None
         }
         if type_ != "void": 
             self.igmemory[f"_f_{name}"] = type_
             self.igfunctions[name]["return"] = f"_f_{name}"
         
         for functionArg in ctx.functionArg():
-            arg_type = functionArg.type_.text
+            arg_type = functionArg.type_.text if functionArg.arr() is None else functionArg.type_.text + "[]"
             arg_name = functionArg.WORD().getText()
             if len(list(filter(lambda i: i[0] == arg_name, self.igfunctions[name]["args"]))) != 0:
                 line = functionArg.start.line
@@ -51,6 +64,3 @@ class MappingVisitor(MineScriptVisitor):
             self.logger.log(f"The built-in function '{name}' takes no args", line, char, "error")
             raise MappingException()
 
-        self.igfunc = name
-        self.visitChildren(ctx)            
-        self.igfunc = None        
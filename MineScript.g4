@@ -40,7 +40,7 @@ expr
 cast                    : '(' type_=(K_INT | K_CHAR) ')' expr;
 variableDeclaration     : type_=(K_INT | K_CHAR) variableAssignement (COMMA variableAssignement)*;
 variableAssignement     : PREFIX? WORD arr? (OP_ASSIGN expr)?;
-functionDeclaration     : type_=(K_INT | K_CHAR | K_VOID) WORD '(' (functionArg (COMMA functionArg)*)? ')' stat;
+functionDeclaration     : K_EXPORT? type_=(K_INT | K_CHAR | K_VOID) WORD '(' (functionArg (COMMA functionArg)*)? ')' stat;
 functionArg             : type_=(K_INT | K_CHAR) PREFIX? WORD arr?;
 printStatement          : K_PRINT '(' (expr (COMMA expr)*)? ')' SEP;
 functionCall            : PREFIX? WORD '(' (expr (COMMA expr)*)? ')';
@@ -76,6 +76,7 @@ K_MC                    : 'mc';
 K_RESULT                : 'result';
 K_SUCCESS               : 'success';
 K_RETURN                : 'return';
+K_EXPORT                : 'export';
 OP_INC                  : '++';
 OP_DEC                  : '--';
 OP_PLUS                 : '+';
@@ -1,15 +1,24 @@
+import copy
 import sys
+from collections import defaultdict
 
 import antlr4
 
+import analysis
+import ir
 from exceptions import CompileTimeException
 from logs import Logger
 from MineScriptParser import MineScriptParser
 from MineScriptVisitor import MineScriptVisitor
 
-CONTROL_FLOW_CONTEXTS = [MineScriptParser.IfStatementContext,
-                         MineScriptParser.ForStatementContext,
-                         MineScriptParser.WhileStatementContext]
+# Most instructions a counted for loop is unrolled into (0 never unrolls)
+UNROLL_THRESHOLD = 32
+# Fewest branches of an if/else-if chain on one variable dispatched by binary search
+SWITCH_THRESHOLD = 4
+# Storage compound macro functions get their arguments from
+MACRO_ARGUMENTS = "_macro"
+# Elements per page of an array (0 keeps each array in one flat list)
+PAGE_SIZE = 0
 
 class Literal:
     def __init__(self, value, type, const=False):
@@ -18,9 +27,16 @@ class Literal:
         self.const = const
 
 class Visitor(MineScriptVisitor):
-    def __init__(self, name, filename):
+    def __init__(self, name, filename, unroll_threshold=UNROLL_THRESHOLD, macros=False, page_size=PAGE_SIZE):
         self.logger = Logger(filename)
         self.name = name
+        self.unroll_threshold = unroll_threshold
+        # Whether the target version has function macros
+        self.macros = macros
+        # Arrays are split into pages of this many elements, kept as a tree
+        # of compounds that's never deeper than it must be (see element_path).
+        # Macros reach any element of a flat list in one command instead
+        self.page_size = 0 if macros else page_size
         
         self.memory = {}
         self.localmemory = {}
@@ -31,23 +47,34 @@ class Visitor(MineScriptVisitor):
         self.igmemory = {}
         self.local = {}
         self.igfunctions = {}
+        self.declarations = {}
         self.igfunc = None
         self.igfuncinfo = None
+        # Functions called anywhere in the source
+        self.called = set()
         
         self.igloops = {}
+        self.igloopinfo = {}
+        self.igsources = {}
         
-        self.usedvars = set()
         self.tempvars = set()
+        self.constants = {}
+        self.constant_uses = defaultdict(int)
         self.prefixes = []
+        # Break/return guards among the prefixes that nothing has needed yet:
+        # only commands after an emitted break or return have to test them
+        self.dormant = set()
         self.loop = []
         self.break_var = []
         self.loops = 0
+        self.blocks = 0
         self.tags = 0
+        # Commands saved while generating code, per optimization
+        self.optimizations = defaultdict(int)
         
     def get_value(self, obj):
         if isinstance(obj, Literal):
             if obj.type == "char[]":
-                print(obj.value)
                 return ''.join(obj.value)
             if obj.type == "char":
                 return chr(obj.value)
@@ -55,6 +82,12 @@ class Visitor(MineScriptVisitor):
         else:
             return self.get_value(self.memory[obj])
         
+    def get_number(self, obj):
+        # Value of a compile-time int or char, as the number the scoreboard holds
+        if isinstance(obj, Literal):
+            return obj.value
+        return self.memory[obj].value
+        
     def at_compile_time(self, obj):
         if isinstance(obj, Literal):
             return True
@@ -63,20 +96,29 @@ class Visitor(MineScriptVisitor):
         return False
         
     def is_used(self, ctx):
-        aux = ctx.parentCtx
+        child, aux = ctx, ctx.parentCtx
         while aux is not None and not isinstance(aux, MineScriptParser.StatContext):
+            if isinstance(aux, MineScriptParser.ForStatementContext):
+                # The init and update of a for only run for their side effects
+                return child is aux.expr()[-2]
             if not isinstance(aux, MineScriptParser.IgnoreContext):
                 return True
-            aux = aux.parentCtx
+            child, aux = aux, aux.parentCtx
         return False
     
     def is_used_on_condition(self, ctx):
+        # Whether variable ctx's value is itself the condition of an if, which
+        # keeps being tested while the statements it guards run, and those may
+        # change it. Anything else reads it right away.
         aux = ctx.parentCtx
-        while aux is not None and not isinstance(aux, MineScriptParser.StatContext):
-            for context in CONTROL_FLOW_CONTEXTS:
-                if isinstance(aux, context):
-                    return True
+        while isinstance(aux, (MineScriptParser.IgnoreContext, MineScriptParser.ParenthesesContext)):
             aux = aux.parentCtx
+        if not isinstance(aux, MineScriptParser.IfStatementContext):
+            return False
+        for stat in aux.stat():
+            written = analysis.assigned_variables(stat, self.declarations)
+            if written is None or ctx.WORD().getText() in written:
+                return True
         return False
     
     def is_defined(self, name):
@@ -144,16 +186,19 @@ class Visitor(MineScriptVisitor):
         if isinstance(value, Literal):
             if not name.startswith("$"):
                 if not self.get_type(value).endswith("[]"):
-                    self.add_cmd(f"scoreboard players set #MineScript {name} {value.value}", ctx)
+                    self.add_cmd(ir.Set(name, value.value), ctx)
                 else:
-                    list_value = ""
+                    items = []
                     for item in value.value:
                         if self.get_type(value) == "char[]":
-                            list_value += f'{ord(item)},'
+                            items.append(str(ord(item)))
                         elif self.get_type(value) == "int[]":
-                            list_value += str(item.value) + ","
-                    list_value = "{value:" + f"[{list_value[:-1]}]," + f"size:{str(len(value.value))}"+ "}"
-                    self.add_cmd(f"data modify storage {self.name}:minescript {name} set value {list_value}", ctx)
+                            items.append(str(item.value))
+                    pages = [items]
+                    if self.page_size:
+                        pages = [items[i:i+self.page_size] for i in range(0, len(items), self.page_size)] or [[]]
+                    list_value = "{" + self.page_snbt(pages, 0) + f",size:{str(len(value.value))}" + "}"
+                    self.add_cmd(ir.DataModify(name, "set", value=list_value), ctx)
             else:
                 self.memory[name] = value
         else:
@@ -162,10 +207,12 @@ class Visitor(MineScriptVisitor):
                 char = ctx.start.column
                 self.logger.log("Compile-time variable can't be assigned to an in-game variable", line, char, "error")
                 raise CompileTimeException()
+            if value == name:
+                return
             if not self.get_type(value).endswith("[]"):
-                self.add_cmd(f"scoreboard players operation #MineScript {name} = #MineScript {value}", ctx)
+                self.add_cmd(ir.Operation(name, "=", value), ctx)
             else:
-                self.add_cmd(f"data modify storage {self.name}:minescript {name} set from storage {self.name}:minescript {value}", ctx)
+                self.add_cmd(ir.DataModify(name, "set", source=value), ctx)
                 
     def get_arr_element(self, name, element, ctx):
         if self.get_type(element) != "int":
@@ -176,33 +223,35 @@ class Visitor(MineScriptVisitor):
         if not name.startswith("$"):
             if isinstance(element, Literal):
                 temp_result = self.get_temp_var(self.get_type(name)[:-2])
-                self.add_cmd(f"execute store result score #MineScript {temp_result} run "
-                            f"data get storage {self.name}:minescript {name}.value[{element.value}]", ctx)
+                self.add_cmd(ir.LoadData(temp_result, self.element_path(name, element.value)), ctx)
+                return temp_result
+            elif self.macros:
+                temp_result = self.get_temp_var(self.get_type(name)[:-2])
+                self.macro_index(element, ir.LoadData(temp_result, f"{name}.value[$(i)]"), ctx)
+                return temp_result
+            elif self.page_size:
+                temp_result = self.get_temp_var(self.get_type(name)[:-2])
+                node = self.get_temp_var(self.get_type(name))
+                self.set_var(node, name, ctx)
+                page, offset = self.page_index(element, ctx)
+                self.find_page(node, page, ctx)
+                if offset is None:
+                    self.add_cmd(ir.LoadData(temp_result, f"{node}.value[0]"), ctx)
+                else:
+                    self.scan_read(node, offset, temp_result, ctx)
+                    self.mark_unused(offset)
+                self.mark_unused(node)
+                self.mark_unused(page)
+                self.optimizations["paged index"] += 1
                 return temp_result
             else:
                 temp_list = self.get_temp_var(self.get_type(name))
-                count = self.get_temp_var("int")
-                #size = self.get_temp_var("int")
+                count = self.get_counter(element, ctx)
                 temp_result = self.get_temp_var(self.get_type(name)[:-2])
-                #self.add_cmd(f"execute store result score #MineScript {size} run "
-                #             f"data get storage {self.name}:minescript {name}.size", ctx)
-                self.set_var(count, Literal(0, "int"), ctx)
                 self.set_var(temp_list, name, ctx)
-                name = f"_loop{self.loops}"
-                self.add_cmd(f"function {self.name}:{name}", ctx)
-                
-                self.start_loop(name, None)
-                self.add_cmd(f"scoreboard players add #MineScript {count} 1", ctx)
-                self.add_cmd(f"execute store result score #MineScript {temp_result} run "
-                            f"data get storage {self.name}:minescript {temp_list}.value[0]", ctx)
-                self.add_cmd(f"data remove storage {self.name}:minescript {temp_list}.value[0]", ctx)
-                self.add_cmd(f"execute unless score #MineScript {count} > #MineScript {element} run "
-                            f"function {self.name}:{name}", ctx)
-                self.end_loop()
-                
+                self.scan_read(temp_list, count, temp_result, ctx)
                 self.mark_unused(temp_list)
                 self.mark_unused(count)
-                #self.mark_unused(size)
                 
                 return temp_result
         else:
@@ -211,6 +260,144 @@ class Visitor(MineScriptVisitor):
             elif element.startswith("$"):
                 return self.memory[name][self.memory[element].value]
         
+    def scan_read(self, temp_list, count, temp_result, ctx):
+        # The loop counts the index down to -1, so it never reads the
+        # index variable and every array read shares one loop shape
+        name = f"_loop{self.loops}"
+        self.add_cmd(ir.Call(name), ctx)
+        
+        self.start_loop(name, None, ctx, "array read")
+        self.add_cmd(ir.LoadData(temp_result, f"{temp_list}.value[0]"), ctx)
+        self.add_cmd(ir.DataRemove(f"{temp_list}.value[0]"), ctx)
+        self.add_cmd(ir.Add(count, -1), ctx)
+        self.add_cmd(ir.Call(name), ctx, [ir.Matches(count, None, -1, negate=True)])
+        self.end_loop()
+        
+    def scan_write(self, name, count, size, value, ctx):
+        # Counting the index down, it reaches 0 exactly once, at the
+        # element being replaced
+        temp_list = self.get_temp_var(self.get_type(name))
+        self.set_var(temp_list, Literal([], self.get_type(name)), ctx)
+        lname = f"_loop{self.loops}"
+        self.add_cmd(ir.Call(lname), ctx)
+        
+        self.start_loop(lname, None, ctx, "array write")
+        at_index = [ir.Matches(count, 0, 0)]
+        self.add_cmd(ir.DataModify(f"{temp_list}.value", "append", source=f"{name}.value[0]"), ctx,
+                     [ir.Matches(count, 0, 0, negate=True)])
+        if isinstance(value, Literal):
+            self.add_cmd(ir.DataModify(f"{temp_list}.value", "append", value=value.value), ctx, at_index)
+        else:
+            self.add_cmd(ir.DataModify(f"{temp_list}.value", "append", value=0), ctx, at_index)
+            self.add_cmd(ir.StoreData(f"{temp_list}.value[-1]", value), ctx, at_index)
+        self.add_cmd(ir.DataRemove(f"{name}.value[0]"), ctx)
+        self.add_cmd(ir.Add(count, -1), ctx)
+        self.add_cmd(ir.Add(size, -1), ctx)
+        self.add_cmd(ir.Call(lname), ctx, [ir.Matches(size, None, 0, negate=True)])
+        self.end_loop()
+
+        self.add_cmd(ir.DataModify(f"{name}.value", "set", source=f"{temp_list}.value"), ctx)
+        self.mark_unused(temp_list)
+        
+    def page_snbt(self, pages, first, step=1):
+        # Contents of the compound holding pages first, first+step, ... (the
+        # first one itself, the others below it as element_path finds them)
+        text = f"value:[{','.join(pages[first])}]"
+        for side, child in (("l", first + step), ("r", first + 2*step)):
+            if child < len(pages):
+                text += f",{side}:" + "{" + self.page_snbt(pages, child, 2*step) + "}"
+        return text
+        
+    def element_path(self, name, index):
+        # Storage path of element index of array name: page 0 is the array
+        # itself, and page k > 0 is page (k-1)//2 of l if k is odd, of r if
+        # it's even
+        if not self.page_size or index < 0:
+            return f"{name}.value[{index}]"
+        page, offset = divmod(index, self.page_size)
+        sides = ""
+        while page > 0:
+            page -= 1
+            sides += ".l" if page % 2 == 0 else ".r"
+            page //= 2
+        return f"{name}{sides}.value[{offset}]"
+        
+    def page_index(self, element, ctx):
+        # Temps holding the page element is in and its offset there (None
+        # when pages hold one element)
+        page = self.get_temp_var("int")
+        self.set_var(page, element, ctx)
+        if self.page_size == 1:
+            return page, None
+        self.add_cmd(ir.Operation(page, "/=", self.get_constant(self.page_size)), ctx)
+        offset = self.get_counter(element, ctx)
+        self.add_cmd(ir.Operation(offset, "%=", self.get_constant(self.page_size)), ctx)
+        return page, offset
+        
+    def find_page(self, node, page, ctx, stack=None, sides=None):
+        # Replaces node, a copy of an array, with the compound holding its
+        # page numbered page, one level of the heap per iteration. A write
+        # also pushes the compounds it passed onto stack and the sides it took
+        # onto the bits of sides, for put_page to put them back together
+        lname = f"_loop{self.loops}"
+        self.add_cmd(ir.Call(lname), ctx, [ir.Matches(page, 1, None)])
+        
+        self.start_loop(lname, None, ctx, "page search")
+        side = self.get_temp_var("int")
+        self.add_cmd(ir.Add(page, -1), ctx)
+        self.add_cmd(ir.Operation(side, "=", page), ctx)
+        self.add_cmd(ir.Operation(side, "%=", self.get_constant(2)), ctx)
+        if stack is not None:
+            self.add_cmd(ir.DataModify(f"{stack}.value", "append", source=node), ctx)
+            self.add_cmd(ir.Operation(sides, "+=", sides), ctx)
+            self.add_cmd(ir.Operation(sides, "+=", side), ctx)
+        self.add_cmd(ir.DataModify(node, "set", source=f"{node}.l"), ctx, [ir.Matches(side, 0, 0)])
+        self.add_cmd(ir.DataModify(node, "set", source=f"{node}.r"), ctx, [ir.Matches(side, 0, 0, negate=True)])
+        self.add_cmd(ir.Operation(page, "/=", self.get_constant(2)), ctx)
+        self.add_cmd(ir.Call(lname), ctx, [ir.Matches(page, 1, None)])
+        self.end_loop()
+        self.mark_unused(side)
+        
+    def put_page(self, node, stack, sides, ctx):
+        # Undoes find_page: node goes back into the compound above it until
+        # only the leading 1 of sides is left, and node is the whole array
+        lname = f"_loop{self.loops}"
+        self.add_cmd(ir.Call(lname), ctx, [ir.Matches(sides, 2, None)])
+        
+        self.start_loop(lname, None, ctx, "page update")
+        side = self.get_temp_var("int")
+        self.add_cmd(ir.Operation(side, "=", sides), ctx)
+        self.add_cmd(ir.Operation(side, "%=", self.get_constant(2)), ctx)
+        self.add_cmd(ir.DataModify(f"{stack}.value[-1].l", "set", source=node), ctx, [ir.Matches(side, 0, 0)])
+        self.add_cmd(ir.DataModify(f"{stack}.value[-1].r", "set", source=node), ctx,
+                     [ir.Matches(side, 0, 0, negate=True)])
+        self.add_cmd(ir.DataModify(node, "set", source=f"{stack}.value[-1]"), ctx)
+        self.add_cmd(ir.DataRemove(f"{stack}.value[-1]"), ctx)
+        self.add_cmd(ir.Operation(sides, "/=", self.get_constant(2)), ctx)
+        self.add_cmd(ir.Call(lname), ctx, [ir.Matches(sides, 2, None)])
+        self.end_loop()
+        self.mark_unused(side)
+        
+    def macro_index(self, element, access, ctx):
+        # Runs access, which reaches an array element as value[$(i)], in a
+        # macro function given index element as i: one command wherever the
+        # element is, instead of a loop over the array
+        self.add_cmd(ir.StoreData(f"{MACRO_ARGUMENTS}.i", element), ctx)
+        body = self.start_block("_index", ctx)
+        self.add_cmd(access, ctx)
+        self.end_block()
+        self.add_cmd(ir.Call(body, MACRO_ARGUMENTS), ctx)
+        self.mark_unused(element)
+        self.optimizations["macro index"] += 1
+        
+    def get_counter(self, element, ctx):
+        # A temp holding the index element that the caller may count down
+        if element in self.tempvars:
+            return element
+        count = self.get_temp_var("int")
+        self.set_var(count, element, ctx)
+        return count
+        
     def set_arr_element(self, name, element, value, ctx):
         if self.get_type(element) != "int":
                 line = ctx.start.line
@@ -220,55 +407,54 @@ class Visitor(MineScriptVisitor):
         if not name.startswith("$"):
             if isinstance(element, Literal):
                 if isinstance(value, Literal):
-                    self.add_cmd(f"data modify storage {self.name}:minescript {name}.value[{element.value}] value {value.value}", ctx)
+                    self.add_cmd(ir.DataModify(self.element_path(name, element.value), "set", value=value.value), ctx)
                 else:
-                    self.add_cmd(f"execute store result storage {self.name}:minescript {name}.value[{element.value}] run "
-                                f"scoreboard objectives get #MineScript {value}", ctx)
-            else:
-                temp_list = self.get_temp_var(self.get_type(name))
-                count = self.get_temp_var("int")
-                done = self.get_temp_var("int")
-                size = self.get_temp_var("int")
-                self.add_cmd(f"execute store result score #MineScript {size} run "
-                            f"data get storage {self.name}:minescript {name}.size", ctx)
-                self.set_var(count, Literal(0, "int"), ctx)
-                self.set_var(done, Literal(0, "int"), ctx)
-                self.set_var(temp_list, Literal([], self.get_type(name)), ctx)
-                lname = f"_loop{self.loops}"
-                self.add_cmd(f"function {self.name}:{lname}", ctx)
-                
-                self.start_loop(lname, None)
-                self.add_cmd(f"execute unless score #MineScript {count} = #MineScript {element} run "
-                            f"data modify storage {self.name}:minescript {temp_list}.value append from storage "
-                            f"{self.name}:minescript {name}.value[0]", ctx)
+                    self.add_cmd(ir.StoreData(self.element_path(name, element.value), value), ctx)
+            elif self.macros:
                 if isinstance(value, Literal):
-                    self.add_cmd(f"execute if score #MineScript {count} = #MineScript {element} "
-                                f"if score #MineScript {done} matches 0 run "
-                                f"data modify storage {self.name}:minescript {temp_list}.value append "
-                                f"value {value.value}", ctx)
+                    access = ir.DataModify(f"{name}.value[$(i)]", "set", value=value.value)
                 else:
-                    self.add_cmd(f"execute if score #MineScript {count} = #MineScript {element} "
-                                f"if score #MineScript {done} matches 0 run "
-                                f"data modify storage {self.name}:minescript {temp_list}.value append value 0", ctx)
-                    self.add_cmd(f"execute if score #MineScript {count} = #MineScript {element} "
-                                f"if score #MineScript {done} matches 0 run "
-                                f"execute store result storage {self.name}:minescript {temp_list}.value[-1] int 1 run "
-                                f"scoreboard players get #MineScript {value}", ctx)
-                self.add_cmd(f"execute if score #MineScript {count} = #MineScript {element} "
-                            f"if score #MineScript {done} matches 0 run "
-                            f"scoreboard players set #MineScript {done} 1", ctx)
-                self.add_cmd(f"data remove storage {self.name}:minescript {name}.value[0]", ctx)
-                self.add_cmd(f"scoreboard players add #MineScript {count} 1", ctx)
-                self.add_cmd(f"execute unless score #MineScript {count} >= #MineScript {size} run "
-                            f"function {self.name}:{lname}", ctx)
-                self.end_loop()
-
-                self.add_cmd(f"data modify storage {self.name}:minescript {name}.value set from " 
-                            f"storage {self.name}:minescript {temp_list}.value", ctx)
-                self.mark_unused(temp_list)
+                    access = ir.StoreData(f"{name}.value[$(i)]", value)
+                self.macro_index(element, access, ctx)
+                if isinstance(value, str):
+                    self.mark_unused(value)
+            elif self.page_size:
+                # Only the page holding the element is rebuilt
+                node = self.get_temp_var(self.get_type(name))
+                stack = self.get_temp_var(self.get_type(name))
+                sides = self.get_temp_var("int")
+                self.set_var(node, name, ctx)
+                page, offset = self.page_index(element, ctx)
+                self.set_var(stack, Literal([], self.get_type(name)), ctx)
+                self.add_cmd(ir.Set(sides, 1), ctx)
+                self.find_page(node, page, ctx, stack, sides)
+                if offset is None:
+                    if isinstance(value, Literal):
+                        self.add_cmd(ir.DataModify(f"{node}.value[0]", "set", value=value.value), ctx)
+                    else:
+                        self.add_cmd(ir.StoreData(f"{node}.value[0]", value), ctx)
+                else:
+                    size = self.get_temp_var("int")
+                    self.add_cmd(ir.Set(size, self.page_size), ctx)
+                    self.scan_write(node, offset, size, value, ctx)
+                    self.mark_unused(offset)
+                    self.mark_unused(size)
+                self.put_page(node, stack, sides, ctx)
+                self.add_cmd(ir.DataModify(name, "set", source=node), ctx)
+                self.mark_unused(node)
+                self.mark_unused(stack)
+                self.mark_unused(sides)
+                self.mark_unused(page)
+                if isinstance(value, str):
+                    self.mark_unused(value)
+                self.optimizations["paged index"] += 1
+            else:
+                count = self.get_counter(element, ctx)
+                size = self.get_temp_var("int")
+                self.add_cmd(ir.LoadData(size, f"{name}.size"), ctx)
+                self.scan_write(name, count, size, value, ctx)
                 self.mark_unused(count)
                 self.mark_unused(size)
-                self.mark_unused(done)
                 if isinstance(value, str):
                     self.mark_unused(value)
         else:
@@ -297,147 +483,361 @@ class Visitor(MineScriptVisitor):
         name = f"_var{n}"
         self.add_var(name, type_)
         self.tempvars.add(name)
-        self.usedvars.add(name)
         return name
     
+    def get_constant(self, value):
+        # Slot holding value, set once by _vars, for use as an operand
+        name = ir.constant(value)
+        if name not in self.constants:
+            self.constants[name] = value
+            self.add_var(name, "int")
+        self.constant_uses[name] += 1
+        return name
+    
+    def release_constant(self, name):
+        # An operand that was folded away; constants nothing uses aren't set
+        self.constant_uses[name] -= 1
+        if self.constant_uses[name] == 0:
+            del self.constants[name]
+            del self.igmemory[name]
+    
     def mark_unused(self, name):
         if name.startswith("_var") and name in self.tempvars:
             self.tempvars.remove(name)
     
-    def add_cmd(self, command, ctx):
-        if len(self.prefixes) != 0:
-            command = "execute " + " ".join(self.prefixes) + " run " + command
+    def get_code(self):
         if self.loop != []:
-            self.igloops[self.loop[-1]].append(command)
+            return self.igloops[self.loop[-1]]
         elif self.igfunc is not None:
-            self.igfunctions[self.igfunc]["code"].append(command)
+            return self.igfunctions[self.igfunc]["code"]
+        return None
+    
+    def get_prefixes(self):
+        return [prefix for prefix in self.prefixes if prefix not in self.dormant]
+    
+    def add_cmd(self, instruction, ctx, conditions=()):
+        instruction.conditions = self.get_prefixes() + list(conditions)
+        if ctx is not None:
+            instruction.line = ctx.start.line
+            instruction.column = ctx.start.column
+        code = self.get_code()
+        if code is not None:
+            code.append(instruction)
         else:
             line = ctx.start.line
             char = ctx.start.column
             self.logger.log("All code must reside inside a function", line, char, "error")
             raise CompileTimeException()
             
-    def start_loop(self, name, break_var):
+    def start_loop(self, name, break_var, ctx=None, kind="loop", trips=None):
         self.igloops[name] = []
+        self.igloopinfo[name] = {
+            "kind": kind,
+            "trips": trips,
+            "line": ctx.start.line if ctx is not None else -1,
+            "column": ctx.start.column if ctx is not None else -1
+        }
         self.loop.append(name)
         self.break_var.append(break_var)
         if break_var is not None:
-            self.prefixes.append(f"unless score #MineScript {break_var} matches 0")
+            self.prefixes.append(ir.Matches(break_var, 0, 0, negate=True))
+            self.dormant.add(self.prefixes[-1])
         self.loops += 1
         
     def end_loop(self):
         self.loop.pop(-1)
         bv = self.break_var.pop(-1)
         if bv is not None:
-            self.prefixes.pop(-1)
+            self.dormant.discard(self.prefixes.pop(-1))
             self.mark_unused(bv)        
             
-    def compare(self, expr1, expr2, op, ctx):
+    def start_block(self, prefix, ctx):
+        # A body of its own for code that runs once per call; breaks in it
+        # still belong to the loop around it
+        name = f"{prefix}{self.blocks}"
+        self.igloops[name] = []
+        self.igloopinfo[name] = {
+            "kind": "block",
+            "trips": None,
+            "line": ctx.start.line,
+            "column": ctx.start.column
+        }
+        self.loop.append(name)
+        self.blocks += 1
+        return name
+        
+    def end_block(self):
+        self.loop.pop(-1)
+            
+    def comparison(self, expr1, expr2, op, ctx):
+        # The execute condition under which 'expr1 op expr2' holds, or a
+        # Literal if that's known at compile time
         self.assert_types_match(expr1, expr2, ctx)
         if self.at_compile_time(expr1) and self.at_compile_time(expr2):
-            return Literal(eval(f"self.get_value(expr1){op}self.get_value(expr2)"), "int")
+            if self.get_type(expr1).endswith("[]"):
+                return Literal(int(eval(f"self.get_value(expr1){op}self.get_value(expr2)")), "int")
+            return Literal(int(eval(f"self.get_number(expr1){op}self.get_number(expr2)")), "int")
         elif isinstance(expr1, str) and self.at_compile_time(expr2):
-            temp_result = self.get_temp_var("int")
-            self.set_var(temp_result, Literal(0, "int"), ctx)
+            value = self.get_number(expr2)
             if op == "==":
-                self.add_cmd(f"execute if score #MineScript {expr1} matches {self.get_value(expr2)} run scoreboard players set #MineScript {temp_result} 1", ctx)
+                return ir.Matches(expr1, value, value)
             elif op == "<=":
-                self.add_cmd(f"execute if score #MineScript {expr1} matches ..{self.get_value(expr2)} run scoreboard players set #MineScript {temp_result} 1", ctx)
+                return ir.Matches(expr1, None, value)
             elif op == ">=":
-                self.add_cmd(f"execute if score #MineScript {expr1} matches {self.get_value(expr2)}.. run scoreboard players set #MineScript {temp_result} 1", ctx)
+                return ir.Matches(expr1, value, None)
             elif op == "<":
-                self.add_cmd(f"execute unless score #MineScript {expr1} matches {self.get_value(expr2)}.. run scoreboard players set #MineScript {temp_result} 1", ctx)
+                return ir.Matches(expr1, value, None, negate=True)
             elif op == ">":
-                self.add_cmd(f"execute unless score #MineScript {expr1} matches ..{self.get_value(expr2)} run scoreboard players set #MineScript {temp_result} 1", ctx)
+                return ir.Matches(expr1, None, value, negate=True)
             elif op == "!=":
-                self.add_cmd(f"execute if score #MineScript {expr1} matches {self.get_value(expr2)} run scoreboard players set #MineScript {temp_result} 1", ctx)
-            self.mark_unused(expr1)
-            return temp_result
+                return ir.Matches(expr1, value, value, negate=True)
                         
         elif isinstance(expr2, str) and self.at_compile_time(expr1):
-            if op == "==" or op == "!=": newop = op
-            elif op == ">=": newop = "<="
-            elif op == "<=": newop = ">="
-            elif op == ">": newop = "<"
-            elif op =="<": newop = ">"
-            return self.compare(expr2, expr1, newop, ctx)
+            return self.comparison(expr2, expr1, analysis.FLIPPED[op], ctx)
+        
+        elif expr1 == expr2:
+            # A variable against itself
+            self.optimizations["algebraic simplification"] += 2
+            return Literal(int(op in ("==", "<=", ">=")), "int")
         
         elif isinstance(expr1, str) and isinstance(expr2, str):
-            temp_result = self.get_temp_var("int")
-            self.set_var(temp_result, Literal(0, "int"), ctx)
             if op != "==" and op != "!=":
-                self.add_cmd(f"execute if score #MineScript {expr1} {op} #MineScript {expr2} run scoreboard players set #MineScript {temp_result} 1", ctx)
+                return ir.Compare(expr1, op, expr2)
             elif op == "==":
-                self.add_cmd(f"execute if score #MineScript {expr1} = #MineScript {expr2} run scoreboard players set #MineScript {temp_result} 1", ctx)
+                return ir.Compare(expr1, "=", expr2)
             else:
-                self.add_cmd(f"execute unless score #MineScript {expr1} = #MineScript {expr2} run scoreboard players set #MineScript {temp_result} 1", ctx)
-            self.mark_unused(expr1)
-            self.mark_unused(expr2)
-            return temp_result
+                return ir.Compare(expr1, "=", expr2, negate=True)
+    
+    def compare(self, expr1, expr2, op, ctx):
+        condition = self.comparison(expr1, expr2, op, ctx)
+        if condition is None or isinstance(condition, Literal):
+            return condition
+        temp_result = self.get_temp_var("int")
+        self.add_cmd(ir.Test(temp_result, condition), ctx)
+        self.release_condition(condition)
+        return temp_result
+    
+    def release_condition(self, condition):
+        if isinstance(condition, str):
+            self.mark_unused(condition)
+        elif condition is not None and not isinstance(condition, Literal):
+            for slot in condition.reads():
+                self.mark_unused(slot)
+    
+    def visit_condition(self, expr, guarded=None):
+        # Lowers the condition of a control flow statement. A single
+        # comparison becomes the execute check itself instead of a 0/1 temp;
+        # anything else gives its value as usual. The comparison is tested
+        # before and while the guarded statements run, so it reads variables
+        # in place only if those can't write them, and copies them otherwise
+        comparison = analysis.unwrap(expr)
+        if not isinstance(comparison, MineScriptParser.VariableComparisonContext):
+            return self.visit(expr)
+        operands = []
+        for index, operand in enumerate(comparison.expr()):
+            # Both the guarded statements and the right hand side run after
+            # the left hand side is read
+            written = set()
+            for ctx in list(guarded or ()) + comparison.expr()[index+1:]:
+                assigned = analysis.assigned_variables(ctx, self.declarations)
+                if assigned is None:
+                    written = None
+                    break
+                written |= assigned
+            value = self.visit(operand)
+            name = analysis.variable_name(operand)
+            if name is not None and (written is None or name in written):
+                value = self.get_result_var(value, operand)
+            operands.append(value)
+        if guarded is not None and operands[0] != operands[1]:
+            # Function results, read once both sides are evaluated as a 0/1
+            # temp would
+            for index, value in enumerate(operands):
+                if isinstance(value, str) and value.startswith("_f_"):
+                    operands[index] = self.get_result_var(value, comparison)
+        condition = self.comparison(*operands, comparison.type_.text, comparison)
+        if condition is not None and not isinstance(condition, Literal):
+            self.optimizations["fused conditions"] += 1
+        return condition
+    
+    def loop_condition(self, expr):
+        # Condition a loop's (re)entry call runs under; nothing runs between
+        # testing it and the call
+        condition = self.visit_condition(expr)
+        if isinstance(condition, str):
+            return ir.Matches(condition, 0, 0, negate=True)
+        return condition
+    
+    def fold(self, value1, value2, op):
+        # What the scoreboard operation computes (floored division, a zero
+        # divisor leaving the value as it was), wrapped to 32 bits
+        if op == "+":
+            result = value1 + value2
+        elif op == "-":
+            result = value1 - value2
+        elif op == "*":
+            result = value1 * value2
+        elif op == "/":
+            result = value1 // value2 if value2 != 0 else value1
+        elif op == "%":
+            result = value1 % value2 if value2 != 0 else value1
+        return (result + 2**31) % 2**32 - 2**31
+    
+    def get_result_var(self, expr, ctx):
+        # Temp to compute into, holding expr's value: expr itself if it's a
+        # temp, as nothing else reads it after this
+        if expr in self.tempvars:
+            self.optimizations["algebraic simplification"] += 1
+            return expr
+        temp_result = self.get_temp_var(self.get_type(expr))
+        self.set_var(temp_result, expr, ctx)
+        return temp_result
+    
+    def set_result(self, name, value, ctx):
+        # set_var for the value of an expression, when nothing reads that
+        # value afterwards: a temp computed just now is computed in name instead
+        if (isinstance(value, str) and value in self.tempvars and not name.startswith("$")
+                and not self.get_type(value).endswith("[]") and self.retarget(value, name)):
+            self.optimizations["destination-driven assignment"] += 1
+            return
+        # An array literal is written straight into name instead of a copy
+        code = self.get_code()
+        if (isinstance(value, str) and value in self.tempvars and not name.startswith("$")
+                and self.get_type(value).endswith("[]") and code and isinstance(code[-1], ir.DataModify)
+                and code[-1].path == value and code[-1].mode == "set" and code[-1].source is None
+                and code[-1].conditions == self.get_prefixes()):
+            code[-1].path = name
+            self.optimizations["destination-driven assignment"] += 1
+            return
+        self.set_var(name, value, ctx)
+    
+    def retarget(self, temp, dest):
+        # Renames temp to dest from the last instruction that sets all of temp
+        # onwards, if those run under the current prefixes and don't otherwise
+        # touch dest
+        code = self.get_code()
+        prefixes = self.get_prefixes()
+        if code is None or any(dest in prefix.reads() for prefix in prefixes):
+            return False
+        for index in range(len(code)-1, -1, -1):
+            instruction = code[index]
+            if isinstance(instruction, ir.Call) or instruction.conditions != prefixes:
+                return False
+            copy = isinstance(instruction, ir.Operation) and instruction.op == "="
+            if temp in instruction.writes() and (copy or isinstance(instruction, (ir.Set, ir.LoadData, ir.Test))):
+                if dest in instruction.reads() and not copy:
+                    return False
+                break
+            if dest in instruction.reads() or dest in instruction.writes():
+                return False
+        else:
+            return False
+        for instruction in code[index:]:
+            instruction.rename({temp: dest})
+        if copy and code[index].source == dest:
+            del code[index]
+        return True
+    
+    def get_last_cmd(self, dest):
+        # The last instruction so far, if it wrote dest under the current prefixes
+        code = self.get_code()
+        if code and dest in code[-1].writes() and code[-1].conditions == self.get_prefixes():
+            return code[-1]
+        return None
+    
+    def add_constant(self, temp_result, value, ctx):
+        # temp_result += value, merged into an addition just before it
+        last = self.get_last_cmd(temp_result)
+        if isinstance(last, ir.Add):
+            last.value = self.fold(last.value, value, "+")
+            self.optimizations["algebraic simplification"] += 1
+            if last.value == 0:
+                self.get_code().pop()
+                self.optimizations["algebraic simplification"] += 1
+        else:
+            self.add_cmd(ir.Add(temp_result, value), ctx)
+    
+    def multiply_constant(self, temp_result, value, ctx):
+        # temp_result *= value, merged into a multiplication just before it
+        last = self.get_last_cmd(temp_result)
+        if isinstance(last, ir.Operation) and last.op == "*=" and ir.is_constant(last.source):
+            self.release_constant(last.source)
+            last.source = self.get_constant(self.fold(ir.constant_value(last.source), value, "*"))
+            self.optimizations["algebraic simplification"] += 1
+        elif value == 2:
+            # An addition needs no constant
+            self.add_cmd(ir.Operation(temp_result, "+=", temp_result), ctx)
+        else:
+            self.add_cmd(ir.Operation(temp_result, "*=", self.get_constant(value)), ctx)
     
     def operate(self, expr1, expr2, op, ctx):
         self.assert_types_match(expr1, expr2, ctx)
         
         if self.at_compile_time(expr1) and self.at_compile_time(expr2):
-            return Literal(eval(f"self.get_value(expr1){op}self.get_value(expr2)"), self.get_type(expr1))
+            if self.get_type(expr1).endswith("[]"):
+                return Literal(eval(f"self.get_value(expr1){op}self.get_value(expr2)"), self.get_type(expr1))
+            return Literal(self.fold(self.get_number(expr1), self.get_number(expr2), op), self.get_type(expr1))
         
         elif isinstance(expr1, str) and self.at_compile_time(expr2):
-            temp_result = self.get_temp_var(self.get_type(expr2))
+            value = self.get_number(expr2)
+            if (op in ("+", "-") and value == 0) or (op in ("*", "/") and value == 1):
+                # Still a copy of a variable, as the rest of the expression may change it
+                self.optimizations["algebraic simplification"] += 1
+                return self.get_result_var(expr1, ctx)
+            if (op == "*" and value == 0) or (op == "%" and value in (1, -1)):
+                self.optimizations["algebraic simplification"] += 2
+                self.mark_unused(expr1)
+                return Literal(0, self.get_type(expr1))
+            temp_result = self.get_result_var(expr1, ctx)
             if op == "+":
-                self.set_var(temp_result, expr1, ctx)
-                self.add_cmd(f"scoreboard players add #MineScript {temp_result} {self.get_value(expr2)}", ctx)
+                self.add_constant(temp_result, value, ctx)
             elif op == "-":
-                self.set_var(temp_result, expr1, ctx)
-                self.add_cmd(f"scoreboard players remove #MineScript {temp_result} {self.get_value(expr2)}", ctx)
+                self.add_constant(temp_result, -value, ctx)
             elif op == "*":
-                self.set_var(temp_result, expr2, ctx)
-                self.add_cmd(f"scoreboard players operation #MineScript {temp_result} *= #MineScript {expr1}", ctx)
-            elif op == "/":
-                temp_var = self.get_temp_var(self.get_type(expr2))
-                self.set_var(temp_var, expr2, ctx)
-                self.set_var(temp_result, expr1, ctx)
-                self.add_cmd(f"scoreboard players operation #MineScript {temp_result} /= #MineScript {temp_var}", ctx)
-                self.mark_unused(temp_var)
-            elif op == "%":
-                temp_var = self.get_temp_var(self.get_type(expr2))
-                self.set_var(temp_var, expr2, ctx)
-                self.set_var(temp_result, expr1, ctx)
-                self.add_cmd(f"scoreboard players operation #MineScript {temp_result} %= #MineScript {temp_var}", ctx)
-                self.mark_unused(temp_var)
-            self.mark_unused(expr1)
+                self.multiply_constant(temp_result, value, ctx)
+            elif op == "/" or op == "%":
+                self.add_cmd(ir.Operation(temp_result, f"{op}=", self.get_constant(value)), ctx)
             return temp_result
                         
         elif isinstance(expr2, str) and self.at_compile_time(expr1):
             if op == "+" or op == "*":
                 return self.operate(expr2, expr1, op, ctx)
+            elif op in ("/", "%") and self.get_number(expr1) == 0:
+                self.optimizations["algebraic simplification"] += 2
+                self.mark_unused(expr2)
+                return Literal(0, self.get_type(expr1))
             else:
                 temp_result = self.get_temp_var(self.get_type(expr1))
-                if op == "-":
-                    self.set_var(temp_result, expr1, ctx)
-                    self.add_cmd(f"scoreboard players operation #MineScript {temp_result} -= #MineScript {expr2}", ctx)
-                elif op == "/":
-                    temp_var = self.get_temp_var(self.get_type(expr1))
-                    self.set_var(temp_var, expr1, ctx)
-                    self.set_var(temp_result, expr2, ctx)
-                    self.add_cmd(f"scoreboard players operation #MineScript {temp_result} /= #MineScript {temp_var}", ctx)
-                    self.mark_unused(temp_var)
-                elif op == "%":
-                    temp_var = self.get_temp_var(self.get_type(expr1))
-                    self.set_var(temp_var, expr1, ctx)
-                    self.set_var(temp_result, expr2, ctx)
-                    self.add_cmd(f"scoreboard players operation #MineScript {temp_result} %= #MineScript {temp_var}", ctx)
-                    self.mark_unused(temp_var)
+                self.set_var(temp_result, expr1, ctx)
+                self.add_cmd(ir.Operation(temp_result, f"{op}=", expr2), ctx)
                 self.mark_unused(expr2)
                 return temp_result
         
+        elif expr1 == expr2 and op in ("-", "%"):
+            # x - x and x % x (a zero divisor leaves 0 as it is)
+            self.optimizations["algebraic simplification"] += 2
+            return Literal(0, self.get_type(expr1))
+        
         elif isinstance(expr1, str) and isinstance(expr2, str):
-            temp_result = self.get_temp_var(self.get_type(expr1))
-            self.set_var(temp_result, expr1, ctx)
-            self.add_cmd(f"scoreboard players operation #MineScript {temp_result} {op}= #MineScript {expr2}", ctx)
-            self.mark_unused(expr1)
+            if op in ("+", "*") and expr2 in self.tempvars and expr1 not in self.tempvars:
+                expr1, expr2 = expr2, expr1
+            temp_result = self.get_result_var(expr1, ctx)
+            self.add_cmd(ir.Operation(temp_result, f"{op}=", expr2), ctx)
             self.mark_unused(expr2)
             return temp_result
-        
+
+    def visitStat(self, ctx):
+        if not ctx.stat():
+            return self.visitChildren(ctx)
+        # A block stops at its first statement that always returns or breaks
+        stats = analysis.reachable(ctx.stat())
+        for stat in stats:
+            self.visit(stat)
+        if len(stats) < len(ctx.stat()):
+            unreachable = ctx.stat()[len(stats)]
+            self.logger.log("Unreachable code", unreachable.start.line, unreachable.start.column, "warning")
+            self.optimizations["unreachable statement"] += len(ctx.stat()) - len(stats)
+
     def visitParentheses(self, ctx):
         return self.visit(ctx.expr())
             
@@ -455,7 +855,7 @@ class Visitor(MineScriptVisitor):
             if l is not None:
                 value = self.visit(l)
                 self.assert_types_match(value, name, l)
-                self.set_var(name+suffix, value, ctx)
+                self.set_result(name+suffix, value, ctx)
                 if isinstance(value, str):
                     self.mark_unused(value)                
                     
@@ -469,7 +869,7 @@ class Visitor(MineScriptVisitor):
             value = self.visit(ctx.expr())
             if ctx.arr() is None:
                 self.assert_types_match(name, value, ctx)
-                self.set_var(name+suffix, value, ctx)
+                self.set_result(name+suffix, value, ctx)
             else:
                 element = self.visit(ctx.arr().expr())
                 if not name.startswith("$"):
@@ -515,19 +915,34 @@ class Visitor(MineScriptVisitor):
                     
     def visitFunctionDeclaration(self, ctx):
         name = ctx.WORD().getText()
+        if self.igfunc is not None:
+            line = ctx.start.line
+            char = ctx.start.column
+            self.logger.log(f"Nested functions not supported ('{name}' inside '{self.igfunc}')", line, char, "error")
+            raise CompileTimeException()
+        if name not in self.igfunctions:
+            line = ctx.start.line
+            char = ctx.start.column
+            self.logger.log(f"Function '{name}' must be declared at the top level", line, char, "error")
+            raise CompileTimeException()
         self.igfunc = name
         self.local[self.igfunc] = {}
         
         for arg in self.igfunctions[name]["args"]:
             self.add_var(arg[0], arg[1])
         
-        self.add_var(f"_break_{name}", "int")
-        self.igfuncinfo = {"break": f"_break_{name}"}
-        self.set_var(f"_break_{name}", Literal(0, "int"), ctx)
+        # Only a function that can return early needs a flag to skip the rest
+        self.igfuncinfo = {"break": None, "tails": analysis.tail_returns(ctx.stat())}
+        if analysis.early_returns(ctx):
+            self.add_var(f"_break_{name}", "int")
+            self.igfuncinfo["break"] = f"_break_{name}"
+            self.set_var(f"_break_{name}", Literal(0, "int"), ctx)
+            self.prefixes.append(ir.Matches(self.igfuncinfo["break"], 1, 1, negate=True))
+            self.dormant.add(self.prefixes[-1])
         
-        self.prefixes.append(f"unless score #MineScript {self.igfuncinfo['break']} matches 1")
         self.visit(ctx.stat())
-        self.prefixes.pop(-1)
+        if self.igfuncinfo["break"] is not None:
+            self.dormant.discard(self.prefixes.pop(-1))
         self.igfuncinfo = None
         self.igfunc = None
         
@@ -539,6 +954,7 @@ class Visitor(MineScriptVisitor):
             self.logger.log(f"Undefined function '{name}'", line, char, "error")
             raise CompileTimeException()
         else:
+            self.called.add(name)
             args = []
             for expr in ctx.expr():
                 args.append((self.visit(expr), expr.start.line, expr.start.column))
@@ -558,8 +974,10 @@ class Visitor(MineScriptVisitor):
                         self.logger.log(msg, args[i][1], args[i][2], "error")
                         raise CompileTimeException()
                     else:
-                        self.set_var(fargs[i][0]+"+local", args[i][0], ctx)
-                self.add_cmd(f"function {self.name}:{name}", ctx)
+                        self.set_result(fargs[i][0]+"+local", args[i][0], ctx)
+                        if isinstance(args[i][0], str):
+                            self.mark_unused(args[i][0])
+                self.add_cmd(ir.Call(name), ctx)
 
             if "return" in self.igfunctions[name]:
                 return self.igfunctions[name]["return"]
@@ -581,8 +999,8 @@ class Visitor(MineScriptVisitor):
                     value = self.visit(ctx.expr())
                     self.assert_types_match(self.igfunctions[self.igfunc]["return"], value, ctx.expr())
  
-                    self.set_var(self.igfunctions[self.igfunc]["return"], value, ctx)
-                    self.add_cmd(f"scoreboard players set #MineScript {self.igfuncinfo['break']} 1", ctx)
+                    self.set_result(self.igfunctions[self.igfunc]["return"], value, ctx)
+                    self.exit_function(ctx)
                     
                     if isinstance(value, str):
                         self.mark_unused(value)
@@ -593,8 +1011,16 @@ class Visitor(MineScriptVisitor):
                     self.logger.log("Void function returns a value", line, char, "error")
                     raise CompileTimeException()
                 else:
-                    self.add_cmd(f"scoreboard players set #MineScript {self.igfuncinfo['break']} 1", ctx)
+                    self.exit_function(ctx)
                     
+    def exit_function(self, ctx):
+        # Nothing runs after a return in tail position; any other sets the
+        # flag, and everything from here on in the function has to test it
+        if ctx in self.igfuncinfo["tails"]:
+            return
+        self.add_cmd(ir.Set(self.igfuncinfo["break"], 1), ctx)
+        self.dormant.discard(ir.Matches(self.igfuncinfo["break"], 1, 1, negate=True))
+        
     def visitLiteral(self, ctx):
         if ctx.CHAR() is not None:
             return Literal(eval(f"ord({ctx.CHAR().getText()})"), "char")
@@ -613,7 +1039,7 @@ class Visitor(MineScriptVisitor):
         if used: 
             temp_result = self.get_temp_var(self.get_type(name))
             self.set_var(temp_result, name+suffix, ctx)
-        self.add_cmd(f"scoreboard players add #MineScript {name}{suffix} 1", ctx)
+        self.add_cmd(ir.Add(name+suffix, 1), ctx)
         if used:
             return temp_result
         
@@ -623,7 +1049,7 @@ class Visitor(MineScriptVisitor):
         self.assert_is_defined(name, ctx)
         
         suffix = "" if self.igfunc is None or name not in self.local[self.igfunc] else "+local" 
-        self.add_cmd(f"scoreboard players add #MineScript {name}{suffix} 1", ctx)
+        self.add_cmd(ir.Add(name+suffix, 1), ctx)
         return name+suffix
         
     def visitVariableDecrementPos(self, ctx):
@@ -636,7 +1062,7 @@ class Visitor(MineScriptVisitor):
         if used: 
             temp_result = self.get_temp_var(self.get_type(name))
             self.set_var(temp_result, name+suffix, ctx)
-        self.add_cmd(f"scoreboard players remove #MineScript {name}{suffix} 1", ctx)
+        self.add_cmd(ir.Add(name+suffix, -1), ctx)
         if used:
             return temp_result
         
@@ -646,7 +1072,7 @@ class Visitor(MineScriptVisitor):
         self.assert_is_defined(name, ctx)
         
         suffix = "" if self.igfunc is None or name not in self.local[self.igfunc] else "+local" 
-        self.add_cmd(f"scoreboard players remove #MineScript {name}{suffix} 1", ctx)
+        self.add_cmd(ir.Add(name+suffix, -1), ctx)
         return name
             
     def visitVariableComparison(self, ctx):
@@ -664,22 +1090,108 @@ class Visitor(MineScriptVisitor):
             return self.operate(expr1, expr2, ctx.type_.text, ctx)
             
     def visitIfStatement(self, ctx):
-        condition = self.visit(ctx.expr())
+        switch = analysis.switch_cases(ctx)
+        if switch is not None and len(switch[1]) >= SWITCH_THRESHOLD and self.get_code() is not None:
+            variable, cases, otherwise = switch
+            value = self.visit(variable)
+            if self.get_type(value) == "int":
+                self.visit_switch(value, variable, cases, otherwise, ctx)
+                return
+        condition = self.visit_condition(ctx.expr(), ctx.stat())
         if isinstance(condition, str):
-            self.prefixes.append(f"if score #MineScript {condition} matches 1")
+            condition = ir.Matches(condition, 1, 1)
+        if not isinstance(condition, Literal):
+            self.prefixes.append(condition)
             self.visit(ctx.stat(0))
             self.prefixes.pop(-1)
             if len(ctx.stat()) > 1:
-                self.prefixes.append(f"unless score #MineScript {condition} matches 1")
+                self.prefixes.append(condition.inverted())
                 self.visit(ctx.stat(1))
                 self.prefixes.pop(-1)
-            self.mark_unused(condition)
+            self.release_condition(condition)
         else:
             if condition.value:
                 self.visit(ctx.stat(0))
             elif len(ctx.stat()) > 1:
                 self.visit(ctx.stat(1))
 
+    def visit_switch(self, value, variable, cases, otherwise, ctx):
+        # 'if (v == a) ... else if (v == b) ...' as a binary search over the
+        # literals: every branch is a body of its own, and each step tests
+        # which half of the remaining ones v is in and calls the code for
+        # it, so a chain of n branches runs about 2*log2(n) tests instead
+        # of one per branch (and one per command in each branch)
+        statements = [stat for _, stat in cases] + ([otherwise] if otherwise is not None else [])
+        written = set()
+        for stat in statements:
+            assigned = analysis.assigned_variables(stat, self.declarations)
+            if assigned is None:
+                written = None
+                break
+            written |= assigned
+        if written is None or analysis.variable_name(variable) in written:
+            value = self.get_result_var(value, variable)
+        bodies = []
+        for stat in statements:
+            bodies.append(self.start_block("_switch", stat))
+            self.visit(stat)
+            self.end_block()
+        default = bodies.pop() if otherwise is not None else None
+        cases = sorted(zip([case for case, _ in cases], bodies))
+        self.dispatch(value, cases, None, None, default, ctx)
+        # Bodies of one command were copied where they run
+        for body in bodies + [default]:
+            if body is not None and self.inlinable(body):
+                del self.igloops[body]
+                del self.igloopinfo[body]
+        self.optimizations["switch dispatch"] += 1
+        if value in self.tempvars:
+            self.mark_unused(value)
+        
+    def dispatch(self, value, cases, low, high, default, ctx):
+        # Runs the body of the case value is, given it's in low..high (None
+        # is unbounded); without a default, only the cases' values matter
+        if len(cases) == 1:
+            (case, body), = cases
+            self.run_body(body, [ir.Matches(value, case, case)], ctx)
+            # The default runs for the rest of low..high
+            if default is not None and (low, high) != (case, case):
+                if low == case:
+                    conditions = [ir.Matches(value, case + 1, high)]
+                elif high == case:
+                    conditions = [ir.Matches(value, low, case - 1)]
+                else:
+                    conditions = [ir.Matches(value, low, high)] if (low, high) != (None, None) else []
+                    conditions.append(ir.Matches(value, case, case, negate=True))
+                self.run_body(default, conditions, ctx)
+            return
+        middle = len(cases) // 2
+        if default is not None:
+            halves = [(cases[:middle], low, cases[middle][0] - 1), (cases[middle:], cases[middle][0], high)]
+        else:
+            halves = [(cases[:middle], cases[0][0], cases[middle-1][0]), (cases[middle:], cases[middle][0], cases[-1][0])]
+        for half, half_low, half_high in halves:
+            if len(half) == 1:
+                self.dispatch(value, half, half_low, half_high, default, ctx)
+                continue
+            name = self.start_block("_switch", ctx)
+            self.dispatch(value, half, half_low, half_high, default, ctx)
+            self.end_block()
+            self.add_cmd(ir.Call(name), ctx, [ir.Matches(value, half_low, half_high)])
+            
+    def inlinable(self, body):
+        code = self.igloops[body]
+        return len(code) == 0 or len(code) == 1 and not isinstance(code[0], ir.Test)
+        
+    def run_body(self, body, conditions, ctx):
+        if not self.inlinable(body):
+            self.add_cmd(ir.Call(body), ctx, conditions)
+            return
+        for instruction in self.igloops[body]:
+            instruction = copy.copy(instruction)
+            instruction.conditions = instruction.conditions + conditions
+            self.get_code().append(instruction)
+        
     def visitForStatement(self, ctx):
         if len(ctx.expr()) == 3:
             init, condition, update = ctx.expr()
@@ -687,59 +1199,128 @@ class Visitor(MineScriptVisitor):
             init = ctx.variableDeclaration()
             condition, update = ctx.expr()
         init_value = self.visit(init)
+        
+        # Variables the body declares are declared again by every copy of it
+        declared = set(self.local[self.igfunc]) if self.igfunc is not None else set()
+        trips = analysis.trip_count(analysis.loop_bounds(ctx, self.declarations))
+        copies = 1
+        quiet = self.logger.quiet
+        # A loop left early would still run the rest of its copies, if only to skip them
+        if trips is not None and self.igfunc is not None and self.unroll_threshold > 0 \
+                and not analysis.loop_breaks(ctx) and not analysis.loop_returns(ctx) \
+                and not analysis.writes_compile_time(ctx.stat()):
+            trips, copies = self.unroll(ctx, update, trips, declared)
+            # The body has been compiled (and reported its warnings) once already
+            self.logger.quiet = True
+            if trips == 0:
+                self.logger.quiet = quiet
+                if isinstance(init_value, str):
+                    self.mark_unused(init_value)
+                return
+        
         name = f"_loop{self.loops}"
-        condition_value = self.visit(condition)
+        condition_value = self.loop_condition(condition)
         
-        break_var = self.get_temp_var("int")
-        self.set_var(break_var, Literal(1, "int"), ctx)
+        break_var = None
+        if analysis.loop_breaks(ctx):
+            break_var = self.get_temp_var("int")
+            self.set_var(break_var, Literal(1, "int"), ctx)
         
         always_true = False
-        if isinstance(condition_value, str):
-            self.add_cmd(f"execute unless score #MineScript {condition_value} matches 0 run function {self.name}:{name}", ctx)
-        elif isinstance(condition_value, Literal):
+        if not isinstance(condition_value, Literal):
+            self.add_cmd(ir.Call(name), ctx, [condition_value])
+            self.release_condition(condition_value)
+        else:
             if not condition_value.value:
                 line = condition.start.line
                 char = condition.start.column
                 self.logger.log("Condition is always false", line, char, "warning")
-                self.mark_unused(break_var)
+                if break_var is not None:
+                    self.mark_unused(break_var)
                 return
             line = condition.start.line
             char = condition.start.column
             self.logger.log("Condition is always true", line, char, "warning")
-            self.add_cmd(f"function {self.name}:{name}", ctx)
+            self.add_cmd(ir.Call(name), ctx)
             always_true = True
             
-        self.start_loop(name, break_var)
-        self.visit(ctx.stat())
-        update_value = self.visit(update)
+        self.start_loop(name, break_var, ctx, "for loop", trips // copies if trips is not None else None)
+        for _ in range(copies):
+            self.visit_iteration(ctx, update, declared)
         if always_true:
-            self.add_cmd(f"function {self.name}:{name}", ctx)
+            self.add_cmd(ir.Call(name), ctx)
         else:
-            if isinstance(condition_value, str):
-                self.mark_unused(condition_value)
-            condition_value = self.visit(condition)
-            self.add_cmd(f"execute unless score #MineScript {condition_value} matches 0 run function {self.name}:{name}", ctx)
+            condition_value = self.loop_condition(condition)
+            self.add_cmd(ir.Call(name), ctx, [condition_value])
+            self.release_condition(condition_value)
         self.end_loop()
+        self.logger.quiet = quiet
         
         if isinstance(init_value, str):
             self.mark_unused(init_value)
-        if isinstance(condition_value, str):
-            self.mark_unused(condition_value)
+        
+    def visit_iteration(self, ctx, update, declared):
+        # The body and update of for loop ctx, once more
+        local = self.local.get(self.igfunc, {})
+        for name in [name for name in local if name not in declared]:
+            del local[name]
+        self.visit(ctx.stat())
+        update_value = self.visit(update)
         if isinstance(update_value, str):
             self.mark_unused(update_value)
         
+    def unroll(self, ctx, update, trips, declared):
+        # Runs as many iterations of counted loop ctx straight in the code
+        # around it as unroll_threshold allows, the first one measuring the
+        # body. Returns the iterations left for a loop, and how many of them
+        # each run of its body covers.
+        if trips == 0:
+            return 0, 1
+        code = self.get_code()
+        start, before = len(code), set(self.igloops)
+        optimizations = dict(self.optimizations)
+        self.visit_iteration(ctx, update, declared)
+        # Loops (and switches) nested in it became bodies of their own
+        bodies = [body for body in self.igloops if body not in before]
+        size = len(code) - start + sum(len(self.igloops[body]) for body in bodies)
+        copies = self.unroll_threshold // max(size, 1)
+        if copies >= trips:
+            peeled = trips
+        elif copies >= 2:
+            # What doesn't fill a whole run of the loop body runs before it
+            peeled = 1 + (trips - 1) % copies
+        else:
+            del code[start:]
+            for body in bodies:
+                del self.igloops[body]
+                del self.igloopinfo[body]
+            self.optimizations.clear()
+            self.optimizations.update(optimizations)
+            return trips, 1
+        quiet = self.logger.quiet
+        self.logger.quiet = True
+        for _ in range(peeled - 1):
+            self.visit_iteration(ctx, update, declared)
+        self.logger.quiet = quiet
+        # Every iteration but the last of each run of the loop skips its call
+        left = trips - peeled
+        self.optimizations["unrolled iteration"] += peeled + left - left // max(copies, 1)
+        return left, copies
+        
     def visitWhileStatement(self, ctx):
         condition = ctx.expr()
-        condition_value = self.visit(condition)
+        condition_value = self.loop_condition(condition)
         name = f"_loop{self.loops}"
         
-        break_var = self.get_temp_var("int")
-        self.set_var(break_var, Literal(1, "int"), ctx)
+        break_var = None
+        if analysis.loop_breaks(ctx):
+            break_var = self.get_temp_var("int")
+            self.set_var(break_var, Literal(1, "int"), ctx)
         
         always_true = False
         if isinstance(condition_value, Literal):
             if condition_value.value:
-                self.add_cmd(f"function {self.name}:{name}", ctx)
+                self.add_cmd(ir.Call(name), ctx)
                 always_true = True
             else:
                 line = condition.start.line
@@ -747,30 +1328,28 @@ class Visitor(MineScriptVisitor):
                 self.logger.log("Condition is always false", line, char, "warning")
                 return
         else:
-            self.add_cmd(f"execute unless score #MineScript {condition_value} matches 0 run function {self.name}:{name}", ctx)
+            self.add_cmd(ir.Call(name), ctx, [condition_value])
+            self.release_condition(condition_value)
         
-        self.start_loop(name, break_var)
+        self.start_loop(name, break_var, ctx, "while loop")
         self.visit(ctx.stat())
         if always_true:
-            self.add_cmd(f"function {self.name}:{name}", ctx)
+            self.add_cmd(ir.Call(name), ctx)
         else:
-            if isinstance(condition_value, str):
-                self.mark_unused(condition_value)
-            condition_value = self.visit(condition)
-            self.add_cmd(f"execute unless score #MineScript {condition_value} matches 0 run function {self.name}:{name}", ctx)
+            condition_value = self.loop_condition(condition)
+            self.add_cmd(ir.Call(name), ctx, [condition_value])
+            self.release_condition(condition_value)
         self.end_loop()
-        
-        if isinstance(condition_value, str):
-            self.mark_unused(condition_value)
             
     def visitBreakStatement(self, ctx):
-        if len(self.loop) == 0:
+        if len(self.break_var) == 0:
             line = ctx.start.line
             char = ctx.start.column
             self.logger.log("Break statement is outside of a loop", line, char, "error")
             raise CompileTimeException()
 
         self.set_var(self.break_var[-1], Literal(0, "int"), ctx)
+        self.dormant.discard(ir.Matches(self.break_var[-1], 0, 0, negate=True))
         
     def visitPrintStatement(self, ctx):
         if len(ctx.expr()) < 3:
@@ -799,22 +1378,24 @@ class Visitor(MineScriptVisitor):
                             "evaluated at compile time.", line, char, "error")
             raise CompileTimeException()
         
-        color_text = f"\"color\":\"{self.get_value(color_value)}\""
-        command = ""
+        color = self.get_value(color_value)
+        components = []
+        values = []
         for arg in args:
             arg_value = self.visit(arg)
             if self.at_compile_time(arg_value):
-                command += ',{"text":'
                 if self.get_type(arg_value) == "char":
-                    command += f'"{chr(self.get_value(arg_value))}"'
+                    components.append(ir.Text(chr(self.get_value(arg_value)), color))
                 else:
-                    command += f'"{str(self.get_value(arg_value))}"'
-                command += ", " + color_text + "}"
+                    components.append(ir.Text(str(self.get_value(arg_value)), color))
             else:
                 if self.get_type(arg_value) == "int":
-                    command += ',{"score":{"name":"#MineScript","objective":"'+arg_value+'"}}'
-                self.mark_unused(arg_value)
-        self.add_cmd(f"tellraw {selector_value.value} [{command[1:]}]", ctx)
+                    components.append(ir.Score(arg_value))
+                values.append(arg_value)
+        self.add_cmd(ir.Print(self.get_value(selector_value), components), ctx)
+        # Only now, or a later argument could reuse an earlier one's temp
+        for value in values:
+            self.mark_unused(value)
         
     def visitMcCommand(self, ctx):
         pass
@@ -837,11 +1418,9 @@ class Visitor(MineScriptVisitor):
                 expr.value %= 256
                 return expr
             else:
-                temp_var = self.get_temp_var("int")
-                self.set_var(temp_var, Literal(255, "int"), ctx)
                 temp_result = self.get_temp_var("char")
                 self.set_var(temp_result, expr, ctx)
-                self.add_cmd(f"scoreboard players operation #MineScript {temp_result} %= #MineScript {temp_var}", ctx)
+                self.add_cmd(ir.Operation(temp_result, "%=", self.get_constant(256)), ctx)
                 return temp_result        
         
 # ! Strings:
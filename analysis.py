@@ -0,0 +1,262 @@
+from antlr4.tree.Tree import TerminalNodeImpl
+
+from MineScriptParser import MineScriptParser
+
+# Static queries over the parse tree, shared by the code generator and the
+# optimization passes.
+
+FLIPPED = {"<": ">", ">": "<", "<=": ">=", ">=": "<=", "==": "==", "!=": "!="}
+
+def walk(ctx):
+    stack = [ctx]
+    while stack:
+        node = stack.pop()
+        yield node
+        if not isinstance(node, TerminalNodeImpl) and node.children:
+            stack.extend(reversed(node.children))
+
+def unwrap(expr):
+    # Skips parentheses and the '#ignore' wrapper around single-rule expressions
+    while True:
+        if isinstance(expr, MineScriptParser.ParenthesesContext):
+            expr = expr.expr()
+        elif isinstance(expr, MineScriptParser.IgnoreContext):
+            expr = expr.getChild(0)
+        else:
+            return expr
+
+def literal_value(expr):
+    expr = unwrap(expr)
+    if isinstance(expr, MineScriptParser.LiteralContext) and expr.NUMBER() is not None:
+        return int(expr.NUMBER().getText())
+    return None
+
+def variable_name(expr):
+    # Name of a plain in-game variable read (no assignment, no indexing)
+    expr = unwrap(expr)
+    if (isinstance(expr, MineScriptParser.VariableAssignementContext) and expr.PREFIX() is None
+            and expr.arr() is None and expr.expr() is None):
+        return expr.WORD().getText()
+    return None
+
+def assigned_variables(ctx, declarations=None, visited=None):
+    # Names of every variable that may be written while ctx executes,
+    # following calls into the bodies of user functions. None means the set
+    # is unknown (a call to something we can't see into).
+    if visited is None:
+        visited = set()
+    names = set()
+    for node in walk(ctx):
+        if isinstance(node, MineScriptParser.VariableAssignementContext):
+            if node.expr() is not None or isinstance(node.parentCtx, MineScriptParser.VariableDeclarationContext):
+                names.add(node.WORD().getText())
+        elif isinstance(node, (MineScriptParser.VariableIncrementPosContext, MineScriptParser.VariableIncrementPreContext,
+                               MineScriptParser.VariableDecrementPosContext, MineScriptParser.VariableDecrementPreContext)):
+            names.add(node.WORD().getText())
+        elif isinstance(node, MineScriptParser.FunctionCallContext):
+            name = node.WORD().getText()
+            if declarations is None or name not in declarations:
+                return None
+            if name in visited:
+                continue
+            visited.add(name)
+            declaration = declarations[name]
+            names.update(arg.WORD().getText() for arg in declaration.functionArg())
+            callee = assigned_variables(declaration.stat(), declarations, visited)
+            if callee is None:
+                return None
+            names |= callee
+    return names
+
+def writes_compile_time(ctx):
+    # Whether running ctx declares or changes a compile-time ('$') variable
+    for node in walk(ctx):
+        if isinstance(node, MineScriptParser.VariableAssignementContext) and node.PREFIX() is not None:
+            if node.expr() is not None or isinstance(node.parentCtx, MineScriptParser.VariableDeclarationContext):
+                return True
+        elif isinstance(node, (MineScriptParser.VariableIncrementPosContext, MineScriptParser.VariableIncrementPreContext,
+                               MineScriptParser.VariableDecrementPosContext, MineScriptParser.VariableDecrementPreContext)):
+            if node.PREFIX() is not None:
+                return True
+    return False
+
+def contains(ctx, context_type, stop_at=()):
+    # Whether ctx contains a node of context_type without crossing into any
+    # of the stop_at node types
+    stack = [ctx]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, context_type):
+            return True
+        if node is not ctx and isinstance(node, stop_at):
+            continue
+        if not isinstance(node, TerminalNodeImpl) and node.children:
+            stack.extend(node.children)
+    return False
+
+LOOP_CONTEXTS = (MineScriptParser.ForStatementContext, MineScriptParser.WhileStatementContext)
+
+def loop_breaks(ctx):
+    # Whether the body of loop ctx contains a break for this loop
+    return contains(ctx.stat(), MineScriptParser.BreakStatementContext, LOOP_CONTEXTS)
+
+def loop_returns(ctx):
+    # Whether the body of loop ctx, or of a loop in it, contains a return
+    return contains(ctx.stat(), MineScriptParser.ReturnStatementContext)
+
+def case(ctx):
+    # (variable expression, literal) of an if statement on 'v == literal'
+    condition = unwrap(ctx.expr())
+    if not isinstance(condition, MineScriptParser.VariableComparisonContext) or condition.type_.text != "==":
+        return None
+    left, right = condition.expr()
+    if variable_name(left) is not None and literal_value(right) is not None:
+        return left, literal_value(right)
+    if variable_name(right) is not None and literal_value(left) is not None:
+        return right, literal_value(left)
+    return None
+
+def switch_cases(ctx):
+    # Recognizes 'if (v == a) ... else if (v == b) ... else ...' on a single
+    # in-game variable v and distinct literals. Returns (the first expression
+    # reading v, [(literal, statement)], the final else statement or None).
+    first = case(ctx)
+    if first is None:
+        return None
+    variable = first[0]
+    cases = []
+    while True:
+        cases.append((case(ctx)[1], ctx.stat(0)))
+        if len(ctx.stat()) == 1:
+            return variable, cases, None
+        otherwise = ctx.stat(1)
+        following = case(otherwise.ifStatement()) if otherwise.ifStatement() is not None else None
+        if following is None or variable_name(following[0]) != variable_name(variable) \
+                or following[1] in [value for value, _ in cases]:
+            return variable, cases, otherwise
+        ctx = otherwise.ifStatement()
+
+def exits(stat):
+    # Whether stat always returns or breaks, so nothing after it in its
+    # block runs
+    if stat.returnStatement() is not None or stat.breakStatement() is not None:
+        return True
+    if stat.ifStatement() is not None:
+        branches = stat.ifStatement().stat()
+        return len(branches) == 2 and all(exits(branch) for branch in branches)
+    return any(exits(child) for child in stat.stat())
+
+def reachable(stats):
+    # The statements of a block up to the first one that always exits
+    for index, stat in enumerate(stats):
+        if exits(stat):
+            return stats[:index+1]
+    return stats
+
+def tail_returns(stat):
+    # Return statements after which nothing else in the function runs: the
+    # last reachable statement of stat, or of either branch of an if ending it
+    if stat.returnStatement() is not None:
+        return {stat.returnStatement()}
+    if stat.ifStatement() is not None:
+        returns = set()
+        for branch in stat.ifStatement().stat():
+            returns |= tail_returns(branch)
+        return returns
+    if stat.stat():
+        return tail_returns(reachable(stat.stat())[-1])
+    return set()
+
+def early_returns(ctx):
+    # Whether function ctx has a reachable return that isn't in tail
+    # position, so whatever follows it has to be skipped at run time
+    tails = tail_returns(ctx.stat())
+    stack = [ctx.stat()]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, MineScriptParser.ReturnStatementContext) and node not in tails:
+            return True
+        if isinstance(node, MineScriptParser.StatContext) and node.stat():
+            stack.extend(reachable(node.stat()))
+        elif not isinstance(node, TerminalNodeImpl) and node.children:
+            stack.extend(node.children)
+    return False
+
+def loop_bounds(ctx, declarations=None):
+    # Recognizes 'for (i = a; i <op> b; i++/i--)' with literal a and b where
+    # the body never writes to i. Returns (variable, start, op, limit, step).
+    if len(ctx.expr()) == 3:
+        init, condition, update = ctx.expr()
+        init = unwrap(init)
+        if not isinstance(init, MineScriptParser.VariableAssignementContext) or init.expr() is None:
+            return None
+    else:
+        declaration = ctx.variableDeclaration()
+        condition, update = ctx.expr()
+        if len(declaration.variableAssignement()) != 1:
+            return None
+        init = declaration.variableAssignement(0)
+        if init.expr() is None:
+            return None
+    if init.PREFIX() is not None or init.arr() is not None:
+        return None
+    variable = init.WORD().getText()
+    start = literal_value(init.expr())
+    if start is None:
+        return None
+
+    condition = unwrap(condition)
+    if not isinstance(condition, MineScriptParser.VariableComparisonContext):
+        return None
+    left, right = condition.expr()
+    op = condition.type_.text
+    if variable_name(left) == variable and literal_value(right) is not None:
+        limit = literal_value(right)
+    elif variable_name(right) == variable and literal_value(left) is not None:
+        limit = literal_value(left)
+        op = FLIPPED[op]
+    else:
+        return None
+
+    update = unwrap(update)
+    if isinstance(update, (MineScriptParser.VariableIncrementPosContext, MineScriptParser.VariableIncrementPreContext)):
+        step = 1
+    elif isinstance(update, (MineScriptParser.VariableDecrementPosContext, MineScriptParser.VariableDecrementPreContext)):
+        step = -1
+    else:
+        return None
+    if update.PREFIX() is not None or update.WORD().getText() != variable:
+        return None
+
+    written = assigned_variables(ctx.stat(), declarations)
+    if written is None or variable in written:
+        return None
+    return variable, start, op, limit, step
+
+def trip_count(bounds):
+    # Number of times the body of a loop with the given bounds runs, or None
+    # if it never terminates on its own
+    if bounds is None:
+        return None
+    _, start, op, limit, step = bounds
+    holds = {"<": start < limit, "<=": start <= limit, ">": start > limit,
+             ">=": start >= limit, "==": start == limit, "!=": start != limit}[op]
+    if not holds:
+        return 0
+    if op == "==":
+        return 1
+    if step == 1:
+        if op == "<":
+            return limit - start
+        if op == "<=":
+            return limit - start + 1
+        if op == "!=" and limit > start:
+            return limit - start
+    else:
+        if op == ">":
+            return start - limit
+        if op == ">=":
+            return start - limit + 1
+        if op == "!=" and limit < start:
+            return start - limit
+    return None
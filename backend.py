@@ -0,0 +1,148 @@
+import ir
+
+# Renders the IR into mcfunction commands.
+
+
+class ObjectiveLayout:
+    # Every slot is its own objective, held by the fake player #MineScript;
+    # constants share the _const objective, one fake player per value
+    def score(self, slot):
+        if ir.is_constant(slot):
+            return f"#{ir.constant_value(slot)}", "_const"
+        return "#MineScript", slot
+
+    def objective(self, slot, display):
+        if ir.is_constant(slot):
+            return "_const", "_const"
+        return slot, display
+
+
+class PlayerLayout:
+    # Every slot is a fake player (#<slot>) on one shared objective, so a
+    # pack adds a single objective however many variables it has
+    def __init__(self, objective="MineScript"):
+        self.name = objective
+
+    def score(self, slot):
+        return f"#{slot}", self.name
+
+    def objective(self, slot, display):
+        return self.name, self.name
+
+
+LAYOUTS = {
+    "objectives": ObjectiveLayout,
+    "players": PlayerLayout,
+}
+
+
+class Backend:
+    def __init__(self, namespace, layout=None):
+        self.namespace = namespace
+        self.layout = layout if layout is not None else ObjectiveLayout()
+
+    def score(self, slot):
+        holder, objective = self.layout.score(slot)
+        return f"{holder} {objective}"
+
+    def storage(self, path):
+        return f"storage {self.namespace}:minescript {path}"
+
+    def condition(self, condition):
+        keyword = "unless" if condition.negate else "if"
+        if isinstance(condition, ir.Matches):
+            low = "" if condition.low is None else condition.low
+            high = "" if condition.high is None else condition.high
+            bounds = str(low) if condition.low == condition.high else f"{low}..{high}"
+            return f"{keyword} score {self.score(condition.slot)} matches {bounds}"
+        return f"{keyword} score {self.score(condition.left)} {condition.op} {self.score(condition.right)}"
+
+    def execute(self, conditions, command, store=None):
+        subcommands = [self.condition(condition) for condition in conditions]
+        if store is not None:
+            subcommands.append(store)
+        if not subcommands:
+            return command
+        return f"execute {' '.join(subcommands)} run {command}"
+
+    def render(self, instruction):
+        # Commands for one instruction
+        method = getattr(self, f"render_{type(instruction).__name__.lower()}")
+        return method(instruction)
+
+    def render_code(self, code):
+        # Commands for a list of instructions, and the source position of each
+        commands = []
+        sources = []
+        for instruction in code:
+            rendered = self.render(instruction)
+            if ir.is_macro(instruction):
+                rendered = ["$" + command for command in rendered]
+            source = (instruction.line, instruction.column) if instruction.line != -1 else None
+            commands.extend(rendered)
+            sources.extend([source]*len(rendered))
+        return commands, sources
+
+    def render_set(self, instruction):
+        return [self.execute(instruction.conditions,
+                             f"scoreboard players set {self.score(instruction.dest)} {instruction.value}")]
+
+    def render_add(self, instruction):
+        action = "add" if instruction.value >= 0 else "remove"
+        return [self.execute(instruction.conditions,
+                             f"scoreboard players {action} {self.score(instruction.dest)} {abs(instruction.value)}")]
+
+    def render_operation(self, instruction):
+        return [self.execute(instruction.conditions,
+                             f"scoreboard players operation {self.score(instruction.dest)} {instruction.op} "
+                             f"{self.score(instruction.source)}")]
+
+    def render_test(self, instruction):
+        dest = self.score(instruction.dest)
+        return [self.execute(instruction.conditions, f"scoreboard players set {dest} 0"),
+                self.execute(instruction.conditions + [instruction.condition], f"scoreboard players set {dest} 1")]
+
+    def render_loaddata(self, instruction):
+        return [self.execute(instruction.conditions, f"data get {self.storage(instruction.path)}",
+                             f"store result score {self.score(instruction.dest)}")]
+
+    def render_storedata(self, instruction):
+        return [self.execute(instruction.conditions, f"scoreboard players get {self.score(instruction.source)}",
+                             f"store result {self.storage(instruction.path)} int 1")]
+
+    def render_datamodify(self, instruction):
+        if instruction.source is not None:
+            value = f"from {self.storage(instruction.source)}"
+        else:
+            value = f"value {instruction.value}"
+        return [self.execute(instruction.conditions,
+                             f"data modify {self.storage(instruction.path)} {instruction.mode} {value}")]
+
+    def render_dataremove(self, instruction):
+        return [self.execute(instruction.conditions, f"data remove {self.storage(instruction.path)}")]
+
+    def render_call(self, instruction):
+        command = f"function {self.namespace}:{instruction.function}"
+        if instruction.arguments is not None:
+            command += f" with {self.storage(instruction.arguments)}"
+        return [self.execute(instruction.conditions, command)]
+
+    def render_print(self, instruction):
+        components = []
+        for component in instruction.components:
+            if isinstance(component, ir.Score):
+                holder, objective = self.layout.score(component.slot)
+                components.append('{"score":{"name":"' + holder + '","objective":"' + objective + '"}}')
+            else:
+                components.append('{"text":"' + component.text + '", "color":"' + component.color + '"}')
+        return [self.execute(instruction.conditions, f"tellraw {instruction.selector} [{','.join(components)}]")]
+
+
+def render(visitor, layout=None):
+    # Replaces the IR in every function and loop body with commands, and
+    # fills visitor.igsources
+    backend = Backend(visitor.name, layout)
+    for loop, code in visitor.igloops.items():
+        visitor.igloops[loop], visitor.igsources[loop] = backend.render_code(code)
+    for function, info in visitor.igfunctions.items():
+        info["code"], visitor.igsources[function] = backend.render_code(info["code"])
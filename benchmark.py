@@ -0,0 +1,271 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import tracemalloc
+
+import minescript
+from options import Options
+from profiler import Profiler
+
+SHAPES = {
+    # name: (functions, statements per function, nesting depth, array size, expression length)
+    "functions": (200, 4, 1, 8, 3),
+    "nested": (10, 4, 8, 8, 3),
+    "arrays": (20, 4, 1, 400, 3),
+    "expressions": (20, 8, 1, 8, 40),
+    "mixed": (60, 6, 4, 64, 12),
+}
+
+class ProgramGenerator:
+    def __init__(self, functions, statements, depth, array_size, expression_length, seed=0):
+        self.functions = functions
+        self.statements = statements
+        self.depth = depth
+        self.array_size = array_size
+        self.expression_length = expression_length
+        self.random = random.Random(seed)
+        self.lines = []
+        self.locals = 0
+
+    def emit(self, line, indent):
+        self.lines.append("    "*indent + line)
+
+    def operand(self, names):
+        if self.random.random() < 0.3:
+            return str(self.random.randint(1, 9))
+        return self.random.choice(names)
+
+    def expression(self, names):
+        expr = self.operand(names)
+        for _ in range(self.expression_length - 1):
+            op = self.random.choice(["+", "-", "*", "+", "-", "%", "/"])
+            operand = self.operand(names)
+            if op in ("%", "/"):
+                # Avoid dividing by a variable that might be zero
+                operand = str(self.random.randint(1, 9))
+            expr = f"{expr} {op} {operand}"
+        return expr
+
+    def local(self):
+        name = f"l{self.locals}"
+        self.locals += 1
+        return name
+
+    def statement(self, names, depth, indent):
+        kind = self.random.choice(["assign", "if", "for", "while", "array"]) if depth > 0 else "assign"
+        if kind == "assign":
+            self.emit(f"{self.random.choice(names)} = {self.expression(names)};", indent)
+        elif kind == "array":
+            self.emit(f"data[{self.random.randrange(self.array_size)}] = {self.random.choice(names)};", indent)
+            self.emit(f"{self.random.choice(names)} = data[{self.random.randrange(self.array_size)}];", indent)
+        elif kind == "if":
+            self.emit(f"if ({self.random.choice(names)} > {self.random.randint(0, 9)}) {{", indent)
+            self.statement(names, depth - 1, indent + 1)
+            self.emit("} else {", indent)
+            self.statement(names, depth - 1, indent + 1)
+            self.emit("}", indent)
+        elif kind == "for":
+            counter = self.local()
+            self.emit(f"int {counter};", indent)
+            self.emit(f"for ({counter} = 0; {counter} < {self.random.randint(2, 5)}; {counter}++) {{", indent)
+            self.statement(names + [counter], depth - 1, indent + 1)
+            self.emit("}", indent)
+        elif kind == "while":
+            counter = self.local()
+            self.emit(f"int {counter} = {self.random.randint(2, 5)};", indent)
+            self.emit(f"while ({counter} > 0) {{", indent)
+            self.emit(f"{counter}--;", indent + 1)
+            self.statement(names + [counter], depth - 1, indent + 1)
+            self.emit("}", indent)
+
+    def generate(self):
+        self.lines = []
+        self.locals = 0
+        self.emit("int g0, g1, g2;", 0)
+        self.emit("int data[];", 0)
+        self.emit("", 0)
+        self.emit("void load() {", 0)
+        for name in ("g0", "g1", "g2"):
+            self.emit(f"{name} = {self.random.randint(0, 9)};", 1)
+        values = ", ".join(str(self.random.randint(0, 99)) for _ in range(self.array_size))
+        self.emit(f"data = {{{values}}};", 1)
+        self.emit("}", 0)
+
+        for i in range(self.functions):
+            self.emit("", 0)
+            self.emit(f"int f{i}(int a, int b) {{", 0)
+            self.emit("int r = a + b;", 1)
+            names = ["a", "b", "r", "g0", "g1", "g2"]
+            for _ in range(self.statements):
+                self.statement(names, self.depth, 1)
+            self.emit("return r;", 1)
+            self.emit("}", 0)
+
+        self.emit("", 0)
+        self.emit("void tick() {", 0)
+        for i in range(self.functions):
+            self.emit(f"g{i % 3} = f{i}(g{(i + 1) % 3}, {i % 10});", 1)
+        self.emit("}", 0)
+        return "\n".join(self.lines) + "\n"
+
+
+class MemoryProfiler(Profiler):
+    # Records the peak memory traced during each phase instead of its time
+    def __init__(self):
+        super().__init__(visitor_methods=False)
+        self.memory = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            self.memory[name] = tracemalloc.get_traced_memory()[1]
+
+
+def run_build(name, file, options, profiler):
+    # The build users run, phase by phase as minescript.build reports them
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not minescript.build(name, file, options, profiler):
+            raise RuntimeError("Generated program failed to compile")
+    return profiler.counters["commands"]
+
+def benchmark(shape, scale=1.0, repeat=3, seed=0, options=None):
+    functions, statements, depth, array_size, expression_length = SHAPES[shape]
+    params = {
+        "functions": max(1, int(functions*scale)),
+        "statements": statements,
+        "depth": depth,
+        "array_size": max(1, int(array_size*scale)),
+        "expression_length": expression_length,
+        "seed": seed,
+    }
+    source = ProgramGenerator(**params).generate()
+    lines = source.count("\n")
+    name = "bench"
+    if options is None:
+        options = {}
+    # Parsing is part of what's measured, so the parse tree cache is never read
+    build_options = Options(**options)
+    build_options.cache = False
+
+    with tempfile.TemporaryDirectory() as workdir:
+        file = os.path.join(workdir, f"{shape}.ms")
+        with open(file, "w") as f:
+            f.write(source)
+
+        times = {}
+        for _ in range(repeat):
+            profiler = Profiler(visitor_methods=False)
+            commands = run_build(name, file, build_options, profiler)
+            for phase, (seconds, _) in profiler.phases.items():
+                times.setdefault(phase, []).append(seconds)
+
+        # Peak memory is measured in a separate run since tracing skews timings
+        profiler = MemoryProfiler()
+        tracemalloc.start()
+        try:
+            run_build(name, file, build_options, profiler)
+        finally:
+            tracemalloc.stop()
+
+    phases = {}
+    for phase, seconds in times.items():
+        seconds = min(seconds)
+        phases[phase] = {
+            "seconds": seconds,
+            "lines_per_second": lines/seconds if seconds > 0 else None,
+            "peak_memory": profiler.memory[phase],
+        }
+    total = sum(phase["seconds"] for phase in phases.values())
+    return {
+        "shape": shape,
+        "params": params,
+        "options": options,
+        "lines": lines,
+        "commands": commands,
+        "phases": phases,
+        "total": {"seconds": total, "lines_per_second": lines/total if total > 0 else None},
+    }
+
+def compare(old, new, threshold):
+    regressions = []
+    old_cases = {case["shape"]: case for case in old["cases"]}
+    for case in new["cases"]:
+        if case["shape"] not in old_cases:
+            continue
+        previous = old_cases[case["shape"]]
+        if previous["params"] != case["params"] or previous.get("options", {}) != case["options"]:
+            print(f"{case['shape']}: parameters changed, skipping")
+            continue
+        for phase in [phase for phase in case["phases"] if phase in previous["phases"]] + ["total"]:
+            before = previous["phases"][phase]["seconds"] if phase != "total" else previous["total"]["seconds"]
+            after = case["phases"][phase]["seconds"] if phase != "total" else case["total"]["seconds"]
+            ratio = after/before if before > 0 else 1.0
+            marker = ""
+            if ratio > 1 + threshold:
+                marker = "  REGRESSION"
+                regressions.append((case["shape"], phase, ratio))
+            print(f"{case['shape']:>12} {phase:>15} {before:10.4f}s -> {after:10.4f}s  x{ratio:.2f}{marker}")
+        if previous["commands"] != case["commands"]:
+            print(f"{case['shape']:>12} {'commands':>15} {previous['commands']:>11} -> {case['commands']:>11}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MineScript compiler on generated programs")
+    parser.add_argument("--shape", action="append", choices=sorted(SHAPES),
+                        help="program shape to benchmark (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for program size")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per shape (the fastest is kept)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown reported as a regression (default: 0.10)")
+    parser.add_argument("--options", type=json.loads, default={}, metavar="JSON",
+                        help="build options as a JSON object, e.g. '{\"inline\": false}' (see options.py)")
+    parser.add_argument("--emit", metavar="SHAPE", choices=sorted(SHAPES),
+                        help="print the generated program for SHAPE and exit")
+    args = parser.parse_args()
+
+    if args.emit is not None:
+        functions, statements, depth, array_size, expression_length = SHAPES[args.emit]
+        generator = ProgramGenerator(max(1, int(functions*args.scale)), statements, depth,
+                                     max(1, int(array_size*args.scale)), expression_length, args.seed)
+        print(generator.generate(), end="")
+        return 0
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": [],
+    }
+    for shape in args.shape or sorted(SHAPES):
+        case = benchmark(shape, args.scale, args.repeat, args.seed, args.options)
+        results["cases"].append(case)
+        print(f"{shape:>12}: {case['lines']} lines, {case['commands']} commands, "
+              f"{case['total']['lines_per_second']:.0f} lines/s")
+        for phase, info in case["phases"].items():
+            print(f"{'':>14}{phase:>15} {info['seconds']:10.4f}s "
+                  f"{info['peak_memory']/1024:10.0f} KiB peak")
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            old = json.load(file)
+        if compare(old, results, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import argparse
+import re
+import sys
+
+from simulator import MAX_COMMAND_CHAIN, read_pack
+
+CALL = re.compile(r"(?:^|\srun )function (\S+)")
+
+
+class Cost:
+    def __init__(self, commands, unbounded=frozenset()):
+        # Worst-case commands (per iteration for unbounded loops), and the
+        # functions whose cost can't be bounded statically
+        self.commands = commands
+        self.unbounded = unbounded
+
+
+class CostAnalyzer:
+    def __init__(self, functions, loops=None, sources=None, chain_limit=MAX_COMMAND_CHAIN):
+        # functions: {"namespace:name": [commands]}
+        # loops:     {"namespace:name": trip count or None} for loop functions
+        # sources:   {"namespace:name": (line, column, description)}
+        self.functions = functions
+        self.loops = loops or {}
+        self.sources = sources or {}
+        self.chain_limit = chain_limit
+        self.costs = {}
+        self.active = set()
+
+    def callees(self, name):
+        calls = []
+        for command in self.functions.get(name, []):
+            match = CALL.search(command)
+            if match is not None:
+                calls.append(match.group(1))
+        return calls
+
+    def cost(self, name):
+        if name in self.costs:
+            return self.costs[name]
+        if name not in self.functions:
+            return Cost(0)
+        self.active.add(name)
+        commands = len(self.functions[name])
+        unbounded = set()
+        recursive = False
+        for callee in self.callees(name):
+            if callee == name:
+                recursive = True
+            elif callee in self.active:
+                # Recursion through other functions can't be bounded
+                unbounded.add(callee)
+            else:
+                cost = self.cost(callee)
+                commands += cost.commands
+                unbounded |= cost.unbounded
+        self.active.discard(name)
+
+        if recursive:
+            trips = self.loops.get(name)
+            if trips is None:
+                unbounded.add(name)
+            else:
+                commands *= trips
+        cost = Cost(commands, frozenset(unbounded))
+        self.costs[name] = cost
+        return cost
+
+    def worst_case(self, name):
+        cost = self.cost(name)
+        if cost.unbounded:
+            return self.chain_limit
+        return min(cost.commands, self.chain_limit)
+
+    def reachable(self, name):
+        seen = []
+        stack = [name]
+        while stack:
+            current = stack.pop()
+            if current in seen or current not in self.functions:
+                continue
+            seen.append(current)
+            stack.extend(self.callees(current))
+        return seen
+
+    def contributors(self, entry, count=5):
+        # Reachable functions ordered by their own worst-case cost
+        names = [name for name in self.reachable(entry) if name != entry]
+        names.sort(key=lambda name: (bool(self.cost(name).unbounded), self.cost(name).commands), reverse=True)
+        return names[:count]
+
+    def describe(self, name):
+        cost = self.cost(name)
+        trips = self.loops.get(name, "")
+        if name in cost.unbounded:
+            bound = "unbounded loop"
+        elif cost.unbounded:
+            bound = "calls unbounded code"
+        elif name in self.loops:
+            bound = f"{trips} iterations"
+        else:
+            bound = ""
+        return bound
+
+    def report(self, entries, file=sys.stdout):
+        print(f"{'Function':<30} {'Own':>6} {'Worst case':>11}  Bound / source", file=file)
+        for name in sorted(self.functions):
+            cost = self.cost(name)
+            worst = "unbounded" if cost.unbounded else str(cost.commands)
+            source = self.sources.get(name)
+            location = f"  (line {source[0]}, {source[2]})" if source is not None and source[0] != -1 else ""
+            print(f"{name:<30} {len(self.functions[name]):>6} {worst:>11}  {self.describe(name)}{location}", file=file)
+        print(file=file)
+        for label, names in entries:
+            for name in names:
+                cost = self.cost(name)
+                if cost.unbounded:
+                    print(f"{label} ({name}): unbounded, at most {self.chain_limit} commands "
+                          f"(maxCommandChainLength)", file=file)
+                else:
+                    print(f"{label} ({name}): {self.worst_case(name)} commands worst case", file=file)
+
+    def check_budget(self, entry, budget, logger=None, type_="warning"):
+        # Logs the code responsible when the worst case of entry exceeds the
+        # budget. Returns whether it stayed within budget.
+        worst = self.worst_case(entry)
+        if worst <= budget:
+            return True
+        cost = self.cost(entry)
+        if cost.unbounded:
+            message = (f"'{entry}' may run up to {self.chain_limit} commands (contains loops with no "
+                       f"compile-time bound), over the budget of {budget}")
+        else:
+            message = f"'{entry}' runs up to {worst} commands, over the budget of {budget}"
+        self.log(logger, message, self.sources.get(entry), type_)
+
+        responsible = sorted(cost.unbounded) or self.contributors(entry)
+        for name in responsible:
+            detail = self.describe(name) or f"{self.cost(name).commands} commands"
+            self.log(logger, f"'{name}': {detail}", self.sources.get(name), type_)
+        return False
+
+    def log(self, logger, message, source, type_):
+        if logger is None:
+            print(f"{type_.capitalize()}: {message}", file=sys.stderr)
+        elif source is None or source[0] == -1:
+            logger.log(message, type_=type_)
+        else:
+            logger.log(f"{message} ({source[2]})", source[0], source[1], type_)
+
+
+def from_visitor(name, functions, visitor, chain_limit=MAX_COMMAND_CHAIN):
+    loops = {}
+    sources = {}
+    for function, info in visitor.igfunctions.items():
+        if "line" in info:
+            sources[f"{name}:{function}"] = (info["line"], info["column"], f"function '{function}'")
+    for loop, info in visitor.igloopinfo.items():
+        if info["kind"] != "block":
+            loops[f"{name}:{loop}"] = info["trips"]
+        sources[f"{name}:{loop}"] = (info["line"], info["column"], info["kind"])
+    return CostAnalyzer(functions, loops, sources, chain_limit)
+
+def main():
+    parser = argparse.ArgumentParser(description="Static worst-case command count of a built datapack")
+    parser.add_argument("pack", help="path to the built datapack, e.g. build/test")
+    parser.add_argument("--budget", type=int, help="maximum commands allowed per tick")
+    parser.add_argument("--chain-limit", type=int, default=MAX_COMMAND_CHAIN)
+    args = parser.parse_args()
+
+    functions, load, tick = read_pack(args.pack)
+    # Without the compiler's loop information every recursive function is unbounded
+    analyzer = CostAnalyzer(functions, chain_limit=args.chain_limit)
+    analyzer.report([("load", load), ("tick", tick)])
+    if args.budget is not None:
+        within = [analyzer.check_budget(entry, args.budget, type_="error") for entry in tick]
+        if not all(within):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import ir
+from regalloc import is_temp
+
+# Dead code elimination over the IR, after inlining. The game only runs load
+# and tick (and functions marked 'export', which are run from outside the
+# pack), so anything they can't reach is left out of the pack, and so are the
+# objectives of variables no remaining instruction uses. Temps are left to
+# regalloc, which gives objectives only to the temps it allocates.
+#
+# Storage isn't visible outside the pack either: a value in storage is only
+# needed if some instruction loads it into a score, passes it to a macro
+# function, or copies it into a value that is needed, so writes to anything
+# else are dropped.
+
+ENTRY_POINTS = ("load", "tick")
+
+
+def root(path):
+    # The variable a storage path belongs to ("a.value[2]" -> "a")
+    return path.split(".")[0]
+
+
+def storage_roots(instruction):
+    # Variables whose storage the instruction reads or writes
+    roots = set()
+    if isinstance(instruction, (ir.LoadData, ir.StoreData, ir.DataModify, ir.DataRemove)):
+        roots.add(root(instruction.path))
+    if isinstance(instruction, ir.DataModify) and instruction.source is not None:
+        roots.add(root(instruction.source))
+    if isinstance(instruction, ir.Call) and instruction.arguments is not None:
+        roots.add(root(instruction.arguments))
+    return roots
+
+
+def size(code):
+    # Commands the instructions render to
+    return sum(2 if isinstance(instruction, ir.Test) else 1 for instruction in code)
+
+
+class DeadCodeEliminator:
+    def __init__(self, visitor):
+        self.visitor = visitor
+        self.bodies = dict(visitor.igloops)
+        for function, info in visitor.igfunctions.items():
+            self.bodies[function] = info["code"]
+        self.removed = {"unreachable function": 0, "dead storage write": 0, "unused variable": 0}
+
+    def reachable(self):
+        roots = [name for name, info in self.visitor.igfunctions.items()
+                 if name in ENTRY_POINTS or info["export"]]
+        seen = set(roots)
+        stack = list(roots)
+        while stack:
+            for instruction in self.bodies[stack.pop()]:
+                if isinstance(instruction, ir.Call) and instruction.function in self.bodies \
+                        and instruction.function not in seen:
+                    seen.add(instruction.function)
+                    stack.append(instruction.function)
+        return seen
+
+    def remove_unreachable(self):
+        reachable = self.reachable()
+        for name in [name for name in self.bodies if name not in reachable]:
+            self.removed["unreachable function"] += size(self.bodies.pop(name))
+            if name in self.visitor.igloops:
+                del self.visitor.igloops[name]
+                del self.visitor.igloopinfo[name]
+                continue
+            # Its locals stay while inlined copies of its code still use them
+            info = self.visitor.igfunctions.pop(name)
+            # Functions whose calls were all inlined, or are themselves
+            # unreachable, go without a word
+            if name not in self.visitor.called:
+                self.visitor.logger.log(f"Function '{name}' is never called, so it was left out "
+                                        f"(declare it 'export' to keep it)", info["line"], info["column"])
+
+    def live_storage(self):
+        live = set()
+        copies = []
+        for code in self.bodies.values():
+            for instruction in code:
+                if isinstance(instruction, ir.LoadData):
+                    live.add(root(instruction.path))
+                elif isinstance(instruction, ir.Call) and instruction.arguments is not None:
+                    live.add(root(instruction.arguments))
+                elif isinstance(instruction, ir.DataModify) and instruction.source is not None:
+                    copies.append((root(instruction.path), root(instruction.source)))
+        changed = True
+        while changed:
+            changed = False
+            for dest, source in copies:
+                if dest in live and source not in live:
+                    live.add(source)
+                    changed = True
+        return live
+
+    def remove_dead_stores(self):
+        live = self.live_storage()
+        for code in self.bodies.values():
+            kept = [instruction for instruction in code
+                    if not isinstance(instruction, (ir.StoreData, ir.DataModify, ir.DataRemove))
+                    or root(instruction.path) in live]
+            self.removed["dead storage write"] += len(code) - len(kept)
+            code[:] = kept
+
+    def remove_unused_variables(self):
+        used = set()
+        for code in self.bodies.values():
+            for instruction in code:
+                used |= instruction.reads() | instruction.writes() | storage_roots(instruction)
+        for variable in [variable for variable in self.visitor.igmemory
+                         if variable not in used and not is_temp(variable)]:
+            del self.visitor.igmemory[variable]
+            if ir.is_constant(variable):
+                del self.visitor.constants[variable]
+            self.removed["unused variable"] += 1
+        # Locals of every function share one objective per name
+        unused = set()
+        for local in self.visitor.local.values():
+            for variable in [variable for variable in local if f"{variable}+local" not in used]:
+                del local[variable]
+                unused.add(variable)
+        for local in self.visitor.local.values():
+            unused -= set(local)
+        self.removed["unused variable"] += len(unused)
+
+    def run(self):
+        self.remove_unreachable()
+        self.remove_dead_stores()
+        self.remove_unused_variables()
+        return self.removed
+
+
+def eliminate(visitor):
+    return DeadCodeEliminator(visitor).run()
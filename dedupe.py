@@ -0,0 +1,81 @@
+import copy
+
+import ir
+from deadcode import ENTRY_POINTS, size
+
+# Hash-consing of function and loop bodies, after temps are allocated. Array
+# accesses and repeated loop shapes generate bodies that only differ in their
+# own name; those are written once and every call goes to the shared copy.
+# Two bodies are merged only if they run exactly the same instructions on the
+# same slots, so callers can't tell which one they called. Merging two loops
+# can make the bodies calling them identical as well, so this runs until
+# nothing else merges.
+
+
+def shape(name, code, names=None, rename=None):
+    # The instructions of body name as a hashable key: calls back into the
+    # body itself are told apart from calls to others, calls are resolved
+    # through names (function -> shared copy), and slots renamed by rename
+    key = []
+    for instruction in code:
+        if rename is not None:
+            instruction = copy.copy(instruction)
+            instruction.rename(rename)
+        if isinstance(instruction, ir.Call):
+            function = names.get(instruction.function, instruction.function) if names else instruction.function
+            key.append((tuple(instruction.conditions), None if function == name else function,
+                        instruction.arguments))
+        else:
+            key.append(repr(instruction))
+    return tuple(key)
+
+
+class Deduplicator:
+    def __init__(self, visitor):
+        self.visitor = visitor
+        self.bodies = dict(visitor.igloops)
+        for function, info in visitor.igfunctions.items():
+            self.bodies[function] = info["code"]
+        # Functions the game runs by name can share another's body, but must
+        # still exist themselves
+        self.kept = {name for name, info in visitor.igfunctions.items() if name in ENTRY_POINTS or info["export"]}
+        self.names = {}
+        self.saved = {"shared function": 0}
+
+    def merge(self):
+        groups = {}
+        for name, code in self.bodies.items():
+            groups.setdefault(shape(name, code, self.names), []).append(name)
+        merged = False
+        for names in groups.values():
+            shared = next((name for name in names if name in self.kept), names[0])
+            for name in names:
+                if name != shared and name not in self.kept:
+                    self.names[name] = shared
+                    self.saved["shared function"] += size(self.bodies.pop(name))
+                    merged = True
+        return merged
+
+    def resolve(self, name):
+        while name in self.names:
+            name = self.names[name]
+        return name
+
+    def run(self):
+        while self.merge():
+            self.names = {name: self.resolve(name) for name in self.names}
+        for code in self.bodies.values():
+            for instruction in code:
+                if isinstance(instruction, ir.Call):
+                    instruction.function = self.resolve(instruction.function)
+        for name in self.names:
+            if name in self.visitor.igloops:
+                del self.visitor.igloops[name]
+                del self.visitor.igloopinfo[name]
+            else:
+                del self.visitor.igfunctions[name]
+        return self.saved
+
+
+def deduplicate(visitor):
+    return Deduplicator(visitor).run()
@@ -4,6 +4,11 @@ class MappingException(Exception):
         self.errors = errors
         
 class CompileTimeException(Exception):
+    def __init__(self, message="", errors=[]):
+        super().__init__(message)
+        self.errors = errors
+        
+class SimulationException(Exception):
     def __init__(self, message="", errors=[]):
         super().__init__(message)
         self.errors = errors
\ No newline at end of file
@@ -0,0 +1,245 @@
+import copy
+
+import ir
+from regalloc import is_temp
+
+# Inlines calls to small functions over the IR, before temps are allocated.
+# The callee's instructions replace the call, each guarded by the call's
+# conditions as well as its own; its temps are renamed to fresh ones, since
+# function temps are private to the function. Everything else (arguments,
+# locals, the result) keeps its slot, so the inlined code behaves exactly as
+# the call did.
+#
+# An argument slot that belongs to a single function only carries a value
+# from a call site into that call, so once the body is inlined the argument
+# copy is forwarded into the instructions reading it.
+
+# Largest function (in instructions) inlined at its call sites
+INLINE_THRESHOLD = 8
+
+
+class Inliner:
+    def __init__(self, visitor, threshold):
+        self.visitor = visitor
+        self.threshold = threshold
+        self.bodies = dict(visitor.igloops)
+        for function, info in visitor.igfunctions.items():
+            self.bodies[function] = info["code"]
+        self.callees = {name: {instruction.function for instruction in code if isinstance(instruction, ir.Call)}
+                        for name, code in self.bodies.items()}
+        self.next_temp = 1 + max([int(slot[4:]) for slot in self.all_slots() if is_temp(slot)], default=-1)
+        self.saved = {"inlined call": 0, "forwarded argument": 0}
+
+    def all_slots(self):
+        slots = set(self.visitor.igmemory)
+        for code in self.bodies.values():
+            for instruction in code:
+                slots |= instruction.reads() | instruction.writes()
+        return slots
+
+    def reaches(self, start, target):
+        stack = list(self.callees.get(start, ()))
+        seen = set()
+        while stack:
+            name = stack.pop()
+            if name == target:
+                return True
+            if name not in seen:
+                seen.add(name)
+                stack.extend(self.callees.get(name, ()))
+        return False
+
+    def postorder(self):
+        # Callees before their callers, so a function is measured with its
+        # own calls already inlined
+        order = []
+        seen = set()
+        for root in self.bodies:
+            if root in seen:
+                continue
+            seen.add(root)
+            stack = [(root, iter(sorted(self.callees[root])))]
+            while stack:
+                name, callees = stack[-1]
+                for callee in callees:
+                    if callee in self.bodies and callee not in seen:
+                        seen.add(callee)
+                        stack.append((callee, iter(sorted(self.callees[callee]))))
+                        break
+                else:
+                    order.append(name)
+                    stack.pop()
+        return order
+
+    def inlinable(self, function):
+        # Loop bodies share temps with the function calling them, so a
+        # function with loops would need them copied as well
+        code = self.bodies[function]
+        return (function in self.visitor.igfunctions and len(code) <= self.threshold
+                and not any(callee in self.visitor.igloops for callee in self.callees[function])
+                and not self.reaches(function, function))
+
+    def closure_writes(self, function):
+        writes = set()
+        seen = {function}
+        stack = [function]
+        while stack:
+            for instruction in self.bodies[stack.pop()]:
+                writes |= instruction.writes()
+                if isinstance(instruction, ir.Call) and instruction.function in self.bodies \
+                        and instruction.function not in seen:
+                    seen.add(instruction.function)
+                    stack.append(instruction.function)
+        return writes
+
+    def expand(self, call):
+        # The callee's instructions as they run at call
+        names = {}
+        for instruction in self.bodies[call.function]:
+            for slot in instruction.reads() | instruction.writes():
+                if is_temp(slot) and slot not in names:
+                    names[slot] = f"_var{self.next_temp}"
+                    self.visitor.igmemory[names[slot]] = self.visitor.igmemory[slot]
+                    self.next_temp += 1
+        expanded = []
+        for instruction in self.bodies[call.function]:
+            instruction = copy.copy(instruction)
+            instruction.rename(names)
+            instruction.conditions = call.conditions + instruction.conditions
+            expanded.append(instruction)
+        return expanded
+
+    def inline_calls(self, name):
+        code = []
+        for instruction in self.bodies[name]:
+            if isinstance(instruction, ir.Call) and self.inlinable(instruction.function):
+                # The call tests its conditions once; the inlined code tests
+                # them on every instruction, so they mustn't change midway
+                guard_slots = set()
+                for condition in instruction.conditions:
+                    guard_slots |= condition.reads()
+                if not guard_slots & self.closure_writes(instruction.function):
+                    code.extend(self.expand(instruction))
+                    self.saved["inlined call"] += 1
+                    continue
+            code.append(instruction)
+        self.bodies[name][:] = code
+        self.callees[name] = {instruction.function for instruction in code if isinstance(instruction, ir.Call)}
+
+    def private_arguments(self):
+        # Argument slots no other function has a local of the same name for
+        private = set()
+        for function, info in self.visitor.igfunctions.items():
+            for arg, _ in info["args"]:
+                if not any(arg in local for other, local in self.visitor.local.items() if other != function):
+                    private.add(arg+"+local")
+        return private
+
+    def forward(self, code, index):
+        # Replaces the reads of the argument copied at index with its source,
+        # and drops the copy, if the argument is dead after those reads
+        copied = code[index]
+        slot = copied.dest
+        source = copied.source if isinstance(copied, ir.Operation) else None
+        guard_slots = set()
+        for condition in copied.conditions:
+            guard_slots |= condition.reads()
+        readers = []
+        # Whether the source or the copy's conditions changed since the copy
+        changed = False
+        for instruction in code[index+1:]:
+            if isinstance(instruction, ir.Call) and instruction.function in self.bodies:
+                use = self.first_use(instruction.function, slot)
+                if use == "write" and not instruction.conditions:
+                    break
+                if use == "read":
+                    return False
+                if use == "write" or self.closure_writes(instruction.function) & (guard_slots | {source}):
+                    changed = True
+                continue
+            reads = slot in instruction.reads()
+            if reads:
+                if changed or instruction.conditions[:len(copied.conditions)] != copied.conditions \
+                        or any(slot in condition.reads() for condition in instruction.conditions) \
+                        or not self.rewritable(instruction, slot, source):
+                    return False
+                readers.append(instruction)
+            if slot in instruction.writes():
+                if reads or instruction.conditions != copied.conditions:
+                    return False
+                break
+            if source in instruction.writes() or guard_slots & instruction.writes():
+                changed = True
+        if not readers:
+            return False
+        for instruction in readers:
+            self.rewrite(code, instruction, slot, copied)
+        del code[index]
+        return True
+
+    def first_use(self, function, slot, seen=None):
+        # "write" if running function sets slot before anything could read
+        # it, None if it doesn't touch slot, "read" otherwise
+        seen = seen if seen is not None else set()
+        seen.add(function)
+        for instruction in self.bodies[function]:
+            if isinstance(instruction, ir.Call) and instruction.function in self.bodies:
+                if instruction.function in seen:
+                    if any(slot in other.reads() | other.writes() for other in self.bodies[instruction.function]):
+                        return "read"
+                    continue
+                use = self.first_use(instruction.function, slot, seen)
+                if use == "write" and not instruction.conditions:
+                    return use
+                if use is not None:
+                    return "read"
+            elif slot in instruction.reads():
+                return "read"
+            elif slot in instruction.writes():
+                full = isinstance(instruction, (ir.Set, ir.LoadData, ir.Test)) or \
+                       isinstance(instruction, ir.Operation) and instruction.op == "="
+                return "write" if full and not instruction.conditions else "read"
+        return None
+
+    def rewritable(self, instruction, slot, source):
+        if isinstance(instruction, ir.Operation):
+            if instruction.dest == slot or instruction.op == "><":
+                return False
+            return source is not None or instruction.op in ("=", "+=", "-=")
+        return source is not None and isinstance(instruction, (ir.Test, ir.Print, ir.StoreData))
+
+    def rewrite(self, code, instruction, slot, copied):
+        if isinstance(copied, ir.Operation):
+            instruction.rename({slot: copied.source})
+            return
+        # A literal argument: 'x = a' and 'x += a' become a set and an add
+        if instruction.op == "=":
+            replacement = ir.Set(instruction.dest, copied.value)
+        else:
+            replacement = ir.Add(instruction.dest, copied.value if instruction.op == "+=" else -copied.value)
+        replacement.conditions = instruction.conditions
+        replacement.line = instruction.line
+        replacement.column = instruction.column
+        code[code.index(instruction)] = replacement
+
+    def forward_arguments(self):
+        private = self.private_arguments()
+        for code in self.bodies.values():
+            index = 0
+            while index < len(code):
+                instruction = code[index]
+                if (isinstance(instruction, ir.Set) or isinstance(instruction, ir.Operation) and instruction.op == "=") \
+                        and instruction.dest in private and self.forward(code, index):
+                    self.saved["forwarded argument"] += 1
+                    continue
+                index += 1
+
+    def run(self):
+        for name in self.postorder():
+            self.inline_calls(name)
+        self.forward_arguments()
+        return self.saved
+
+
+def inline(visitor, threshold=INLINE_THRESHOLD):
+    return Inliner(visitor, threshold).run()
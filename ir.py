@@ -0,0 +1,328 @@
+# Intermediate representation produced by Visitor and turned into commands by
+# backend.py. Slots are plain names ("x", "x+local", "_var0", "_f_add", ...);
+# where a slot lives in game is decided by the backend's layout. Storage paths
+# are relative to the pack's storage, functions are named without namespace.
+
+
+# Constants: read-only slots set once when the pack loads
+
+def constant(value):
+    return f"_const{value}"
+
+def is_constant(slot):
+    return slot.startswith("_const")
+
+def constant_value(slot):
+    return int(slot[len("_const"):])
+
+
+def is_macro(instruction):
+    # Whether the instruction reads a macro argument ('$(key)' in a storage path)
+    paths = [getattr(instruction, "path", None), getattr(instruction, "source", None)]
+    return any(isinstance(path, str) and "$(" in path for path in paths)
+
+
+# Conditions
+
+class Matches:
+    # 'if score <slot> matches <low>..<high>' (either bound may be None)
+    def __init__(self, slot, low=None, high=None, negate=False):
+        self.slot = slot
+        self.low = low
+        self.high = high
+        self.negate = negate
+
+    def reads(self):
+        return {self.slot}
+
+    def inverted(self):
+        return Matches(self.slot, self.low, self.high, not self.negate)
+
+    def renamed(self, names):
+        if self.slot not in names:
+            return self
+        return Matches(names[self.slot], self.low, self.high, self.negate)
+
+    def key(self):
+        return ("matches", self.slot, self.low, self.high, self.negate)
+
+    def __eq__(self, other):
+        return isinstance(other, Matches) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        low = "" if self.low is None else self.low
+        high = "" if self.high is None else self.high
+        bounds = str(low) if self.low == self.high else f"{low}..{high}"
+        return f"{'unless' if self.negate else 'if'} {self.slot} matches {bounds}"
+
+
+class Compare:
+    # 'if score <left> <op> <right>', op one of <, <=, =, >=, >
+    def __init__(self, left, op, right, negate=False):
+        self.left = left
+        self.op = op
+        self.right = right
+        self.negate = negate
+
+    def reads(self):
+        return {self.left, self.right}
+
+    def inverted(self):
+        return Compare(self.left, self.op, self.right, not self.negate)
+
+    def renamed(self, names):
+        if self.left not in names and self.right not in names:
+            return self
+        return Compare(names.get(self.left, self.left), self.op, names.get(self.right, self.right), self.negate)
+
+    def key(self):
+        return ("compare", self.left, self.op, self.right, self.negate)
+
+    def __eq__(self, other):
+        return isinstance(other, Compare) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return f"{'unless' if self.negate else 'if'} {self.left} {self.op} {self.right}"
+
+
+# Instructions
+
+class Instruction:
+    def __init__(self):
+        # Conditions that must all hold for the instruction to run, and the
+        # source position it was generated from
+        self.conditions = []
+        self.line = -1
+        self.column = -1
+
+    def reads(self):
+        # Slots whose value may be read, conditions included
+        slots = set()
+        for condition in self.conditions:
+            slots |= condition.reads()
+        return slots | self.operands()
+
+    def operands(self):
+        return set()
+
+    def writes(self):
+        return set()
+
+    def rename(self, names):
+        # Replaces slots according to names (old -> new), in place
+        self.conditions = [condition.renamed(names) for condition in self.conditions]
+
+    def describe(self):
+        return type(self).__name__
+
+    def __repr__(self):
+        if not self.conditions:
+            return self.describe()
+        return f"[{', '.join(repr(condition) for condition in self.conditions)}] {self.describe()}"
+
+
+class Set(Instruction):
+    def __init__(self, dest, value):
+        super().__init__()
+        self.dest = dest
+        self.value = value
+
+    def writes(self):
+        return {self.dest}
+
+    def rename(self, names):
+        super().rename(names)
+        self.dest = names.get(self.dest, self.dest)
+
+    def describe(self):
+        return f"{self.dest} = {self.value}"
+
+
+class Add(Instruction):
+    # A negative value subtracts
+    def __init__(self, dest, value):
+        super().__init__()
+        self.dest = dest
+        self.value = value
+
+    def operands(self):
+        return {self.dest}
+
+    def writes(self):
+        return {self.dest}
+
+    def rename(self, names):
+        super().rename(names)
+        self.dest = names.get(self.dest, self.dest)
+
+    def describe(self):
+        return f"{self.dest} += {self.value}"
+
+
+class Operation(Instruction):
+    # 'scoreboard players operation', op one of =, +=, -=, *=, /=, %=, <, >, ><
+    def __init__(self, dest, op, source):
+        super().__init__()
+        self.dest = dest
+        self.op = op
+        self.source = source
+
+    def operands(self):
+        if self.op == "=":
+            return {self.source}
+        return {self.dest, self.source}
+
+    def writes(self):
+        if self.op == "><":
+            return {self.dest, self.source}
+        return {self.dest}
+
+    def rename(self, names):
+        super().rename(names)
+        self.dest = names.get(self.dest, self.dest)
+        self.source = names.get(self.source, self.source)
+
+    def describe(self):
+        return f"{self.dest} {self.op} {self.source}"
+
+
+class Test(Instruction):
+    # dest = 1 if condition holds, 0 otherwise
+    def __init__(self, dest, condition):
+        super().__init__()
+        self.dest = dest
+        self.condition = condition
+
+    def operands(self):
+        return self.condition.reads()
+
+    def writes(self):
+        return {self.dest}
+
+    def rename(self, names):
+        super().rename(names)
+        self.dest = names.get(self.dest, self.dest)
+        self.condition = self.condition.renamed(names)
+
+    def describe(self):
+        return f"{self.dest} = ({self.condition!r})"
+
+
+# Storage
+
+class LoadData(Instruction):
+    # dest = value at path
+    def __init__(self, dest, path):
+        super().__init__()
+        self.dest = dest
+        self.path = path
+
+    def writes(self):
+        return {self.dest}
+
+    def rename(self, names):
+        super().rename(names)
+        self.dest = names.get(self.dest, self.dest)
+
+    def describe(self):
+        return f"{self.dest} = storage {self.path}"
+
+
+class StoreData(Instruction):
+    # value at path = source
+    def __init__(self, path, source):
+        super().__init__()
+        self.path = path
+        self.source = source
+
+    def operands(self):
+        return {self.source}
+
+    def rename(self, names):
+        super().rename(names)
+        self.source = names.get(self.source, self.source)
+
+    def describe(self):
+        return f"storage {self.path} = {self.source}"
+
+
+class DataModify(Instruction):
+    # 'data modify', mode one of set, append, prepend; with either an SNBT
+    # value or the path of another value in storage
+    def __init__(self, path, mode, value=None, source=None):
+        super().__init__()
+        self.path = path
+        self.mode = mode
+        self.value = value
+        self.source = source
+
+    def describe(self):
+        value = self.value if self.source is None else f"storage {self.source}"
+        return f"storage {self.path} {self.mode} {value}"
+
+
+class DataRemove(Instruction):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def describe(self):
+        return f"remove storage {self.path}"
+
+
+# Control flow and output
+
+class Call(Instruction):
+    # Runs another function (or loop body) of the pack; a macro function gets
+    # the compound at storage path arguments, and reads its entries as $(key)
+    def __init__(self, function, arguments=None):
+        super().__init__()
+        self.function = function
+        self.arguments = arguments
+
+    def describe(self):
+        if self.arguments is None:
+            return f"call {self.function}"
+        return f"call {self.function} with storage {self.arguments}"
+
+
+class Print(Instruction):
+    # tellraw to selector; components are Text or Score
+    def __init__(self, selector, components):
+        super().__init__()
+        self.selector = selector
+        self.components = components
+
+    def operands(self):
+        return {component.slot for component in self.components if isinstance(component, Score)}
+
+    def rename(self, names):
+        super().rename(names)
+        self.components = [Score(names.get(component.slot, component.slot)) if isinstance(component, Score)
+                           else component for component in self.components]
+
+    def describe(self):
+        return f"print {self.selector} {self.components!r}"
+
+
+class Text:
+    def __init__(self, text, color):
+        self.text = text
+        self.color = color
+
+    def __repr__(self):
+        return f"{self.text!r} {self.color}"
+
+
+class Score:
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __repr__(self):
+        return self.slot
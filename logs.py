@@ -8,10 +8,14 @@ NL = "\n"
 class Logger:
     def __init__(self, filename):
         self.filename = filename
+        # Only errors get through, for code compiled more than once
+        self.quiet = False
         with open(self.filename, "r") as file:
             self.code = file.readlines()
         
     def log(self, message, line=-1, char=-1, type_="info"):
+        if self.quiet and type_ != "error":
+            return
         if type_ == "error":
             color = Fore.RED
         elif type_ == "warning":
@@ -1,26 +1,57 @@
+import argparse
+import cProfile
+import json
 import logging
 import os
 import pprint
 import shutil
+import sys
 
 from antlr4 import CommonTokenStream, FileStream
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.ErrorListener import ConsoleErrorListener, ErrorListener
+from antlr4.error.Errors import ParseCancellationException
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
 
+import backend
+import costs
+import deadcode
+import dedupe
+import inliner
+import ir
+import peephole
+import redundancy
+import references
+import regalloc
+import treecache
 from exceptions import CompileTimeException, MappingException
 from MappingVisitor import MappingVisitor
 from MineScriptLexer import MineScriptLexer
 from MineScriptParser import MineScriptParser
-from Visitor import Visitor
+from options import Options
+from profiler import Profiler, phase
+from simulator import read_pack
+from Visitor import PAGE_SIZE, UNROLL_THRESHOLD, Visitor
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 
 packmeta = """{
   "pack": {
-    "pack_format": 1,
+    "pack_format": %d,
     "description": "%s"
   }
 }
 """
 
+# pack_format of the data packs each Minecraft version reads, up to the last
+# one using the data/<namespace>/functions layout the pack is written in
+PACK_FORMATS = {
+    "1.13": 4, "1.14": 4, "1.15": 5, "1.16": 5, "1.16.2": 6, "1.17": 7, "1.18": 8, "1.18.2": 9,
+    "1.19": 10, "1.19.4": 12, "1.20": 15, "1.20.2": 18, "1.20.3": 26, "1.20.5": 41,
+}
+# Function macros are read from this pack_format (1.20.2) on
+MACRO_PACK_FORMAT = 18
+
 load_file = """{
     "values": [
         "%s:load"
@@ -42,7 +73,7 @@ def mkdir(*args):
     except FileExistsError:
         pass
 
-def create_structure(name, description, path):
+def create_structure(name, description, path, pack_format=1):
     try:
         os.mkdir(os.path.join(path, name))
     except FileExistsError:
@@ -51,7 +82,7 @@ def create_structure(name, description, path):
         
     mkdir(os.path.join(path, name, "data"))
     with open(os.path.join(path, name, "pack.mcmeta"), "w") as file:
-        file.write(packmeta%description)
+        file.write(packmeta%(pack_format, description))
     mkdir(os.path.join(path, name, "data", "minecraft"))
     mkdir(os.path.join(path, name, "data", name))
     mkdir(os.path.join(path, name, "data", "minecraft", "tags"))
@@ -63,19 +94,36 @@ def create_structure(name, description, path):
     with open(os.path.join(path, name, "data", "minecraft", "tags", "functions", "tick.json"), "w") as file:
         file.write(tick_file%name)
         
-def assemble_pack(name, visitor, path):
+def write_function(path, name, function, code):
+    with open(os.path.join(path, name, "data", name, "functions", f"{function}.mcfunction"), "w") as file:
+        for command in code:
+            file.write(command + "\n")
+    return len(code)
+
+def assemble_pack(name, visitor, path, options=None):
+    if options is None:
+        options = Options()
+    layout = backend.LAYOUTS[options.layout]()
     commands = 0
     added = set()
+    objectives = set()
     with open(os.path.join(path, name, "data", name, "functions", "_setup.mcfunction"), "w") as usrvar:
         with open(os.path.join(path, name, "data", name, "functions", "_vars.mcfunction"), "w") as tempvar:
+            def add_objective(file, slot, display):
+                objective, display = layout.objective(slot, display)
+                if objective not in objectives:
+                    file.write(f"scoreboard objectives add {objective} dummy \"{display}\"\n")
+                    objectives.add(objective)
+                    return 1
+                return 0
+            
             for variable in visitor.igmemory:
                 if variable.startswith("_"):
                     file = tempvar
                 else:
                     file = usrvar
                 if not visitor.igmemory[variable].endswith("[]") or variable.startswith("_"):
-                    file.write(f"scoreboard objectives add {variable} dummy \"{variable}\"\n")
-                    commands += 1
+                    commands += add_objective(file, variable, variable)
                     
             for func in visitor.local:
                 for variable in visitor.local[func]:
@@ -85,59 +133,153 @@ def assemble_pack(name, visitor, path):
                         else:
                             file = usrvar
                         if not visitor.local[func][variable].endswith("[]") or variable.startswith("_"):
-                            file.write(f"scoreboard objectives add {variable}+local dummy \"{variable}\"\n")
-                            commands += 1
+                            commands += add_objective(file, f"{variable}+local", variable)
                         added.add(variable)
-                
-    for loop in visitor.igloops:
-        with open(os.path.join(path, name, "data", name, "functions", f"{loop}.mcfunction"), "w") as file:
-            for command in visitor.igloops[loop]:
-                file.write(command + "\n")
+                        
+            renderer = backend.Backend(name, layout)
+            for constant, value in visitor.constants.items():
+                for command in renderer.render(ir.Set(constant, value)):
+                    tempvar.write(command + "\n")
+                    commands += 1
+                    
+            if options.instrument:
+                tempvar.write("scoreboard objectives add _profile dummy \"_profile\"\n")
                 commands += 1
-                
+    
+    functions = {}
+    for loop in visitor.igloops:
+        functions[loop] = (visitor.igloops[loop], visitor.igsources[loop])
     for function in visitor.igfunctions:
-        with open(os.path.join(path, name, "data", name, "functions", f"{function}.mcfunction"), "w") as file:
-            if function == "load":
-                file.write(f"function {name}:_setup\n")
-                file.write(f"function {name}:_vars\n")
-                commands += 2
-            for command in visitor.igfunctions[function]["code"]:
-                file.write(command + "\n")
-                commands += 1
-    if "load" not in visitor.igfunctions:
-        with open(os.path.join(path, name, "data", name, "functions", "load.mcfunction"), "w") as file:
-            file.write(f"function {name}:_setup\n")
-            file.write(f"function {name}:_vars\n")
-            commands += 2
+        functions[function] = (visitor.igfunctions[function]["code"], visitor.igsources[function])
+    if "load" not in functions:
+        functions["load"] = ([], [])
+    if "tick" not in functions and options.instrument:
+        functions["tick"] = ([], [])
+        
+    sourcemap = {}
+    for function, (code, sources) in functions.items():
+        prefix = []
+        if function == "load":
+            prefix.append(f"function {name}:_setup")
+            prefix.append(f"function {name}:_vars")
+        if options.instrument:
+            prefix.append(f"scoreboard players add #{function} _profile 1")
+        commands += write_function(path, name, function, prefix + code)
+        sourcemap[f"{name}:{function}"] = [None]*len(prefix) + [list(source) if source is not None else None
+                                                               for source in sources]
+    if "tick" not in functions:
+        # tick.json always references it, and a missing function would make the tag fail to load
+        write_function(path, name, "tick", [])
+        
+    if options.instrument:
+        dump = ['tellraw @a {"text":"MineScript profile (calls per function):","color":"gold"}']
+        for function in sorted(functions):
+            dump.append(f'tellraw @a [{{"text":"  {function}: ","color":"gray"}},'
+                        f'{{"score":{{"name":"#{function}","objective":"_profile"}}}}]')
+        commands += write_function(path, name, "_profile_dump", dump)
+        commands += write_function(path, name, "_profile_reset", ["scoreboard players reset * _profile"])
+        with open(os.path.join(path, f"{name}.sourcemap.json"), "w") as file:
+            json.dump({"source": visitor.logger.filename, "functions": sourcemap}, file)
     print(commands)
+    return commands
+
+class ErrorCounter(ErrorListener):
+    def __init__(self):
+        self.errors = 0
+        
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        self.errors += 1
+
+def parse(parser, stream):
+    # Try the much faster SLL prediction first; it only fails on syntax
+    # errors or (rarely) ambiguous input, in which case reparse with full LL
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser.removeErrorListeners()
+    parser._errHandler = BailErrorStrategy()
+    try:
+        return parser.prog()
+    except ParseCancellationException:
+        stream.seek(0)
+        parser.reset()
+        parser.addErrorListener(ConsoleErrorListener.INSTANCE)
+        parser._errHandler = DefaultErrorStrategy()
+        parser._interp.predictionMode = PredictionMode.LL
+        return parser.prog()
 
-def get_tree(file):
+def get_tree(file, cache_dir=None):
+    if cache_dir is not None:
+        key = treecache.cache_key(file)
+        tree = treecache.load(cache_dir, key)
+        if tree is not None:
+            return tree
+        
     inp = FileStream(file)
     lexer = MineScriptLexer(inp)
+    lexer_errors = ErrorCounter()
+    lexer.addErrorListener(lexer_errors)
     stream = CommonTokenStream(lexer)
     parser = MineScriptParser(stream)
-    tree = parser.prog()
+    tree = parse(parser, stream)
+    if cache_dir is not None and lexer_errors.errors == 0 and parser.getNumberOfSyntaxErrors() == 0:
+        treecache.store(cache_dir, key, stream.tokens, tree)
     return tree
+
+def get_cache_dir(file, options):
+    if not options.cache:
+        return None
+    if options.cache_dir is not None:
+        return options.cache_dir
+    return os.path.join(parent(file), "build", ".cache")
     
-def visit(name, file):
-    tree = get_tree(file)
+def map_tree(name, file, tree):
     mapvisitor = MappingVisitor(name, file)
     try:
         mapvisitor.visit(tree)
     except MappingException:
         return None
-    visitor = Visitor(name, file)
+    return mapvisitor
+
+def compile_tree(name, file, tree, mapvisitor, profiler=None, unroll_threshold=UNROLL_THRESHOLD, macros=False,
+                 page_size=PAGE_SIZE):
+    visitor = Visitor(name, file, unroll_threshold, macros, page_size)
     visitor.igfunctions = mapvisitor.igfunctions
     visitor.igmemory = mapvisitor.igmemory
+    visitor.declarations = mapvisitor.declarations
+    if profiler is not None:
+        profiler.instrument(visitor)
     try:
         visitor.visit(tree)
     except CompileTimeException:
         return None
+    return visitor
+    
+def visit(name, file, options=None, profiler=None):
+    if options is None:
+        options = Options()
+    with phase(profiler, "get_tree"):
+        tree = get_tree(file, get_cache_dir(file, options))
+    with phase(profiler, "MappingVisitor"):
+        mapvisitor = map_tree(name, file, tree)
+    if mapvisitor is None:
+        return None
+    with phase(profiler, "Visitor"):
+        # An instrumented pack counts calls per loop, so it keeps them all
+        unroll_threshold = 0 if options.instrument else options.unroll_threshold
+        visitor = compile_tree(name, file, tree, mapvisitor, profiler, unroll_threshold,
+                               options.pack_format >= MACRO_PACK_FORMAT, options.page_size)
+    if visitor is None:
+        return None
     print(visitor.tempvars)
     print(visitor.memory)
     return visitor
 
-def main(name, file):
+def report_optimizations(optimizations):
+    print(f"{'Optimization':<30} {'Saved':>6}")
+    for rule, saved in optimizations.items():
+        print(f"{rule:<30} {saved:>6}")
+    print(f"{'total':<30} {sum(optimizations.values()):>6}")
+
+def build(name, file, options, profiler=None):
     path = parent(file)
     
     path = os.path.join(path, "build")
@@ -146,20 +288,148 @@ def main(name, file):
     distpath = os.path.join(parent(file), "dist")
     mkdir(distpath)
 
-    create_structure(name, "Generated using MineScript 2.0", path)
-    visitor = visit(name, file)
+    create_structure(name, "Generated using MineScript 2.0", path, options.pack_format)
+    visitor = visit(name, file, options, profiler)
     if visitor is None:
-        return
+        return False
+
+    optimizations = dict(visitor.optimizations)
+    # An instrumented pack counts calls per function, so it keeps them all
+    if options.inline and not options.instrument:
+        with phase(profiler, "inline"):
+            optimizations.update(inliner.inline(visitor, options.inline_threshold))
+    if options.pass_by_reference:
+        with phase(profiler, "references"):
+            optimizations.update(references.pass_arrays(visitor))
+    if options.eliminate_dead_code:
+        with phase(profiler, "deadcode"):
+            optimizations.update(deadcode.eliminate(visitor))
+    if options.eliminate_redundancy:
+        with phase(profiler, "redundancy"):
+            optimizations.update(redundancy.eliminate(visitor))
+    if options.allocate_temps:
+        with phase(profiler, "regalloc"):
+            optimizations.update(regalloc.allocate(visitor))
+    if options.deduplicate:
+        with phase(profiler, "dedupe"):
+            optimizations.update(dedupe.deduplicate(visitor))
+    with phase(profiler, "render"):
+        backend.render(visitor, backend.LAYOUTS[options.layout]())
+    if options.peephole:
+        with phase(profiler, "peephole"):
+            optimizations.update(peephole.optimize(visitor, options.merge_threshold))
+    if options.optimization_report:
+        report_optimizations(optimizations)
     
-    assemble_pack(name, visitor, path)
-    shutil.make_archive(os.path.join(distpath, name), 'zip', os.path.join(path, name))
+    with phase(profiler, "assemble_pack"):
+        commands = assemble_pack(name, visitor, path, options)
+        
+    if options.costs or options.budget is not None:
+        with phase(profiler, "costs"):
+            functions, load, tick = read_pack(os.path.join(path, name))
+            analyzer = costs.from_visitor(name, functions, visitor)
+            if options.costs:
+                analyzer.report([("load", load), ("tick", tick)])
+            if options.budget is not None:
+                type_ = "error" if options.budget_error else "warning"
+                within = all([analyzer.check_budget(entry, options.budget, visitor.logger, type_) for entry in tick])
+                if not within and options.budget_error:
+                    return False
+                
+    with phase(profiler, "make_archive"):
+        shutil.make_archive(os.path.join(distpath, name), 'zip', os.path.join(path, name))
+        
+    if profiler is not None:
+        profiler.count("commands", commands)
+        profiler.count("functions", len(visitor.igfunctions))
+        profiler.count("loops", len(visitor.igloops))
+        profiler.count("temp vars", len([var for var in visitor.igmemory if var.startswith("_var")]))
+        for rule, saved in optimizations.items():
+            profiler.count(f"saved: {rule}", saved)
+    return True
+
+def main(name, file, options=None):
+    if options is None:
+        options = Options()
+    profiler = Profiler() if options.profile else None
+    if options.profile_output is None:
+        success = build(name, file, options, profiler)
+    else:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+        try:
+            success = build(name, file, options, profiler)
+        finally:
+            cprofile.disable()
+            cprofile.dump_stats(options.profile_output)
+    if profiler is not None:
+        profiler.report()
+    return success
 
 if __name__ == "__main__":
-    # file = "test.txt"
-    # v = visit("test", file)
-    # if v is not None:
-    #     print(v.igmemory)
-    #     print(v.tempvars)
-    #     pprint.pprint(v.igfunctions)
-    #     pprint.pprint(v.igloops)
-    main("test", "test.txt")
+    parser = argparse.ArgumentParser(description="Compile a MineScript file into a datapack")
+    parser.add_argument("file", nargs="?", default="test.txt")
+    parser.add_argument("--name", help="datapack name (default: the file name without extension)")
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="always lex and parse the source, ignoring the parse tree cache")
+    parser.add_argument("--profile", action="store_true",
+                        help="report time spent per compiler phase and visitor method")
+    parser.add_argument("--profile-output", metavar="FILE",
+                        help="dump cProfile statistics of the whole build to FILE")
+    parser.add_argument("--instrument", action="store_true",
+                        help="count calls of every function in game (see <pack>:_profile_dump) and "
+                             "write a source map next to the pack")
+    parser.add_argument("--costs", action="store_true",
+                        help="print the static worst-case command count of every function")
+    parser.add_argument("--budget", type=int, metavar="COMMANDS",
+                        help="warn when the worst-case commands per tick exceed COMMANDS")
+    parser.add_argument("--budget-error", action="store_true",
+                        help="fail the build instead of warning when over budget")
+    parser.add_argument("--no-inline", dest="inline", action="store_false",
+                        help="always call functions instead of inlining the small ones")
+    parser.add_argument("--inline-threshold", type=int, default=inliner.INLINE_THRESHOLD, metavar="N",
+                        help="inline functions of at most N instructions (default: %(default)s)")
+    parser.add_argument("--unroll-threshold", type=int, default=UNROLL_THRESHOLD, metavar="N",
+                        help="unroll counted for loops into at most N instructions, 0 to never unroll "
+                             "(default: %(default)s)")
+    parser.add_argument("--copy-arrays", dest="pass_by_reference", action="store_false",
+                        help="copy array arguments on every call, even when nothing writes them")
+    parser.add_argument("--keep-dead-code", dest="eliminate_dead_code", action="store_false",
+                        help="write every function and variable, even those load and tick never reach")
+    parser.add_argument("--keep-redundant", dest="eliminate_redundancy", action="store_false",
+                        help="compute every expression where it's written, even if its value is at hand")
+    parser.add_argument("--no-temp-allocation", dest="allocate_temps", action="store_false",
+                        help="keep the temporaries Visitor picked instead of allocating them by liveness")
+    parser.add_argument("--no-deduplicate", dest="deduplicate", action="store_false",
+                        help="write every function and loop body, even identical ones")
+    parser.add_argument("--target", choices=PACK_FORMATS, metavar="VERSION",
+                        help="Minecraft version the pack is for, which decides its pack_format and the "
+                             "commands it may use (one of %(choices)s; default: pack_format 1, no macros)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, metavar="N",
+                        help="split arrays into pages of N elements, so indexing them in game only scans "
+                             "one page; ignored on targets with macros (default: %(default)s, flat lists)")
+    parser.add_argument("--layout", choices=sorted(backend.LAYOUTS), default="objectives",
+                        help="where variables live: one objective each, or fake players on a single objective")
+    parser.add_argument("--no-peephole", dest="peephole", action="store_false",
+                        help="write the commands exactly as generated, without the peephole pass")
+    parser.add_argument("--merge-prefixes", dest="merge_threshold", type=int, default=peephole.MERGE_THRESHOLD,
+                        metavar="N", help="move runs of at least N commands sharing an execute prefix into their own function")
+    parser.add_argument("--optimization-report", action="store_true",
+                        help="print how many commands each optimization removed")
+    args = parser.parse_args()
+    
+    name = args.name
+    if name is None:
+        name = os.path.splitext(os.path.basename(args.file))[0]
+    options = Options(cache=args.cache, profile=args.profile, profile_output=args.profile_output,
+                      instrument=args.instrument, costs=args.costs, budget=args.budget,
+                      budget_error=args.budget_error, layout=args.layout, inline=args.inline,
+                      pack_format=PACK_FORMATS[args.target] if args.target is not None else 1,
+                      page_size=args.page_size,
+                      inline_threshold=args.inline_threshold, unroll_threshold=args.unroll_threshold,
+                      pass_by_reference=args.pass_by_reference, eliminate_dead_code=args.eliminate_dead_code,
+                      eliminate_redundancy=args.eliminate_redundancy, allocate_temps=args.allocate_temps,
+                      deduplicate=args.deduplicate, peephole=args.peephole,
+                      merge_threshold=args.merge_threshold,
+                      optimization_report=args.optimization_report)
+    sys.exit(0 if main(name, args.file, options) else 1)
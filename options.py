@@ -0,0 +1,57 @@
+import inliner
+import peephole
+from Visitor import PAGE_SIZE, UNROLL_THRESHOLD
+
+
+class Options:
+    def __init__(self, **kwargs):
+        # Parse trees are cached on disk, keyed by source hash and grammar version
+        self.cache = True
+        self.cache_dir = None
+        # Per-phase/per-method timing report, and an optional cProfile dump
+        self.profile = False
+        self.profile_output = None
+        # Call counters in every function, a _profile_dump function and a source map
+        self.instrument = False
+        # Static worst-case cost report, and the per-tick command budget
+        self.costs = False
+        self.budget = None
+        self.budget_error = False
+        # Where variables live (see backend.LAYOUTS)
+        self.layout = "objectives"
+        # pack_format written to pack.mcmeta (see minescript.PACK_FORMATS); from
+        # MACRO_PACK_FORMAT on, arrays are indexed through function macros
+        self.pack_format = 1
+        # Arrays split into pages of this many elements, so an index that's only
+        # known in game scans one page (see Visitor.PAGE_SIZE; 0 keeps flat lists,
+        # and so does a target with macros)
+        self.page_size = PAGE_SIZE
+        # Calls to small functions replaced by their body (see inliner.INLINE_THRESHOLD)
+        self.inline = True
+        self.inline_threshold = inliner.INLINE_THRESHOLD
+        # Counted for loops with literal bounds unrolled, fully or partly, into
+        # at most this many instructions (see Visitor.UNROLL_THRESHOLD; 0 never unrolls)
+        self.unroll_threshold = UNROLL_THRESHOLD
+        # Array arguments nothing writes read from the array passed instead of
+        # a copy of it (see references.py)
+        self.pass_by_reference = True
+        # Functions not reachable from load, tick or an 'export' function, unused
+        # variables and dead storage writes left out of the pack (see deadcode.py)
+        self.eliminate_dead_code = True
+        # Loop-invariant expressions computed before the loop, and repeated ones
+        # copied from where they were computed already (see redundancy.py)
+        self.eliminate_redundancy = True
+        # Temps allocated by liveness over the IR (see regalloc.py) instead of Visitor's pool
+        self.allocate_temps = True
+        # Identical function and loop bodies written once (see dedupe.py)
+        self.deduplicate = True
+        # Peephole pass over the generated commands (merge_threshold: see peephole.MERGE_THRESHOLD),
+        # and a per-rule report of what it saved
+        self.peephole = True
+        self.merge_threshold = peephole.MERGE_THRESHOLD
+        self.optimization_report = False
+
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise TypeError(f"Unknown build option '{key}'")
+            setattr(self, key, value)
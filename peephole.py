@@ -0,0 +1,506 @@
+import re
+
+# Peephole optimizer over the command lists produced by Visitor. Commands are
+# parsed just enough to know which scoreboard slots (holder, objective) they
+# read and write; anything that isn't understood is left untouched and acts
+# as a barrier for the rules below.
+
+TEMP = re.compile(r"^#?_var\d+$")
+SCORE_TEXT = re.compile(r'"name":"([^"]+)","objective":"([^"]+)"')
+FUNCTION_CALL = re.compile(r"^function (\S+)(?: with storage \S+ \S+)?$")
+
+# Minimum number of consecutive commands sharing an execute prefix before
+# they are moved into their own function. The extra call costs one command
+# each time the prefix holds, so this is off (0) unless asked for.
+MERGE_THRESHOLD = 0
+
+INT_MAX = 2**31 - 1
+
+RULES = ["no-op", "combined add/remove", "dead store", "overwritten set", "coalesced copy",
+         "merged prefix checks"]
+
+def is_integer(text):
+    return re.match(r"^-?\d+$", text) is not None
+
+def is_temp(slot):
+    return TEMP.match(slot[0]) is not None or TEMP.match(slot[1]) is not None
+
+
+class Command:
+    def __init__(self, conditions, body, source, tokens=None):
+        # conditions: list of execute subcommands (each a list of tokens)
+        # body: the command after 'run' (or the whole command)
+        self.conditions = conditions
+        self.body = body
+        self.source = source
+        self.analyze(tokens if tokens is not None else body.split(" "))
+
+    @classmethod
+    def parse(cls, text, source):
+        # Nested executes are flattened into one condition list, unless a
+        # store would then apply to a different command
+        tokens = text.split(" ")
+        conditions = []
+        start = 0
+        store = False
+        while tokens[start] == "execute" and not store:
+            i = start + 1
+            parsed = []
+            while i < len(tokens) and tokens[i] != "run":
+                length = subcommand_length(tokens, i)
+                if length is None or i + length > len(tokens):
+                    break
+                parsed.append(tokens[i:i + length])
+                store = store or tokens[i] == "store"
+                i += length
+            if i >= len(tokens) or tokens[i] != "run":
+                break
+            conditions.extend(parsed)
+            start = i + 1
+        body = tokens[start:]
+        return cls(conditions, " ".join(body), source, body)
+
+    def analyze(self, tokens):
+        self.reads = set()
+        self.writes = set()
+        self.target = None
+        self.op = None
+        self.operand = None
+        self.call = None
+        self.opaque = False
+        # Scores the execute conditions test, and whether a store is involved
+        self.guard = condition_slots(self.conditions)
+        self.store = any(sub[0] == "store" for sub in self.conditions)
+        self.reads |= self.guard
+        for sub in self.conditions:
+            if sub[0] == "store" and sub[2] == "score":
+                self.writes.add((sub[3], sub[4]))
+
+        if tokens[0] == "scoreboard" and len(tokens) >= 5 and tokens[1] == "players":
+            action = tokens[2]
+            slot = (tokens[3], tokens[4])
+            if action in ("set", "add", "remove") and len(tokens) == 6 and is_integer(tokens[5]):
+                self.target, self.op, self.operand = slot, action, int(tokens[5])
+                self.writes.add(slot)
+                if action != "set":
+                    self.reads.add(slot)
+            elif action == "operation" and len(tokens) == 8:
+                source = (tokens[6], tokens[7])
+                self.target, self.op, self.operand = slot, tokens[5], source
+                self.reads.add(source)
+                self.writes.add(slot)
+                if self.op != "=":
+                    self.reads.add(slot)
+                if self.op == "><":
+                    self.writes.add(source)
+            elif action == "get" and len(tokens) == 5:
+                self.reads.add(slot)
+            else:
+                self.opaque = True
+        elif tokens[0] == "scoreboard" and len(tokens) >= 2 and tokens[1] == "objectives":
+            pass
+        elif tokens[0] == "data":
+            pass
+        elif tokens[0] == "tellraw":
+            self.reads.update(SCORE_TEXT.findall(self.body))
+        elif FUNCTION_CALL.match(self.body):
+            self.call = FUNCTION_CALL.match(self.body).group(1)
+        else:
+            self.opaque = True
+
+    @property
+    def pure(self):
+        # Whether the command's only effect is writing self.target (or the
+        # store target), so it can be dropped when that slot is dead
+        if self.opaque or self.call is not None:
+            return False
+        if self.store:
+            stores = [sub for sub in self.conditions if sub[0] == "store"]
+            body = self.body.split(" ")
+            side_effect_free = (body[0] == "data" and body[1] == "get") or (body[0] == "scoreboard" and body[2] == "get")
+            return side_effect_free and len(stores) == 1 and stores[0][2] == "score"
+        return self.target is not None and self.op != "><"
+
+    def condition_text(self):
+        return " ".join(" ".join(sub) for sub in self.conditions)
+
+    def written_slot(self):
+        if self.target is not None:
+            return self.target
+        stores = [sub for sub in self.conditions if sub[0] == "store" and sub[2] == "score"]
+        return (stores[0][3], stores[0][4]) if stores else None
+
+    def overwrites(self, slot):
+        # Whether running the command always replaces slot's value
+        if self.target != slot or self.store:
+            return False
+        return self.op == "set" or (self.op == "=" and self.operand != slot)
+
+    def text(self):
+        if not self.conditions:
+            return self.body
+        return f"execute {self.condition_text()} run {self.body}"
+
+    def replace_body(self, body):
+        return Command(self.conditions, body, self.source)
+
+
+def condition_slots(conditions):
+    slots = set()
+    for sub in conditions:
+        if sub[0] in ("if", "unless") and sub[1] == "score":
+            slots.add((sub[2], sub[3]))
+            if sub[4] != "matches":
+                slots.add((sub[5], sub[6]))
+    return slots
+
+def subcommand_length(tokens, i):
+    keyword = tokens[i]
+    if keyword in ("if", "unless") and i + 1 < len(tokens):
+        kind = tokens[i + 1]
+        if kind == "score" and i + 4 < len(tokens):
+            return 6 if tokens[i + 4] == "matches" else 7
+        if kind == "data" and i + 2 < len(tokens) and tokens[i + 2] == "storage":
+            return 5
+        return None
+    if keyword == "store" and i + 2 < len(tokens):
+        if tokens[i + 2] == "score":
+            return 5
+        if tokens[i + 2] == "storage":
+            return 7
+    return None
+
+
+class PeepholeOptimizer:
+    def __init__(self, namespace, functions, threshold=MERGE_THRESHOLD):
+        # functions: {name: [(command, source)]}, names without the namespace
+        self.namespace = namespace
+        self.threshold = threshold
+        self.functions = {name: [Command.parse(text, source) for text, source in code]
+                          for name, code in functions.items()}
+        self.saved = {rule: 0 for rule in RULES}
+        self.blocks = {}
+        # Referenced temps, call closures and live-out sets. The rules only
+        # ever remove commands or rename a temp to a slot the function already
+        # uses, so values computed from the original code remain safe
+        # over-approximations and are never invalidated.
+        self.temps = {}
+        self.cache = {}
+
+    def local_name(self, call):
+        prefix = f"{self.namespace}:"
+        if call is not None and call.startswith(prefix) and call[len(prefix):] in self.functions:
+            return call[len(prefix):]
+        return None
+
+    def closure(self, name):
+        # Every function that may run when name is called
+        seen = set()
+        stack = [name]
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            for command in self.functions.get(current, []):
+                callee = self.local_name(command.call)
+                if command.call is not None and callee is None:
+                    return None
+                if callee is not None:
+                    stack.append(callee)
+        return seen
+
+    def referenced_temps(self, name):
+        if name not in self.temps:
+            temps = set()
+            for command in self.functions[name]:
+                temps |= {slot for slot in command.reads | command.writes if is_temp(slot)}
+                if command.opaque:
+                    tokens = command.body.split(" ")
+                    temps |= {(holder, objective) for holder, objective in zip(tokens, tokens[1:])
+                              if is_temp((holder, objective))}
+            self.temps[name] = temps
+        return self.temps[name]
+
+    def call_reads(self, command):
+        # Temps a call may read: everything referenced by the callee's closure
+        key = ("reads", command.call)
+        if key not in self.cache:
+            names = self.closure(self.local_name(command.call)) if self.local_name(command.call) else None
+            if names is None:
+                self.cache[key] = None
+            else:
+                self.cache[key] = set().union(*[self.referenced_temps(name) for name in names])
+        return self.cache[key]
+
+    def call_writes(self, command):
+        key = ("writes", command.call)
+        if key not in self.cache:
+            names = self.closure(self.local_name(command.call)) if self.local_name(command.call) else None
+            writes = set() if names is not None else None
+            for name in names or []:
+                if any(callee_command.opaque for callee_command in self.functions[name]):
+                    writes = None
+                    break
+                for callee_command in self.functions[name]:
+                    writes |= callee_command.writes
+            self.cache[key] = writes
+        return self.cache[key]
+
+    def live_out(self, name):
+        # Temps that may be read after the function returns: everything its
+        # callers (transitively) reference, and all of its own if it can
+        # re-enter itself
+        key = ("live", name)
+        if key not in self.cache:
+            if "callers" not in self.cache:
+                self.cache["callers"] = {}
+                for caller, commands in self.functions.items():
+                    for command in commands:
+                        callee = self.local_name(command.call)
+                        if callee is not None:
+                            self.cache["callers"].setdefault(callee, set()).add(caller)
+            callers = self.cache["callers"]
+            seen = set()
+            stack = list(callers.get(name, []))
+            while stack:
+                current = stack.pop()
+                if current not in seen:
+                    seen.add(current)
+                    stack.extend(callers.get(current, []))
+            self.cache[key] = set().union(*[self.referenced_temps(caller) for caller in seen])
+        return self.cache[key]
+
+    def dead_after(self, name, commands, i, slot):
+        # Whether the value commands[i] leaves in slot can never be read. A
+        # later write only counts as overwriting it if it runs whenever
+        # commands[i] did: unconditionally, or under a prefix of the same
+        # conditions whose scores haven't changed since.
+        conditions = commands[i].conditions
+        guard = commands[i].guard
+        guarded = not (commands[i].writes & guard)
+        for command in commands[i + 1:]:
+            if command.opaque:
+                return False
+            if command.call is not None:
+                if not is_temp(slot):
+                    return False
+                reads = self.call_reads(command)
+                if reads is None or slot in reads:
+                    return False
+                writes = self.call_writes(command)
+                if writes is None or writes & guard:
+                    guarded = False
+                continue
+            if slot in command.reads:
+                return False
+            if command.overwrites(slot) and (not command.conditions or
+                                             (guarded and conditions[:len(command.conditions)] == command.conditions)):
+                return True
+            if command.writes & guard:
+                guarded = False
+        return is_temp(slot) and slot not in self.live_out(name)
+
+    def remove_noops(self, commands):
+        kept = []
+        for command in commands:
+            if command.op in ("add", "remove") and command.operand == 0 and not command.store:
+                self.saved["no-op"] += 1
+            elif command.op == "=" and command.operand == command.target and not command.store:
+                self.saved["no-op"] += 1
+            else:
+                kept.append(command)
+        return kept
+
+    def combine_adds(self, commands):
+        result = []
+        for command in commands:
+            previous = result[-1] if result else None
+            if (previous is not None and command.op in ("add", "remove") and previous.op in ("add", "remove")
+                    and previous.target == command.target and previous.conditions == command.conditions
+                    and not command.store and not previous.store and command.target not in command.guard):
+                total = (previous.operand if previous.op == "add" else -previous.operand) + \
+                        (command.operand if command.op == "add" else -command.operand)
+                if abs(total) > INT_MAX:
+                    result.append(command)
+                    continue
+                holder, objective = command.target
+                result.pop()
+                self.saved["combined add/remove"] += 1
+                if total != 0:
+                    op = "add" if total > 0 else "remove"
+                    result.append(previous.replace_body(f"scoreboard players {op} {holder} {objective} {abs(total)}"))
+                else:
+                    self.saved["combined add/remove"] += 1
+                continue
+            result.append(command)
+        return result
+
+    def remove_dead_stores(self, name, commands):
+        # Going backwards so that chains of dead writes go in one pass
+        commands = list(commands)
+        for i in range(len(commands) - 1, -1, -1):
+            command = commands[i]
+            slot = command.written_slot()
+            if slot is None or not command.pure or slot in command.guard:
+                continue
+            if self.dead_after(name, commands, i, slot):
+                del commands[i]
+                self.saved["dead store" if is_temp(slot) else "overwritten set"] += 1
+        return commands
+
+    def coalesce_copies(self, name, commands):
+        # X = Y; X op= W...; Z = X  (X a dead temp)  ->  Z = Y; Z op= W...
+        i = 0
+        while i < len(commands):
+            renamed = self.coalesce_at(name, commands, i)
+            if renamed is None:
+                i += 1
+            else:
+                commands = renamed
+        return commands
+
+    def coalesce_at(self, name, commands, i):
+        first = commands[i]
+        if first.op != "=" or not is_temp(first.target) or first.operand == first.target or first.store:
+            return None
+        temp = first.target
+        guard = first.guard
+        if temp in guard:
+            return None
+        chain = []
+        for j in range(i + 1, len(commands)):
+            command = commands[j]
+            if command.opaque or command.call is not None or command.store:
+                break
+            if command.target == temp and command.conditions == first.conditions:
+                if command.op in ("=", "><"):
+                    break
+                chain.append(j)
+                continue
+            if (command.op == "=" and command.operand == temp and command.conditions == first.conditions
+                    and command.target != temp and self.dead_after(name, commands, j, temp)):
+                destination = command.target
+                if destination in guard or any(self.touches(commands[k], destination) for k in range(i + 1, j)):
+                    break
+                if any(commands[k].operand == destination for k in chain):
+                    break
+                return self.rename(commands, i, j, chain, temp, destination)
+            if temp in command.reads or temp in command.writes or (command.writes & guard):
+                break
+        return None
+
+    def touches(self, command, slot):
+        return slot in command.reads or slot in command.writes
+
+    def rename(self, commands, i, j, chain, temp, destination):
+        holder, objective = destination
+        result = list(commands)
+        for k in [i] + chain:
+            command = commands[k]
+            if command.op in ("set", "add", "remove"):
+                body = f"scoreboard players {command.op} {holder} {objective} {command.operand}"
+            else:
+                operand = destination if command.operand == temp else command.operand
+                body = f"scoreboard players operation {holder} {objective} {command.op} {operand[0]} {operand[1]}"
+            result[k] = command.replace_body(body)
+        del result[j]
+        self.saved["coalesced copy"] += 1
+        if result[i].operand == destination:
+            # Z = Z once renamed
+            del result[i]
+            self.saved["coalesced copy"] += 1
+        return result
+
+    def merge_prefixes(self, commands):
+        result = []
+        i = 0
+        while i < len(commands):
+            run = self.prefix_run(commands, i)
+            if run is None:
+                result.append(commands[i])
+                i += 1
+                continue
+            end, prefix = run
+            block = f"_block{len(self.blocks)}"
+            body = [Command(command.conditions[len(prefix):], command.body, command.source)
+                    for command in commands[i:end]]
+            self.blocks[block] = body
+            result.append(Command(prefix, f"function {self.namespace}:{block}", commands[i].source))
+            self.saved["merged prefix checks"] += end - i - 1
+            i = end
+        return result
+
+    def prefix_run(self, commands, start):
+        first = commands[start]
+        if not first.conditions or first.conditions[0][0] not in ("if", "unless"):
+            return None
+        prefix = []
+        for sub in first.conditions:
+            if sub[0] not in ("if", "unless"):
+                break
+            prefix.append(sub)
+        guard = condition_slots(prefix)
+        end = start
+        while end < len(commands):
+            command = commands[end]
+            if command.opaque or command.conditions[:1] != prefix[:1]:
+                break
+            writes = command.writes if command.call is None else self.call_writes(command)
+            if writes is None or writes & guard:
+                break
+            common = 0
+            while common < min(len(prefix), len(command.conditions)) and prefix[common] == command.conditions[common]:
+                common += 1
+            prefix = prefix[:common]
+            end += 1
+        if end - start < self.threshold or not prefix:
+            return None
+        return end, prefix
+
+    def optimize(self):
+        for name in list(self.functions):
+            commands = self.functions[name]
+            while True:
+                before = len(commands)
+                commands = self.remove_noops(commands)
+                commands = self.combine_adds(commands)
+                commands = self.remove_dead_stores(name, commands)
+                commands = self.coalesce_copies(name, commands)
+                self.functions[name] = commands
+                if len(commands) == before:
+                    break
+        if self.threshold:
+            for name in list(self.functions):
+                self.functions[name] = self.merge_prefixes(self.functions[name])
+            self.functions.update(self.blocks)
+        return self.saved
+
+
+def optimize(visitor, threshold=MERGE_THRESHOLD):
+    functions = {}
+    for loop, code in visitor.igloops.items():
+        functions[loop] = list(zip(code, visitor.igsources[loop]))
+    for function, info in visitor.igfunctions.items():
+        functions[function] = list(zip(info["code"], visitor.igsources[function]))
+
+    optimizer = PeepholeOptimizer(visitor.name, functions, threshold)
+    saved = optimizer.optimize()
+
+    for name, commands in optimizer.functions.items():
+        code = [command.text() for command in commands]
+        sources = [command.source for command in commands]
+        if name in visitor.igfunctions:
+            visitor.igfunctions[name]["code"] = code
+        else:
+            if name not in visitor.igloops:
+                first = next((source for source in sources if source is not None), None)
+                visitor.igloopinfo[name] = {
+                    "kind": "block",
+                    "trips": None,
+                    "line": first[0] if first is not None else -1,
+                    "column": first[1] if first is not None else -1
+                }
+            visitor.igloops[name] = code
+        visitor.igsources[name] = sources
+    return saved
@@ -0,0 +1,84 @@
+import contextlib
+import sys
+import time
+
+# Visitor helpers that are timed in addition to the visit* methods
+VISITOR_HELPERS = ["compare", "operate", "set_var", "get_arr_element", "set_arr_element",
+                   "get_temp_var", "add_cmd", "start_loop", "end_loop"]
+
+
+class Profiler:
+    def __init__(self, visitor_methods=True):
+        # Timing every visitor method slows the Visitor phase down, so it can be left out
+        self.visitor_methods = visitor_methods
+        self.phases = {}
+        self.methods = {}
+        self.counters = {}
+        self.stack = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            total, calls = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (total + elapsed, calls + 1)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def wrap(self, name, method):
+        def wrapper(*args, **kwargs):
+            # Each frame accumulates the time spent in nested profiled calls
+            # so that self time can be reported separately
+            self.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = self.stack.pop()
+                if self.stack:
+                    self.stack[-1] += elapsed
+                total, own, calls = self.methods.get(name, (0.0, 0.0, 0))
+                self.methods[name] = (total + elapsed, own + elapsed - children, calls + 1)
+        return wrapper
+
+    def instrument(self, visitor):
+        # Methods are replaced on the instance only, so visitors that are not
+        # being profiled pay nothing
+        if not self.visitor_methods:
+            return
+        names = [name for name in dir(type(visitor)) if name.startswith("visit")
+                 and name not in ("visit", "visitChildren", "visitTerminal", "visitErrorNode")]
+        for name in names + VISITOR_HELPERS:
+            method = getattr(visitor, name, None)
+            if callable(method):
+                setattr(visitor, name, self.wrap(name, method))
+
+    def report(self, file=sys.stdout):
+        print("Phase                         Calls       Time", file=file)
+        total = 0.0
+        for name, (elapsed, calls) in self.phases.items():
+            print(f"  {name:<26} {calls:>7} {elapsed:>9.4f}s", file=file)
+            total += elapsed
+        print(f"  {'total':<26} {'':>7} {total:>9.4f}s", file=file)
+
+        if self.methods:
+            print("\nVisitor method                Calls      Total       Self", file=file)
+            ordered = sorted(self.methods.items(), key=lambda item: item[1][1], reverse=True)
+            for name, (elapsed, own, calls) in ordered:
+                print(f"  {name:<26} {calls:>7} {elapsed:>9.4f}s {own:>9.4f}s", file=file)
+
+        if self.counters:
+            print("\nCounter                       Value", file=file)
+            for name, value in self.counters.items():
+                print(f"  {name:<26} {value:>7}", file=file)
+
+
+def phase(profiler, name):
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name)
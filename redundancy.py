@@ -0,0 +1,249 @@
+import copy
+
+import ir
+from regalloc import is_temp
+
+# Removes repeated computations over the IR, after dead code elimination and
+# before temps are allocated. Visitor computes an expression into a slot one
+# operation at a time ('a * b' is 't = a', 't *= b'), so an expression is the
+# run of operations that built a slot's value since it was last set.
+#
+# Loop-invariant code motion: an expression at the start of such a run in a
+# loop body, whose operands nothing in the loop writes, has the same value on
+# every iteration. It is computed once into a new temp right before the loop
+# is entered, and the body copies that temp instead.
+#
+# Common subexpressions: within a body, an expression some other slot still
+# holds (neither it nor the expression's operands were written since) is
+# copied from that slot instead of being computed again.
+
+ARITHMETIC = ("+=", "-=", "*=", "/=", "%=", "<", ">")
+
+
+def starts(instruction):
+    # Whether the instruction sets its slot regardless of what it held
+    return isinstance(instruction, ir.Set) or isinstance(instruction, ir.Operation) and instruction.op == "="
+
+
+def extends(instruction):
+    # Whether the instruction combines its slot with one other operand
+    if isinstance(instruction, ir.Add):
+        return True
+    return isinstance(instruction, ir.Operation) and instruction.op in ARITHMETIC \
+        and instruction.source != instruction.dest
+
+
+def term(instruction):
+    # What an instruction that starts or extends an expression adds to it
+    if isinstance(instruction, ir.Set):
+        return ("value", instruction.value)
+    if isinstance(instruction, ir.Add):
+        return ("+", instruction.value)
+    return (instruction.op, instruction.source)
+
+
+def copy_of(dest, source, instruction):
+    replacement = ir.Operation(dest, "=", source)
+    replacement.line = instruction.line
+    replacement.column = instruction.column
+    return replacement
+
+
+class Expressions:
+    # The expressions slots hold at a point in a body, while scanning it
+    def __init__(self):
+        self.held = {}
+        # Indices of the instructions that built a slot's expression, as long
+        # as nothing else read the slot in between
+        self.runs = {}
+        # Slot -> slots whose expression reads it
+        self.users = {}
+        # Expression -> slots holding it, in the order they got it
+        self.holders = {}
+
+    def forget(self, slot):
+        if slot in self.held:
+            expression = self.held.pop(slot)
+            del self.holders[expression][slot]
+            if not self.holders[expression]:
+                del self.holders[expression]
+        self.runs.pop(slot, None)
+
+    def written(self, slot):
+        # slot changed: its expression and every expression reading it are gone
+        self.forget(slot)
+        for user in self.users.pop(slot, ()):
+            self.forget(user)
+
+    def hold(self, slot, expression, run):
+        self.held[slot] = expression
+        self.holders.setdefault(expression, {})[slot] = None
+        self.runs[slot] = run
+        for operand in expression:
+            if operand[0] != "value" and operand[0] != "+":
+                self.users.setdefault(operand[1], set()).add(slot)
+
+    def holder(self, expression, slot):
+        # Another slot holding expression, if any
+        return next((other for other in self.holders.get(expression, ()) if other != slot), None)
+
+
+class RedundancyEliminator:
+    def __init__(self, visitor):
+        self.visitor = visitor
+        self.bodies = dict(visitor.igloops)
+        for function, info in visitor.igfunctions.items():
+            self.bodies[function] = info["code"]
+        self.next_temp = 1 + max([int(slot[4:]) for slot in self.all_slots() if is_temp(slot)], default=-1)
+        self.closures = {}
+        self.saved = {"hoisted instruction": 0, "common subexpression": 0}
+
+    def all_slots(self):
+        slots = set(self.visitor.igmemory)
+        for code in self.bodies.values():
+            for instruction in code:
+                slots |= instruction.reads() | instruction.writes()
+        return slots
+
+    def new_temp(self):
+        name = f"_var{self.next_temp}"
+        self.visitor.igmemory[name] = "int"
+        self.next_temp += 1
+        return name
+
+    def closure_writes(self, function):
+        if function not in self.closures:
+            writes = set()
+            seen = {function}
+            stack = [function]
+            while stack:
+                for instruction in self.bodies[stack.pop()]:
+                    writes |= instruction.writes()
+                    if isinstance(instruction, ir.Call) and instruction.function in self.bodies \
+                            and instruction.function not in seen:
+                        seen.add(instruction.function)
+                        stack.append(instruction.function)
+            self.closures[function] = writes
+        return self.closures[function]
+
+    def entries(self):
+        # Loop -> the body and call entering it from outside, if there is just one
+        sites = {}
+        for name, code in self.bodies.items():
+            for instruction in code:
+                if isinstance(instruction, ir.Call) and instruction.function in self.visitor.igloops \
+                        and instruction.function != name:
+                    sites.setdefault(instruction.function, []).append((name, instruction))
+        return {loop: calls[0] for loop, calls in sites.items() if len(calls) == 1}
+
+    def invariant_runs(self, loop):
+        # (start, end) of the runs at the start of an expression in loop that
+        # only read slots the loop never writes
+        code = self.bodies[loop]
+        writes = self.closure_writes(loop)
+        index = 0
+        while index < len(code):
+            instruction = code[index]
+            end = index + 1
+            if starts(instruction) and not instruction.conditions and not instruction.operands() & writes:
+                while end < len(code) and extends(code[end]) and not code[end].conditions \
+                        and code[end].dest == instruction.dest \
+                        and not (isinstance(code[end], ir.Operation) and code[end].source in writes):
+                    end += 1
+                if end - index > 1:
+                    yield index, end
+            index = end
+
+    def hoist(self, loop, caller, call):
+        trips = self.visitor.igloopinfo[loop]["trips"]
+        # A counted loop runs whenever its call is reached (unless the function
+        # returned already), so its invariants need no guard, and can move out
+        # of a loop around it in turn
+        conditions = [] if trips is not None else call.conditions
+        code = self.bodies[loop]
+        hoisted = []
+        kept = []
+        last = 0
+        for start, end in list(self.invariant_runs(loop)):
+            # n operations run once, instead of n - 1 (and a copy) per iteration
+            if trips is not None and trips * (end - start - 1) <= end - start:
+                continue
+            dest = code[start].dest
+            temp = self.new_temp()
+            for instruction in code[start:end]:
+                instruction = copy.copy(instruction)
+                instruction.rename({dest: temp})
+                instruction.conditions = list(conditions)
+                hoisted.append(instruction)
+            kept.extend(code[last:start])
+            kept.append(copy_of(dest, temp, code[start]))
+            last = end
+        if not hoisted:
+            return
+        kept.extend(code[last:])
+        code[:] = kept
+        caller_code = self.bodies[caller]
+        index = next(index for index, instruction in enumerate(caller_code) if instruction is call)
+        caller_code[index:index] = hoisted
+        self.saved["hoisted instruction"] += len(hoisted)
+        self.closures.clear()
+
+    def reuse(self, code):
+        expressions = Expressions()
+        removed = set()
+        for index, instruction in enumerate(code):
+            if isinstance(instruction, ir.Call):
+                if instruction.function not in self.bodies:
+                    expressions = Expressions()
+                    continue
+                # The call may read any slot, halfway through an expression or not
+                expressions.runs.clear()
+                for slot in self.closure_writes(instruction.function):
+                    expressions.written(slot)
+                continue
+            reads = instruction.reads()
+            own = not instruction.conditions and (starts(instruction) or extends(instruction)
+                                                  and instruction.dest in expressions.held)
+            if own and extends(instruction):
+                reads = reads - {instruction.dest}
+            for slot in reads:
+                expressions.runs.pop(slot, None)
+            if not own:
+                for slot in instruction.writes():
+                    expressions.written(slot)
+                continue
+            dest = instruction.dest
+            if starts(instruction):
+                expression = expressions.held.get(instruction.source) if isinstance(instruction, ir.Operation) else None
+                expression = expression or (term(instruction),)
+                run = [index]
+            else:
+                expression = expressions.held[dest] + (term(instruction),)
+                run = expressions.runs.get(dest)
+                run = run + [index] if run is not None else None
+            expressions.written(dest)
+            if any(operand[1] == dest for operand in expression):
+                continue
+            holder = expressions.holder(expression, dest)
+            if holder is not None and run is not None and len(run) > 1:
+                removed.update(run[:-1])
+                code[index] = copy_of(dest, holder, instruction)
+                expressions.runs.pop(holder, None)
+                self.saved["common subexpression"] += len(run) - 1
+                run = [index]
+            expressions.hold(dest, expression, run)
+        code[:] = [instruction for index, instruction in enumerate(code) if index not in removed]
+
+    def run(self):
+        # Inner loops first, so what they hoist can leave the loops around them
+        entries = self.entries()
+        for loop in reversed(list(self.visitor.igloops)):
+            if loop in entries and self.visitor.igloopinfo[loop]["kind"] != "block":
+                self.hoist(loop, *entries[loop])
+        for code in self.bodies.values():
+            self.reuse(code)
+        return self.saved
+
+
+def eliminate(visitor):
+    return RedundancyEliminator(visitor).run()
@@ -0,0 +1,202 @@
+import ir
+from deadcode import ENTRY_POINTS, root
+from regalloc import is_temp
+
+# Passes arrays by reference over the IR, after inlining. Visitor copies an
+# array whenever it's assigned, which for an argument means copying the whole
+# list in storage on every call. A copy that is never written (and whose
+# original isn't written while the copy is in use) holds the same elements as
+# the original, so whatever reads the copy can read the original instead,
+# and the copy goes. A copy that is written to keeps being made.
+#
+# An array argument of a function is read in place from the array every call
+# passes, if they all pass the same one and nothing the function runs writes
+# either of them. An argument copied for inlined code is read from its source
+# by that code, up to the next copy.
+
+
+def storage_reads(instruction):
+    # Variables whose storage the instruction reads
+    if isinstance(instruction, ir.LoadData):
+        return {root(instruction.path)}
+    if isinstance(instruction, ir.DataModify) and instruction.source is not None:
+        return {root(instruction.source)}
+    if isinstance(instruction, ir.Call) and instruction.arguments is not None:
+        return {root(instruction.arguments)}
+    return set()
+
+
+def storage_writes(instruction):
+    # Variables whose storage the instruction writes
+    if isinstance(instruction, (ir.StoreData, ir.DataModify, ir.DataRemove)):
+        return {root(instruction.path)}
+    return set()
+
+
+def is_copy(instruction, slot=None):
+    # Whether the instruction copies a whole array (into slot)
+    return isinstance(instruction, ir.DataModify) and instruction.mode == "set" \
+        and instruction.source is not None and root(instruction.path) == instruction.path \
+        and root(instruction.source) == instruction.source and (slot is None or instruction.path == slot)
+
+
+def reroot(instruction, old, new):
+    # Points the storage paths of instruction under old to new instead
+    if isinstance(instruction, (ir.LoadData, ir.StoreData, ir.DataModify, ir.DataRemove)) \
+            and root(instruction.path) == old:
+        instruction.path = new + instruction.path[len(old):]
+    if isinstance(instruction, ir.DataModify) and instruction.source is not None \
+            and root(instruction.source) == old:
+        instruction.source = new + instruction.source[len(old):]
+    if isinstance(instruction, ir.Call) and instruction.arguments is not None \
+            and root(instruction.arguments) == old:
+        instruction.arguments = new + instruction.arguments[len(old):]
+
+
+class ReferencePasser:
+    def __init__(self, visitor):
+        self.visitor = visitor
+        self.bodies = dict(visitor.igloops)
+        for function, info in visitor.igfunctions.items():
+            self.bodies[function] = info["code"]
+        self.closures = {}
+        self.saved = {"array copy": 0}
+
+    def closure(self, function):
+        # Bodies running function may run
+        if function not in self.closures:
+            seen = {function}
+            stack = [function]
+            while stack:
+                for instruction in self.bodies[stack.pop()]:
+                    if isinstance(instruction, ir.Call) and instruction.function in self.bodies \
+                            and instruction.function not in seen:
+                        seen.add(instruction.function)
+                        stack.append(instruction.function)
+            self.closures[function] = seen
+        return self.closures[function]
+
+    def closure_storage(self, function):
+        # (storage read, storage written, scores written) by running function
+        reads, writes, scores = set(), set(), set()
+        for name in self.closure(function):
+            for instruction in self.bodies[name]:
+                reads |= storage_reads(instruction)
+                writes |= storage_writes(instruction)
+                scores |= instruction.writes()
+        return reads, writes, scores
+
+    def private_arguments(self):
+        # Array argument slot -> its function, for arguments no other
+        # function has a local of the same name for
+        private = {}
+        for function, info in self.visitor.igfunctions.items():
+            for arg, type_ in info["args"]:
+                if type_.endswith("[]") and not any(arg in local for other, local in self.visitor.local.items()
+                                                    if other != function):
+                    private[arg+"+local"] = function
+        return private
+
+    def argument_copy(self, code, call, slot):
+        # Index and source of the copy into slot right before call, if nothing
+        # in between writes either of them or calls anything
+        written = set()
+        for index in range(code.index(call)-1, -1, -1):
+            instruction = code[index]
+            if isinstance(instruction, ir.Call):
+                return None
+            if is_copy(instruction, slot) and instruction.conditions == call.conditions:
+                if instruction.source in written or is_temp(instruction.source) or instruction.source == slot:
+                    return None
+                return index, instruction.source
+            written |= storage_writes(instruction)
+            if slot in written or slot in storage_reads(instruction):
+                return None
+        return None
+
+    def pass_by_reference(self, function, slot):
+        # Makes function read argument slot from the array its calls pass
+        info = self.visitor.igfunctions[function]
+        if function in ENTRY_POINTS or info["export"]:
+            return
+        calls = [(name, instruction) for name, code in self.bodies.items() for instruction in code
+                 if isinstance(instruction, ir.Call) and instruction.function == function]
+        if not calls:
+            return
+        copies = []
+        for name, call in calls:
+            copy = self.argument_copy(self.bodies[name], call, slot)
+            if copy is None:
+                return
+            copies.append((name, copy))
+        sources = {source for _, (_, source) in copies}
+        if len(sources) != 1:
+            return
+        source = sources.pop()
+        _, writes, _ = self.closure_storage(function)
+        if slot in writes or source in writes:
+            return
+        for name in self.closure(function):
+            for instruction in self.bodies[name]:
+                reroot(instruction, slot, source)
+        # Several calls may share a body: later indices go first
+        for name, (index, _) in sorted(copies, key=lambda copy: copy[1][0], reverse=True):
+            del self.bodies[name][index]
+            self.saved["array copy"] += 1
+
+    def forward(self, code, index):
+        # Replaces the reads of the argument copied at index with its source,
+        # and drops the copy, if nothing writes the argument before it's copied
+        # again and the source doesn't change while it's read
+        copied = code[index]
+        slot = copied.path
+        source = copied.source
+        guard_slots = set()
+        for condition in copied.conditions:
+            guard_slots |= condition.reads()
+        readers = []
+        # Whether the source or the copy's conditions changed since the copy
+        changed = False
+        for instruction in code[index+1:]:
+            if isinstance(instruction, ir.Call) and instruction.function in self.bodies:
+                reads, writes, scores = self.closure_storage(instruction.function)
+                if slot in reads | writes | storage_reads(instruction):
+                    return False
+                if source in writes or guard_slots & scores:
+                    changed = True
+                continue
+            if slot in storage_reads(instruction):
+                if changed or instruction.conditions[:len(copied.conditions)] != copied.conditions:
+                    return False
+                readers.append(instruction)
+            if slot in storage_writes(instruction):
+                if not is_copy(instruction, slot) or instruction.conditions != copied.conditions:
+                    return False
+                break
+            if source in storage_writes(instruction) or guard_slots & instruction.writes():
+                changed = True
+        if not readers:
+            return False
+        for instruction in readers:
+            reroot(instruction, slot, source)
+        del code[index]
+        return True
+
+    def run(self):
+        private = self.private_arguments()
+        for slot, function in private.items():
+            self.pass_by_reference(function, slot)
+        for code in self.bodies.values():
+            index = 0
+            while index < len(code):
+                instruction = code[index]
+                if is_copy(instruction) and instruction.path in private and instruction.source != instruction.path \
+                        and self.forward(code, index):
+                    self.saved["array copy"] += 1
+                    continue
+                index += 1
+        return self.saved
+
+
+def pass_arrays(visitor):
+    return ReferencePasser(visitor).run()
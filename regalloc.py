@@ -0,0 +1,453 @@
+from collections import defaultdict
+
+import ir
+
+# Temp allocation over the IR. Visitor hands out _varN temps from a simple
+# pool; here every value a temp holds (a web: the writes and reads connected
+# by liveness) becomes a node of an interference graph, and the graph is
+# coloured with as few scoreboard objectives as possible.
+#
+# Bodies are straight-line lists of instructions guarded by execute
+# conditions. A conditional write still ends the previous value for a later
+# read under (at least) the same conditions, as long as nothing outside those
+# conditions wrote the slots they test in between: once the conditions are
+# false they stay false, and the read doesn't run either.
+#
+# Loop bodies share temps with the code around them: a call to a loop reads
+# the temps the loop reads before writing them, and may leave behind anything
+# it writes. Temps of a function are its own (arguments and results go through
+# other objectives), so a call to a function only clobbers them.
+
+def is_temp(slot):
+    return slot.startswith("_var") and slot[4:].isdigit()
+
+
+class Access:
+    # The slots one instruction reads and writes, calls resolved through the
+    # callee, and the temps it certainly writes whenever it runs
+    def __init__(self, instruction, writes, temp_writes, definite):
+        self.instruction = instruction
+        self.call = instruction.function if isinstance(instruction, ir.Call) else None
+        self.reads = {slot for slot in instruction.reads() if is_temp(slot)}
+        self.writes = writes
+        self.temp_writes = temp_writes
+        self.definite = definite
+        self.conditions = frozenset(instruction.conditions)
+        self.condition_slots = set()
+        for condition in instruction.conditions:
+            self.condition_slots |= condition.reads()
+        self.guard_writes = set()
+
+
+class TempAllocator:
+    def __init__(self, bodies, functions):
+        self.bodies = bodies
+        self.functions = functions
+        # Union-find over nodes: ("use"|"def", body, index, temp) for each
+        # read and write, ("in"|"out", body, temp) for values crossing calls
+        self.ids = {}
+        self.parent = []
+        self.ranges = defaultdict(list)
+        self.tests = []
+        self.moves = []
+        self.outs = set()
+        self.reaching_cache = {}
+        self.summarize()
+
+    def summarize(self):
+        self.callees = {name: {instruction.function for instruction in code
+                               if isinstance(instruction, ir.Call) and instruction.function in self.bodies}
+                        for name, code in self.bodies.items()}
+        called = set()
+        for callees in self.callees.values():
+            called |= callees
+        # Functions run by the game (load, tick, or anything not called from the pack)
+        self.entries = [name for name in self.bodies if name not in called]
+
+        self.closure_writes = {name: set() for name in self.bodies}
+        for name, code in self.bodies.items():
+            for instruction in code:
+                self.closure_writes[name] |= instruction.writes()
+        order = self.postorder()
+        changed = True
+        while changed:
+            changed = False
+            for name in order:
+                writes = self.closure_writes[name]
+                size = len(writes)
+                for callee in self.callees[name]:
+                    writes |= self.closure_writes[callee]
+                changed = changed or len(writes) != size
+        temp_writes = {name: {slot for slot in writes if is_temp(slot)} for name, writes in self.closure_writes.items()}
+
+        guard_slots = set()
+        for code in self.bodies.values():
+            for instruction in code:
+                for condition in instruction.conditions:
+                    guard_slots |= condition.reads()
+        self.accesses = {}
+        for name, code in self.bodies.items():
+            accesses = []
+            for instruction in code:
+                if isinstance(instruction, ir.Call):
+                    shared = set() if instruction.function in self.functions else \
+                             temp_writes.get(instruction.function, set())
+                    access = Access(instruction, self.closure_writes.get(instruction.function, set()), shared, set())
+                else:
+                    writes = instruction.writes()
+                    temps = {slot for slot in writes if is_temp(slot)}
+                    access = Access(instruction, writes, temps, temps)
+                access.guard_writes = access.writes & guard_slots
+                accesses.append(access)
+            self.accesses[name] = accesses
+
+    def postorder(self):
+        # Callees before their callers, as far as recursion allows
+        order = []
+        seen = set()
+        for root in self.bodies:
+            if root in seen:
+                continue
+            seen.add(root)
+            stack = [(root, iter(self.callees[root]))]
+            while stack:
+                name, callees = stack[-1]
+                for callee in callees:
+                    if callee not in seen:
+                        seen.add(callee)
+                        stack.append((callee, iter(self.callees[callee])))
+                        break
+                else:
+                    order.append(name)
+                    stack.pop()
+        return order
+
+    def reachable(self, name):
+        seen = {name}
+        stack = [name]
+        while stack:
+            for callee in self.callees[stack.pop()]:
+                if callee not in seen:
+                    seen.add(callee)
+                    stack.append(callee)
+        return seen
+
+    def reaching(self, body, index, temp):
+        # Writes of temp that may reach the read at index (the end of the body
+        # when index is its length), latest first, and whether the last of
+        # them certainly ran whenever the read does
+        key = (body, index, temp)
+        if key in self.reaching_cache:
+            return self.reaching_cache[key]
+        accesses = self.accesses[body]
+        conditions = accesses[index].conditions if index < len(accesses) else frozenset()
+        defs = []
+        changed = []
+        covered = False
+        for k in range(index - 1, -1, -1):
+            access = accesses[k]
+            if temp in access.temp_writes:
+                defs.append(k)
+                if temp in access.definite and access.conditions <= conditions and not self.guard_broken(access, changed):
+                    covered = True
+                    break
+            elif not defs and access.conditions == conditions and (body, k, temp) in self.reaching_cache:
+                # An earlier read under the same conditions, and temp wasn't
+                # written since: same answer, unless the guard changed
+                previous = self.reaching_cache[(body, k, temp)]
+                if access.guard_writes:
+                    changed.append((access.guard_writes, access.conditions))
+                if not previous[1] or not self.guard_broken(accesses[previous[0][-1]], changed):
+                    defs, covered = previous
+                    break
+                continue
+            if access.guard_writes:
+                changed.append((access.guard_writes, access.conditions))
+        self.reaching_cache[key] = (defs, covered)
+        return defs, covered
+
+    def compute_definite(self):
+        # A call to a loop certainly writes the temps every run of the loop
+        # leaves behind, as far as the loop's own calls are known to
+        changed = True
+        while changed:
+            changed = False
+            covered = {}
+            for name, accesses in self.accesses.items():
+                if name in self.functions:
+                    continue
+                temps = set()
+                for access in accesses:
+                    temps |= access.temp_writes
+                covered[name] = {temp for temp in temps if self.reaching(name, len(accesses), temp)[1]}
+            self.reaching_cache = {}
+            for accesses in self.accesses.values():
+                for access in accesses:
+                    if access.call in covered:
+                        definite = access.temp_writes & covered[access.call]
+                        if definite != access.definite:
+                            access.definite = definite
+                            changed = True
+
+    def guard_broken(self, access, changed):
+        # Whether a slot tested by access's conditions was written somewhere
+        # those conditions didn't hold
+        for slots, conditions in changed:
+            if slots & access.condition_slots and not conditions >= access.conditions:
+                return True
+        return False
+
+    def reads(self, access):
+        if access.call is not None and access.call not in self.functions:
+            return access.reads | self.live_in.get(access.call, set())
+        return access.reads
+
+    def compute_live_in(self):
+        # Temps each body reads before writing them, so a call has to keep them
+        self.live_in = {name: set() for name in self.bodies}
+        changed = True
+        while changed:
+            changed = False
+            for name, accesses in self.accesses.items():
+                for index, access in enumerate(accesses):
+                    for temp in self.reads(access):
+                        if temp not in self.live_in[name] and not self.reaching(name, index, temp)[1]:
+                            self.live_in[name].add(temp)
+                            changed = True
+
+    def node(self, key):
+        id_ = self.ids.get(key)
+        if id_ is None:
+            id_ = self.ids[key] = len(self.parent)
+            self.parent.append(id_)
+        return id_
+
+    def find(self, id_):
+        parent = self.parent
+        while parent[id_] != id_:
+            parent[id_] = parent[parent[id_]]
+            id_ = parent[id_]
+        return id_
+
+    def union(self, a, b):
+        a, b = self.find(self.node(a)), self.find(self.node(b))
+        if a != b:
+            self.parent[b] = a
+
+    def link(self, node, body, defs, covered, temp):
+        for k in defs:
+            self.union(node, ("def", body, k, temp))
+            call = self.accesses[body][k].call
+            if call is not None:
+                self.union(node, self.out(call, temp))
+        if not covered:
+            self.union(node, ("in", body, temp))
+
+    def out(self, body, temp):
+        # The values of temp body may leave behind for its caller
+        node = ("out", body, temp)
+        if node not in self.outs:
+            self.outs.add(node)
+            defs, covered = self.reaching(body, len(self.accesses[body]), temp)
+            self.link(node, body, defs, covered, temp)
+        return node
+
+    def build_webs(self):
+        for name, accesses in self.accesses.items():
+            for index, access in enumerate(accesses):
+                reads = self.reads(access)
+                for temp in reads:
+                    use = ("use", name, index, temp)
+                    self.node(use)
+                    defs, covered = self.reaching(name, index, temp)
+                    self.link(use, name, defs, covered, temp)
+                    if access.call not in self.functions and temp in self.live_in.get(access.call, ()):
+                        self.union(use, ("in", access.call, temp))
+                    self.ranges[name].append((defs[-1] if covered else -1, index - 1, use))
+                if access.call is None:
+                    for temp in access.temp_writes:
+                        define = ("def", name, index, temp)
+                        self.node(define)
+                        if temp in reads:
+                            self.union(define, ("use", name, index, temp))
+                instruction = access.instruction
+                if isinstance(instruction, ir.Test) and is_temp(instruction.dest):
+                    for temp in reads:
+                        self.tests.append((("def", name, index, instruction.dest), ("use", name, index, temp)))
+                if isinstance(instruction, ir.Operation) and instruction.op == "=" and \
+                   is_temp(instruction.dest) and is_temp(instruction.source):
+                    self.moves.append((("def", name, index, instruction.dest), ("use", name, index, instruction.source)))
+
+        # A temp an entry reads before it is ever written keeps its value
+        # across runs of the pack, so it isn't split or shared with anything
+        # that entry runs. Functions only the other entries run keep their
+        # own temps of the same name.
+        self.fixed = set()
+        fixed_nodes = []
+        for entry in self.entries:
+            fixed = self.live_in[entry]
+            if not fixed:
+                continue
+            self.fixed |= fixed
+            bodies = self.reachable(entry)
+            by_temp = defaultdict(list)
+            for node in self.ids:
+                if node[-1] in fixed and node[1] in bodies:
+                    by_temp[node[-1]].append(node)
+            for nodes in by_temp.values():
+                for node in nodes[1:]:
+                    self.union(nodes[0], node)
+                fixed_nodes.append(nodes[0])
+        self.web = {node: self.find(id_) for node, id_ in self.ids.items()}
+        self.fixed_webs = {self.web[node] for node in fixed_nodes}
+
+    def touched(self, body):
+        # Every web the body or the functions it calls may write
+        if body not in self.touched_cache:
+            webs = set()
+            for name in self.reachable(body):
+                webs |= self.direct_webs[name]
+            self.touched_cache[body] = webs
+        return self.touched_cache[body]
+
+    def interference(self):
+        self.edges = defaultdict(set)
+        self.direct_webs = defaultdict(set)
+        self.touched_cache = {}
+        for node in self.ids:
+            if node[0] in ("use", "def"):
+                self.direct_webs[node[1]].add(self.web[node])
+        # A copy doesn't make its source and destination interfere
+        sources = {a: self.web[b] for a, b in self.moves}
+
+        for name, accesses in self.accesses.items():
+            starts = defaultdict(list)
+            ends = defaultdict(list)
+            for start, end, node in self.ranges[name]:
+                web = self.web[node]
+                starts[start].append(web)
+                ends[end].append(web)
+            active = defaultdict(int)
+            for m in range(-1, len(accesses)):
+                for web in starts[m]:
+                    active[web] += 1
+                if m >= 0:
+                    access = accesses[m]
+                    source = None
+                    if access.call is not None:
+                        written = self.touched(access.call)
+                    else:
+                        written = set()
+                        for temp in access.temp_writes:
+                            define = ("def", name, m, temp)
+                            written.add(self.web[define])
+                            source = sources.get(define, source)
+                    for web in written:
+                        for other in active:
+                            if other != web and other != source:
+                                self.edges[web].add(other)
+                                self.edges[other].add(web)
+                for web in ends[m]:
+                    active[web] -= 1
+                    if active[web] == 0:
+                        del active[web]
+
+        # Test writes its result before testing its condition
+        for a, b in self.tests:
+            a, b = self.web[a], self.web[b]
+            if a != b:
+                self.edges[a].add(b)
+                self.edges[b].add(a)
+
+    def color(self):
+        # Webs in the order they first appear in the program
+        order = []
+        seen = set()
+        for node in self.ids:
+            web = self.web[node]
+            if web not in seen and node[0] in ("use", "def"):
+                seen.add(web)
+                order.append((web, node[-1]))
+        hints = defaultdict(list)
+        for a, b in self.moves:
+            a, b = self.web[a], self.web[b]
+            hints[a].append(b)
+            hints[b].append(a)
+
+        self.names = {}
+        pool = []
+        for web, temp in order:
+            if web in self.fixed_webs:
+                self.names[web] = temp
+                continue
+            taken = {self.names[other] for other in self.edges[web] if other in self.names}
+            choice = None
+            for partner in hints[web]:
+                name = self.names.get(partner)
+                if name is not None and name not in taken and name not in self.fixed:
+                    choice = name
+                    break
+            if choice is None:
+                for name in pool:
+                    if name not in taken:
+                        choice = name
+                        break
+            if choice is None:
+                n = len(pool)
+                while f"_var{n}" in self.fixed or f"_var{n}" in pool:
+                    n += 1
+                choice = f"_var{n}"
+                pool.append(choice)
+            self.names[web] = choice
+
+    def rewrite(self):
+        removed = 0
+        for name, accesses in self.accesses.items():
+            code = []
+            for index, access in enumerate(accesses):
+                names = {}
+                for temp in self.reads(access):
+                    if access.call is None or temp in access.reads:
+                        names[temp] = self.names[self.web[("use", name, index, temp)]]
+                if access.call is None:
+                    for temp in access.temp_writes:
+                        names[temp] = self.names[self.web[("def", name, index, temp)]]
+                instruction = access.instruction
+                instruction.rename(names)
+                if isinstance(instruction, ir.Operation) and instruction.op == "=" and \
+                   instruction.dest == instruction.source:
+                    removed += 1
+                    continue
+                code.append(instruction)
+            self.bodies[name] = code
+        return removed
+
+    def allocate(self):
+        self.compute_definite()
+        self.compute_live_in()
+        self.build_webs()
+        self.interference()
+        self.color()
+        return self.rewrite()
+
+
+def allocate(visitor):
+    bodies = dict(visitor.igloops)
+    for function, info in visitor.igfunctions.items():
+        bodies[function] = info["code"]
+    before = len([var for var in visitor.igmemory if is_temp(var)])
+
+    allocator = TempAllocator(bodies, set(visitor.igfunctions))
+    removed = allocator.allocate()
+
+    for name, code in allocator.bodies.items():
+        if name in visitor.igfunctions:
+            visitor.igfunctions[name]["code"] = code
+        else:
+            visitor.igloops[name] = code
+    # Array temps live in storage and need no objective
+    for var in [var for var in visitor.igmemory if is_temp(var)]:
+        del visitor.igmemory[var]
+    for name in sorted(set(allocator.names.values()), key=lambda name: int(name[4:])):
+        visitor.igmemory[name] = "int"
+    return {"temp objectives": before - len(set(allocator.names.values())), "coalesced temp copy": removed}
@@ -0,0 +1,645 @@
+import argparse
+import json
+import os
+import re
+import sys
+
+from exceptions import SimulationException
+
+INT_MIN = -2**31
+INT_MAX = 2**31 - 1
+# Minecraft's default maxCommandChainLength
+MAX_COMMAND_CHAIN = 65536
+
+MACRO_ARGUMENT = re.compile(r"\$\((\w+)\)")
+PATH_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|\[(-?\d+)\]|([^.\[\]"]+)|(\.)')
+NUMBER = re.compile(r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?[bBsSlLfFdD]?$")
+
+
+def wrap(value):
+    return (value - INT_MIN) % 2**32 + INT_MIN
+
+
+class SNBTParser:
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def skip(self):
+        while self.pos < len(self.text) and self.text[self.pos].isspace():
+            self.pos += 1
+
+    def expect(self, char):
+        self.skip()
+        if not self.text.startswith(char, self.pos):
+            raise SimulationException(f"Expected '{char}' at {self.pos} in SNBT '{self.text}'")
+        self.pos += 1
+
+    def peek(self):
+        self.skip()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def parse(self):
+        value = self.value()
+        self.skip()
+        if self.pos != len(self.text):
+            raise SimulationException(f"Trailing data in SNBT '{self.text}'")
+        return value
+
+    def value(self):
+        char = self.peek()
+        if char == "{":
+            return self.compound()
+        if char == "[":
+            return self.list()
+        if char in ("\"", "'"):
+            return self.string()
+        return self.literal()
+
+    def compound(self):
+        self.expect("{")
+        result = {}
+        if self.peek() == "}":
+            self.pos += 1
+            return result
+        while True:
+            if self.peek() in ("\"", "'"):
+                key = self.string()
+            else:
+                key = self.token()
+            self.expect(":")
+            result[key] = self.value()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return result
+
+    def list(self):
+        self.expect("[")
+        # Typed arrays ([I; 1, 2]) are treated as plain lists
+        if re.match(r"[BIL]\s*;", self.text[self.pos:]):
+            self.pos = self.text.index(";", self.pos) + 1
+        result = []
+        if self.peek() == "]":
+            self.pos += 1
+            return result
+        while True:
+            result.append(self.value())
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return result
+
+    def string(self):
+        quote = self.text[self.pos]
+        self.pos += 1
+        result = ""
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            self.pos += 1
+            if char == "\\":
+                result += self.text[self.pos]
+                self.pos += 1
+            elif char == quote:
+                return result
+            else:
+                result += char
+        raise SimulationException(f"Unterminated string in SNBT '{self.text}'")
+
+    def token(self):
+        self.skip()
+        start = self.pos
+        while self.pos < len(self.text) and (self.text[self.pos].isalnum() or self.text[self.pos] in "_-.+"):
+            self.pos += 1
+        if start == self.pos:
+            raise SimulationException(f"Unexpected character at {self.pos} in SNBT '{self.text}'")
+        return self.text[start:self.pos]
+
+    def literal(self):
+        token = self.token()
+        if token in ("true", "false"):
+            return int(token == "true")
+        if NUMBER.match(token):
+            number = token.rstrip("bBsSlLfFdD") if not token[-1].isdigit() else token
+            if token[-1] in "fFdD" or "." in number or "e" in number.lower():
+                return float(number)
+            return int(number)
+        return token
+
+def to_snbt(value):
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{key}:{to_snbt(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, list):
+        return "[" + ",".join(to_snbt(item) for item in value) + "]"
+    if isinstance(value, str):
+        return json.dumps(value)
+    return str(value)
+
+def parse_path(path):
+    segments = []
+    for match in PATH_TOKEN.finditer(path):
+        quoted, index, key, _ = match.groups()
+        if quoted is not None:
+            segments.append(quoted)
+        elif key is not None:
+            segments.append(key)
+        elif index is not None:
+            segments.append(int(index))
+    return segments
+
+def parse_range(text):
+    if ".." not in text:
+        return int(text), int(text)
+    low, high = text.split("..")
+    return (int(low) if low else INT_MIN), (int(high) if high else INT_MAX)
+
+
+def read_pack(path):
+    # Returns ({"namespace:function": [commands]}, load entries, tick entries)
+    data = os.path.join(path, "data")
+    if not os.path.isdir(data):
+        raise SimulationException(f"'{path}' is not a datapack (no data directory)")
+    functions = {}
+    for namespace in sorted(os.listdir(data)):
+        directory = os.path.join(data, namespace, "functions")
+        for root, _, files in os.walk(directory):
+            for file in files:
+                if not file.endswith(".mcfunction"):
+                    continue
+                relative = os.path.relpath(os.path.join(root, file), directory)
+                name = f"{namespace}:{relative[:-len('.mcfunction')].replace(os.sep, '/')}"
+                with open(os.path.join(root, file)) as f:
+                    lines = [line.strip() for line in f]
+                functions[name] = [line for line in lines if line and not line.startswith("#")]
+    tags = []
+    for tag in ("load", "tick"):
+        tag_file = os.path.join(data, "minecraft", "tags", "functions", f"{tag}.json")
+        values = []
+        if os.path.exists(tag_file):
+            with open(tag_file) as f:
+                values = json.load(f)["values"]
+        tags.append(values)
+    return functions, tags[0], tags[1]
+
+
+class Frame:
+    def __init__(self, name, lines, executed, arguments=None):
+        self.name = name
+        self.lines = lines
+        self.pc = 0
+        self.start = executed
+        # Macro arguments the function was called with
+        self.arguments = arguments
+
+
+class FunctionStats:
+    def __init__(self):
+        self.calls = 0
+        self.own = 0
+        self.total = 0
+        self.max_per_call = 0
+
+
+class Simulator:
+    def __init__(self, path, max_commands=MAX_COMMAND_CHAIN):
+        self.path = path
+        self.max_commands = max_commands
+        self.scores = {}
+        self.objectives = set()
+        self.storage = {}
+        self.output = []
+        self.stats = {}
+        self.unsupported = {}
+        self.executed = 0
+        self.max_depth = 0
+        self.nbt_bytes = 0
+        self.truncated = 0
+        self.functions, self.load_tags, self.tick_tags = read_pack(path)
+
+    # Scoreboard and storage access
+
+    def get_score(self, holder, objective):
+        return self.scores.get((holder, objective))
+
+    def set_score(self, holder, objective, value):
+        self.scores[(holder, objective)] = wrap(value)
+        return self.scores[(holder, objective)]
+
+    def storage_root(self, storage):
+        return self.storage.setdefault(storage, {})
+
+    def resolve(self, storage, path, create=False):
+        # Returns the container holding the last path segment, and that segment
+        segments = parse_path(path)
+        node = self.storage_root(storage)
+        for i, segment in enumerate(segments[:-1]):
+            following = segments[i + 1]
+            if isinstance(segment, int):
+                if not isinstance(node, list) or not -len(node) <= segment < len(node):
+                    return None, None
+                node = node[segment]
+            else:
+                if not isinstance(node, dict):
+                    return None, None
+                if segment not in node:
+                    if not create:
+                        return None, None
+                    node[segment] = [] if isinstance(following, int) else {}
+                node = node[segment]
+        return node, segments[-1]
+
+    def data_get(self, storage, path):
+        container, key = self.resolve(storage, path)
+        if container is None:
+            return None
+        if isinstance(key, int):
+            if not isinstance(container, list) or not -len(container) <= key < len(container):
+                return None
+            return container[key]
+        if not isinstance(container, dict):
+            return None
+        return container.get(key)
+
+    def data_set(self, storage, path, value):
+        container, key = self.resolve(storage, path, create=True)
+        if container is None:
+            return 0
+        if isinstance(key, int):
+            if not isinstance(container, list) or not -len(container) <= key < len(container):
+                return 0
+        elif not isinstance(container, dict):
+            return 0
+        container[key] = value
+        return 1
+
+    def copy(self, value):
+        self.nbt_bytes += len(to_snbt(value))
+        return json.loads(json.dumps(value))
+
+    # Command execution
+
+    def run_command(self, command):
+        # Returns (result, function to call or None)
+        head, _, rest = command.partition(" ")
+        if head == "execute":
+            return self.run_execute(rest)
+        if head == "function":
+            return 1, rest.strip()
+        if head == "scoreboard":
+            return self.run_scoreboard(rest.split()), None
+        if head == "data":
+            return self.run_data(rest), None
+        if head == "tellraw":
+            self.run_tellraw(rest)
+            return 1, None
+        self.unsupported[head] = self.unsupported.get(head, 0) + 1
+        return 0, None
+
+    def run_execute(self, arguments):
+        stores = []
+        rest = arguments
+        while rest:
+            tokens = rest.split(" ")
+            keyword = tokens[0]
+            if keyword == "run":
+                break
+            if keyword in ("if", "unless"):
+                passed, consumed = self.test_condition(tokens[1:])
+                if passed != (keyword == "if"):
+                    return 0, None
+                rest = " ".join(tokens[1 + consumed:])
+            elif keyword == "store":
+                kind = tokens[1]
+                if tokens[2] == "score":
+                    stores.append((kind, "score", tokens[3], tokens[4]))
+                    rest = " ".join(tokens[5:])
+                elif tokens[2] == "storage":
+                    stores.append((kind, "storage", tokens[3], tokens[4], tokens[5], float(tokens[6])))
+                    rest = " ".join(tokens[7:])
+                else:
+                    raise SimulationException(f"Unsupported store target '{tokens[2]}'")
+            else:
+                self.unsupported[f"execute {keyword}"] = self.unsupported.get(f"execute {keyword}", 0) + 1
+                return 0, None
+
+        call = None
+        if rest.startswith("run "):
+            result, call = self.run_command(rest[4:])
+        else:
+            result = 1
+        if call is not None and stores:
+            self.unsupported["execute store ... run function"] = self.unsupported.get("execute store ... run function", 0) + 1
+        for store in stores:
+            value = result if store[0] == "result" else int(bool(result))
+            if store[1] == "score":
+                self.set_score(store[2], store[3], value)
+            else:
+                number = value*store[5]
+                self.data_set(store[2], store[3], int(number) if store[4] != "double" and store[4] != "float" else number)
+        return result, call
+
+    def test_condition(self, tokens):
+        kind = tokens[0]
+        if kind == "score":
+            value = self.get_score(tokens[1], tokens[2])
+            if tokens[3] == "matches":
+                if value is None:
+                    return False, 5
+                low, high = parse_range(tokens[4])
+                return low <= value <= high, 5
+            other = self.get_score(tokens[4], tokens[5])
+            if value is None or other is None:
+                return False, 6
+            op = tokens[3]
+            passed = {"<": value < other, "<=": value <= other, "=": value == other,
+                      ">=": value >= other, ">": value > other}[op]
+            return passed, 6
+        if kind == "data" and tokens[1] == "storage":
+            return self.data_get(tokens[2], tokens[3]) is not None, 4
+        raise SimulationException(f"Unsupported execute condition '{kind}'")
+
+    def run_scoreboard(self, tokens):
+        if tokens[0] == "objectives":
+            if tokens[1] == "add":
+                self.objectives.add(tokens[2])
+                return 1
+            if tokens[1] == "remove":
+                self.objectives.discard(tokens[2])
+                return 1
+            raise SimulationException(f"Unsupported scoreboard command 'objectives {tokens[1]}'")
+
+        action, holder, objective = tokens[1], tokens[2], tokens[3]
+        if objective not in self.objectives:
+            raise SimulationException(f"Unknown scoreboard objective '{objective}'")
+        current = self.get_score(holder, objective)
+        if action == "set":
+            return self.set_score(holder, objective, int(tokens[4]))
+        if action == "add":
+            return self.set_score(holder, objective, (current or 0) + int(tokens[4]))
+        if action == "remove":
+            return self.set_score(holder, objective, (current or 0) - int(tokens[4]))
+        if action == "get":
+            if current is None:
+                raise SimulationException(f"{holder} has no score for '{objective}'")
+            return current
+        if action == "reset":
+            if holder == "*":
+                for key in [key for key in self.scores if key[1] == objective]:
+                    del self.scores[key]
+            else:
+                self.scores.pop((holder, objective), None)
+            return 1
+        if action == "operation":
+            op, source_holder, source_objective = tokens[4], tokens[5], tokens[6]
+            if source_objective not in self.objectives:
+                raise SimulationException(f"Unknown scoreboard objective '{source_objective}'")
+            source = self.get_score(source_holder, source_objective)
+            if source is None:
+                raise SimulationException(f"{source_holder} has no score for '{source_objective}'")
+            target = current or 0
+            if op == "=":
+                result = source
+            elif op == "+=":
+                result = target + source
+            elif op == "-=":
+                result = target - source
+            elif op == "*=":
+                result = target*source
+            elif op == "/=":
+                result = target // source if source != 0 else target
+            elif op == "%=":
+                result = target % source if source != 0 else target
+            elif op == "<":
+                result = min(target, source)
+            elif op == ">":
+                result = max(target, source)
+            elif op == "><":
+                self.set_score(source_holder, source_objective, target)
+                result = source
+            else:
+                raise SimulationException(f"Unknown scoreboard operation '{op}'")
+            return self.set_score(holder, objective, result)
+        raise SimulationException(f"Unsupported scoreboard command 'players {action}'")
+
+    def run_data(self, arguments):
+        tokens = arguments.split(" ")
+        action = tokens[0]
+        if tokens[1] != "storage":
+            self.unsupported[f"data {action} {tokens[1]}"] = self.unsupported.get(f"data {action} {tokens[1]}", 0) + 1
+            return 0
+        storage, path = tokens[2], tokens[3]
+        if action == "get":
+            value = self.data_get(storage, path)
+            if value is None:
+                return 0
+            scale = float(tokens[4]) if len(tokens) > 4 else 1
+            if isinstance(value, (list, dict, str)):
+                return len(value)
+            return int(value*scale // 1)
+        if action == "remove":
+            container, key = self.resolve(storage, path)
+            if container is None:
+                return 0
+            try:
+                del container[key]
+            except (KeyError, IndexError, TypeError):
+                return 0
+            return 1
+        if action == "modify":
+            mode = tokens[4]
+            index = None
+            source_at = 5
+            if mode == "insert":
+                index = int(tokens[5])
+                source_at = 6
+            if tokens[source_at] == "value":
+                value = SNBTParser(" ".join(tokens[source_at + 1:])).parse()
+                self.nbt_bytes += len(to_snbt(value))
+            elif tokens[source_at] == "from" and tokens[source_at + 1] == "storage":
+                value = self.data_get(tokens[source_at + 2], tokens[source_at + 3])
+                if value is None:
+                    return 0
+                value = self.copy(value)
+            else:
+                raise SimulationException(f"Unsupported data source '{tokens[source_at]}'")
+            if mode == "set":
+                return self.data_set(storage, path, value)
+            target = self.data_get(storage, path)
+            if target is None:
+                target = []
+                if not self.data_set(storage, path, target):
+                    return 0
+            if not isinstance(target, list):
+                return 0
+            if mode == "append":
+                target.append(value)
+            elif mode == "prepend":
+                target.insert(0, value)
+            elif mode == "insert":
+                target.insert(index, value)
+            else:
+                raise SimulationException(f"Unsupported data modify mode '{mode}'")
+            return 1
+        raise SimulationException(f"Unsupported data command '{action}'")
+
+    def run_tellraw(self, arguments):
+        selector, _, component = arguments.partition(" ")
+        component = json.loads(component)
+        self.output.append((selector, self.render(component)))
+
+    def render(self, component):
+        if isinstance(component, list):
+            return "".join(self.render(item) for item in component)
+        if isinstance(component, str):
+            return component
+        if "score" in component:
+            value = self.get_score(component["score"]["name"], component["score"]["objective"])
+            return "" if value is None else str(value)
+        if "storage" in component:
+            value = self.data_get(component["storage"], component["nbt"])
+            return "" if value is None else to_snbt(value)
+        return component.get("text", "")
+
+    # Entry points
+
+    def call(self, name):
+        if name not in self.functions:
+            raise SimulationException(f"Unknown function '{name}'")
+        start = self.executed
+        stack = [Frame(name, self.functions[name], self.executed)]
+        self.stats.setdefault(name, FunctionStats()).calls += 1
+        self.max_depth = max(self.max_depth, 1)
+        while stack:
+            frame = stack[-1]
+            if frame.pc >= len(frame.lines):
+                stack.pop()
+                stats = self.stats[frame.name]
+                cost = self.executed - frame.start
+                stats.total += cost
+                stats.max_per_call = max(stats.max_per_call, cost)
+                continue
+            if self.executed - start >= self.max_commands:
+                # Minecraft silently stops the whole chain at the limit
+                self.truncated += 1
+                for frame in stack:
+                    stats = self.stats[frame.name]
+                    cost = self.executed - frame.start
+                    stats.total += cost
+                    stats.max_per_call = max(stats.max_per_call, cost)
+                break
+            line = frame.lines[frame.pc]
+            frame.pc += 1
+            self.executed += 1
+            self.stats[frame.name].own += 1
+            if line.startswith("$"):
+                line = self.expand_macro(line[1:], frame)
+            _, target = self.run_command(line)
+            if target is not None:
+                target, arguments = self.macro_call(target)
+                if target not in self.functions:
+                    raise SimulationException(f"Unknown function '{target}' called from '{frame.name}'")
+                self.stats.setdefault(target, FunctionStats()).calls += 1
+                stack.append(Frame(target, self.functions[target], self.executed, arguments))
+                self.max_depth = max(self.max_depth, len(stack))
+        return self.executed - start
+
+    def macro_call(self, target):
+        # 'ns:f with storage <storage> <path>' -> ("ns:f", the compound there)
+        target, _, source = target.partition(" with ")
+        if not source:
+            return target, None
+        tokens = source.split(" ")
+        if tokens[0] != "storage":
+            raise SimulationException(f"Unsupported macro argument source '{tokens[0]}'")
+        arguments = self.data_get(tokens[1], tokens[2])
+        if not isinstance(arguments, dict):
+            raise SimulationException(f"Macro arguments of '{target}' are not a compound")
+        return target, arguments
+
+    def expand_macro(self, line, frame):
+        def argument(match):
+            if frame.arguments is None or match.group(1) not in frame.arguments:
+                raise SimulationException(f"Missing macro argument '{match.group(1)}' in '{frame.name}'")
+            # Strings go in as they are, anything else as SNBT
+            value = frame.arguments[match.group(1)]
+            return value if isinstance(value, str) else to_snbt(value)
+        return MACRO_ARGUMENT.sub(argument, line)
+
+    def load(self):
+        return sum(self.call(name) for name in self.load_tags)
+
+    def tick(self):
+        return sum(self.call(name) for name in self.tick_tags)
+
+    def report(self):
+        return {
+            "commands": self.executed,
+            "max_depth": self.max_depth,
+            "nbt_bytes": self.nbt_bytes,
+            "truncated": self.truncated,
+            "unsupported": dict(self.unsupported),
+            "functions": {
+                name: {
+                    "calls": stats.calls,
+                    "commands": stats.total,
+                    "own_commands": stats.own,
+                    "per_call": stats.total/stats.calls if stats.calls else 0,
+                    "max_per_call": stats.max_per_call,
+                }
+                for name, stats in sorted(self.stats.items())
+            },
+        }
+
+
+def print_report(entries, simulator, file=sys.stdout):
+    for entry, commands in entries:
+        print(f"{entry:<30} {commands:>10} commands", file=file)
+    report = simulator.report()
+    print(f"\n{'Function':<30} {'Calls':>8} {'Commands':>10} {'Own':>10} {'Per call':>10} {'Max':>8}", file=file)
+    ordered = sorted(report["functions"].items(), key=lambda item: item[1]["commands"], reverse=True)
+    for name, stats in ordered:
+        print(f"{name:<30} {stats['calls']:>8} {stats['commands']:>10} {stats['own_commands']:>10} "
+              f"{stats['per_call']:>10.1f} {stats['max_per_call']:>8}", file=file)
+    print(f"\nMax recursion depth: {report['max_depth']}", file=file)
+    print(f"NBT bytes copied:    {report['nbt_bytes']}", file=file)
+    if report["truncated"]:
+        print(f"Command chains cut off at {simulator.max_commands}: {report['truncated']}", file=file)
+    for command, count in report["unsupported"].items():
+        print(f"Unsupported command '{command}' skipped {count} times", file=file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a built MineScript datapack without a Minecraft server")
+    parser.add_argument("pack", help="path to the built datapack, e.g. build/test")
+    parser.add_argument("--ticks", type=int, default=1, help="number of ticks to run after load (default: 1)")
+    parser.add_argument("--call", action="append", default=[], metavar="FUNCTION",
+                        help="additionally call FUNCTION (namespace:name) after load")
+    parser.add_argument("--max-commands", type=int, default=MAX_COMMAND_CHAIN,
+                        help="command chain limit per entry call")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--quiet", action="store_true", help="don't print tellraw output")
+    args = parser.parse_args()
+
+    simulator = Simulator(args.pack, args.max_commands)
+    entries = [("load", simulator.load())]
+    for name in args.call:
+        entries.append((name, simulator.call(name)))
+    for tick in range(args.ticks):
+        entries.append((f"tick {tick + 1}", simulator.tick()))
+
+    if not args.quiet and not args.json:
+        for selector, text in simulator.output:
+            print(f"[{selector}] {text}")
+        print()
+    if args.json:
+        report = simulator.report()
+        report["entries"] = [{"entry": entry, "commands": commands} for entry, commands in entries]
+        report["output"] = [text for _, text in simulator.output]
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(entries, simulator)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import minescript
+from options import Options
+from simulator import Simulator
+
+
+@pytest.fixture
+def run(tmp_path):
+    # Builds source with the given options and returns what load and two ticks print
+    def run(source, **options):
+        file = tmp_path / "prog.ms"
+        file.write_text(source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert minescript.main("prog", str(file), Options(cache=False, **options))
+        simulator = Simulator(str(tmp_path / "build" / "prog"))
+        simulator.load()
+        simulator.tick()
+        simulator.tick()
+        return [text for _, text in simulator.output]
+    return run
+
+
+@pytest.fixture
+def visit(tmp_path):
+    # Visits source and returns the Visitor holding its IR, before any pass runs
+    def visit(source, **options):
+        file = tmp_path / "prog.ms"
+        file.write_text(source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            visitor = minescript.visit("prog", str(file), Options(cache=False, **options))
+        assert visitor is not None
+        return visitor
+    return visit
@@ -0,0 +1,32 @@
+# Tick tests an element it reads through a temp, then calls a function that
+# reads elements of its own; the guard has to outlive the call
+GUARD_ACROSS_CALL = """
+int g;
+int h;
+int arr[];
+int f(int i) { return arr[i] + arr[i + 1]; }
+int other(int i) { return arr[i + 1] * 2; }
+void load() { arr = {5, 7, 9, 11}; g = 1; h = 0; }
+void tick() {
+    h = other(g);
+    if (arr[g] == 7) {
+        print("@a", "white", "f=", f(h - 18));
+        print("@a", "white", "after");
+    } else {
+        print("@a", "white", "else");
+    }
+}
+"""
+
+
+def test_macro_read_keeps_caller_guard(run):
+    expected = ["f=12", "after"] * 2
+    assert run(GUARD_ACROSS_CALL, pack_format=18) == expected
+    assert run(GUARD_ACROSS_CALL, pack_format=18, inline=False) == expected
+
+
+def test_paged_read_keeps_caller_guard(run):
+    expected = ["f=12", "after"] * 2
+    for page_size in (1, 2, 3):
+        assert run(GUARD_ACROSS_CALL, page_size=page_size) == expected
+        assert run(GUARD_ACROSS_CALL, page_size=page_size, inline=False) == expected
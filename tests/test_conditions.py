@@ -0,0 +1,36 @@
+def code(visitor, function="f"):
+    return [repr(instruction) for instruction in visitor.igfunctions[function]["code"]]
+
+
+def branch(visit, statement):
+    return code(visit(f"int x; int y; int z; void f() {{ {statement} }}"))
+
+
+def test_comparison_with_literal_is_a_matches_condition(visit):
+    assert branch(visit, "if (x > 3) y = 1;") == ["[unless x matches ..3] y = 1"]
+    assert branch(visit, "if (x <= 3) y = 1;") == ["[if x matches ..3] y = 1"]
+    assert branch(visit, "if (x != 2) { y = 2; } else { y = 3; }") == \
+        ["[unless x matches 2] y = 2", "[if x matches 2] y = 3"]
+
+
+def test_comparison_of_variables_is_a_compare_condition(visit):
+    assert branch(visit, "if (x < y) z = 4;") == ["[if x < y] z = 4"]
+
+
+def test_body_writing_the_operand_tests_a_copy(visit):
+    assert branch(visit, "if (x == 1) { x = 2; y = 5; }") == \
+        ["_var0 = x", "[if _var0 matches 1] x = 2", "[if _var0 matches 1] y = 5"]
+
+
+def test_fused_conditions_in_game(run):
+    source = """
+    int x;
+    int y;
+    void load() { x = 0; y = 2; }
+    void tick() {
+        if (x == 0) { x = 1; y = y + 10; } else { y = y + 100; }
+        if (x < y) { y = x; }
+        if (y >= 1) { print("@a", "white", "x=", x, " y=", y); } else { print("@a", "white", "low"); }
+    }
+    """
+    assert run(source) == ["x=1 y=1", "x=1 y=1"]
@@ -0,0 +1,46 @@
+import deadcode
+
+SOURCE = """
+int used;
+int unused;
+int kept[];
+int dropped[];
+int helper(int a) { return a + 1; }
+int orphan(int a) { unused = a; return a; }
+int only_orphan(int a) { return a * 2; }
+int chained(int a) { return only_orphan(a); }
+export void api() { used = helper(used); }
+void load() { used = 1; kept = {1, 2, 3}; dropped = {4, 5, 6}; }
+void tick() {
+    kept[0] = used;
+    dropped[1] = used;
+    print("@a", "white", "u=", kept[0]);
+}
+"""
+
+
+def test_unreachable_functions_are_dropped(visit):
+    visitor = visit(SOURCE)
+    removed = deadcode.eliminate(visitor)
+    assert set(visitor.igfunctions) == {"helper", "api", "load", "tick"}
+    # Counted in commands left out
+    assert removed["unreachable function"] == 6
+
+
+def test_unused_variables_and_dead_storage_are_dropped(visit):
+    visitor = visit(SOURCE)
+    deadcode.eliminate(visitor)
+    assert "unused" not in visitor.igmemory
+    assert "used" in visitor.igmemory
+    slots = [repr(instruction) for code in [info["code"] for info in visitor.igfunctions.values()]
+             for instruction in code]
+    assert not any("dropped" in slot for slot in slots)
+    assert any("kept" in slot for slot in slots)
+
+
+def test_pack_keeps_what_runs(run, tmp_path):
+    assert run(SOURCE) == ["u=1", "u=1"]
+    functions = {file.stem for file in (tmp_path / "build").rglob("*.mcfunction")}
+    assert {"load", "tick", "api"} <= functions
+    assert not {"orphan", "only_orphan", "chained"} & functions
+    assert run(SOURCE, eliminate_dead_code=False) == ["u=1", "u=1"]
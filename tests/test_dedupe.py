@@ -0,0 +1,84 @@
+import dedupe
+
+
+def commands(tmp_path):
+    # Every command of the pack built last
+    return "".join(file.read_text() for file in (tmp_path / "build").rglob("*.mcfunction"))
+
+
+def test_bodies_differing_in_color_stay_apart(run, tmp_path):
+    source = """
+    int n;
+    void load() {
+        n = 2;
+        int i = 0;
+        while (i < n) { print("@a", "red", "hi"); i++; }
+        i = 0;
+        while (i < n) { print("@a", "blue", "hi"); i++; }
+    }
+    """
+    assert run(source) == ["hi"] * 4
+    assert '"color":"red"' in commands(tmp_path)
+    assert '"color":"blue"' in commands(tmp_path)
+
+
+def test_bodies_differing_in_score_stay_apart(run):
+    source = """
+    int n;
+    int a;
+    int b;
+    void load() {
+        n = 2;
+        a = 3;
+        b = 4;
+        int i = 0;
+        while (i < n) { print("@a", "white", a); i++; }
+        i = 0;
+        while (i < n) { print("@a", "white", b); i++; }
+    }
+    """
+    assert run(source) == ["3", "3", "4", "4"]
+    assert run(source) == run(source, deduplicate=False)
+
+
+def test_identical_bodies_are_shared(run, tmp_path):
+    source = """
+    int n;
+    void load() {
+        n = 2;
+        int i = 0;
+        while (i < n) { print("@a", "red", "hi"); i++; }
+        i = 0;
+        while (i < n) { print("@a", "red", "hi"); i++; }
+    }
+    """
+    assert run(source) == ["hi"] * 4
+    assert len(list((tmp_path / "build").rglob("_loop*.mcfunction"))) == 1
+
+
+def test_exported_functions_keep_their_own_name(run, tmp_path):
+    source = """
+    int g;
+    export void up() { g = g + 1; }
+    export void up_again() { g = g + 1; }
+    void load() { g = 0; }
+    void tick() { print("@a", "white", g); }
+    """
+    assert run(source) == ["0", "0"]
+    functions = {file.stem for file in (tmp_path / "build").rglob("*.mcfunction")}
+    assert {"up", "up_again"} <= functions
+
+
+def test_shared_callers_after_shared_loops(visit):
+    source = """
+    int g;
+    int n;
+    void a() { int i = 0; while (i < n) { g = g + 2; i++; } }
+    void b() { int i = 0; while (i < n) { g = g + 2; i++; } }
+    void tick() { a(); b(); }
+    """
+    visitor = visit(source)
+    saved = dedupe.deduplicate(visitor)
+    tick = [instruction.function for instruction in visitor.igfunctions["tick"]["code"]]
+    assert tick[0] == tick[1]
+    assert saved["shared function"] > 0
@@ -0,0 +1,37 @@
+def code(visitor, function="f"):
+    return [repr(instruction) for instruction in visitor.igfunctions[function]["code"]]
+
+
+def test_expression_is_computed_in_its_destination(visit):
+    visitor = visit("int x; int y; void f() { int z = x + y; x = x + 1; }")
+    assert code(visitor) == ["z+local = x", "z+local += y", "x += 1"]
+
+
+def test_return_value_and_argument_are_computed_in_place(visit):
+    visitor = visit("int x; int y; int g(int a) { return a * 2 + 1; } void f() { y = g(x + 1); }")
+    assert code(visitor, "g") == ["_f_g = a+local", "_f_g += _f_g", "_f_g += 1"]
+    assert code(visitor) == ["a+local = x", "a+local += 1", "call g", "y = _f_g"]
+
+
+def test_destination_read_later_in_the_expression_keeps_a_temp(visit):
+    visitor = visit("int x; int y; void f() { x = y - x; }")
+    assert code(visitor) == ["_var0 = y", "_var0 -= x", "x = _var0"]
+
+
+def test_assignments_in_game(run):
+    source = """
+    int x;
+    int y;
+    int arr[];
+    int g(int a) { return a * 2 + 1; }
+    void load() { x = 3; y = 10; arr = {0, 0}; }
+    void tick() {
+        x = y - x;
+        y = x * (y + 1);
+        int z = x + y;
+        arr[1] = z - x;
+        x = g(x + 1);
+        print("@a", "white", x, " ", y, " ", z, " ", arr[1]);
+    }
+    """
+    assert run(source) == ["17 77 84 77", "123 4680 4740 4680"]
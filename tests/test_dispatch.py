@@ -0,0 +1,52 @@
+from Visitor import SWITCH_THRESHOLD
+
+
+def chain(cases, variable="x", default="y = 0;"):
+    branches = [f"if ({variable} == {case}) {{ y = {case * 10}; y = y + 1; }}" for case in cases]
+    return " else ".join(branches) + f" else {{ {default} }}"
+
+
+def test_long_chain_is_dispatched(visit):
+    visitor = visit(f"int x; int y; export void f() {{ {chain([1, 3, 5, 7, 9])} }}")
+    assert visitor.optimizations["switch dispatch"] == 1
+    assert [repr(instruction) for instruction in visitor.igfunctions["f"]["code"]] == \
+        ["[if x matches ..4] call _switch6", "[if x matches 5..] call _switch7"]
+
+
+def test_short_chain_is_not_dispatched(visit):
+    visitor = visit(f"int x; int y; export void f() {{ {chain(range(SWITCH_THRESHOLD - 1))} }}")
+    assert visitor.optimizations["switch dispatch"] == 0
+    assert not any(name.startswith("_switch") for name in visitor.igloops)
+
+
+def test_branch_writing_the_variable_tests_a_copy(visit):
+    source = "int x; int y; export void f() { " + chain([1, 2, 3, 4], default="x = 0;") + " }"
+    visitor = visit(source.replace("y = 20;", "x = 3;"))
+    first = repr(visitor.igfunctions["f"]["code"][0])
+    assert first.startswith("_var") and first.endswith(" = x")
+
+
+def test_dispatch_in_game(run):
+    source = f"""
+    int x;
+    int y;
+    void tick() {{
+        x = -1;
+        while (x < 12) {{
+            {chain([1, 3, 5, 7, 9])}
+            print("@a", "white", y);
+            if (x == 2) {{ x = 4; }} else if (x == 4) {{ x = 2; }} else if (x == 6) {{ x = 8; }} else if (x == 8) {{ x = 6; }}
+            print("@a", "white", x);
+            x = x + 1;
+        }}
+    }}
+    """
+    # The second chain writes the variable it tests, so each x takes at most one branch
+    expected = []
+    x = -1
+    while x < 12:
+        expected.append(str(x * 10 + 1 if x in (1, 3, 5, 7, 9) else 0))
+        x = {2: 4, 4: 2, 6: 8, 8: 6}.get(x, x)
+        expected.append(str(x))
+        x += 1
+    assert run(source) == expected * 2
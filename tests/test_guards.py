@@ -0,0 +1,61 @@
+def code(visitor, name):
+    body = visitor.igfunctions[name]["code"] if name in visitor.igfunctions else visitor.igloops[name]
+    return [repr(instruction) for instruction in body]
+
+
+def test_tail_returns_need_no_flag(visit):
+    visitor = visit("int g; int f(int a) { g = a; if (a > 3) { return 1; } else { return a + 1; } }")
+    assert not any("_break_f" in line for line in code(visitor, "f"))
+
+
+def test_early_return_guards_only_what_follows(visit):
+    visitor = visit("int g; int f(int a) { g = 1; if (a > 3) { return 5; } g = 2; return a; }")
+    assert code(visitor, "f") == [
+        "_break_f = 0",
+        "g = 1",
+        "[unless a+local matches ..3] _f_f = 5",
+        "[unless a+local matches ..3] _break_f = 1",
+        "[unless _break_f matches 1] g = 2",
+        "[unless _break_f matches 1] _f_f = a+local",
+    ]
+
+
+def test_loop_without_break_has_no_guard(visit):
+    visitor = visit("int g; void f() { int i = 0; while (i < 3) { g = g + i; i++; } }")
+    assert code(visitor, "_loop0") == ["g += i+local", "i+local += 1", "[unless i+local matches 3..] call _loop0"]
+
+
+def test_break_guards_only_what_follows(visit):
+    visitor = visit("int g; void f() { int i = 0; while (i < 10) { g = g + 1; if (g > 4) { break; } i++; } }")
+    assert code(visitor, "_loop0") == [
+        "g += 1",
+        "[unless g matches ..4] _var0 = 0",
+        "[unless _var0 matches 0] i+local += 1",
+        "[unless _var0 matches 0, unless i+local matches 10..] call _loop0",
+    ]
+
+
+def test_early_exits_in_game(run):
+    source = """
+    int g;
+    int h;
+    int early(int a) { g = 1; if (a > 3) { return 5; } g = 2; return a; }
+    void load() { h = 2; }
+    void tick() {
+        int r = early(h);
+        print("@a", "white", "r=", r, " g=", g);
+        int i = 0;
+        int j;
+        while (i < 10) {
+            g = g + 1;
+            if (g > 4) { break; }
+            j = 0;
+            while (j < 5) { if (j == 2) { break; } j++; }
+            i++;
+        }
+        print("@a", "white", "i=", i, " g=", g, " j=", j);
+        h = h + 2;
+    }
+    """
+    assert run(source) == ["r=2 g=2", "i=2 g=5 j=2", "r=5 g=1", "i=3 g=5 j=2"]
+    assert run(source, inline=False) == run(source)
@@ -0,0 +1,89 @@
+import inliner
+from regalloc import is_temp
+
+LOCAL_ARRAY = """
+int g;
+int pick(int x) {
+    int a[] = {1, 2, 3};
+    a[1] = x;
+    return a[1] * a[2] + a[0];
+}
+void load() { g = 4; }
+void tick() { print("@a", "white", "p=", pick(g)); g = g + 1; }
+"""
+
+
+def test_inlined_local_array(run, tmp_path):
+    assert run(LOCAL_ARRAY) == ["p=13", "p=16"]
+    assert not list((tmp_path / "build").rglob("pick.mcfunction"))
+    assert run(LOCAL_ARRAY, inline=False) == ["p=13", "p=16"]
+
+
+def test_inlined_temps_keep_their_type(visit):
+    visitor = visit(LOCAL_ARRAY)
+    temps = {slot for instruction in visitor.igfunctions["pick"]["code"]
+             for slot in instruction.reads() | instruction.writes() if is_temp(slot)}
+    assert temps
+    for temp in temps:
+        visitor.igmemory[temp] = "int[]"
+    before = set(visitor.igmemory)
+    inliner.inline(visitor)
+    renamed = [slot for slot in visitor.igmemory if slot not in before]
+    assert len(renamed) == len(temps)
+    assert all(visitor.igmemory[slot] == "int[]" for slot in renamed)
+
+
+def test_call_guarded_by_what_callee_writes_is_kept(run):
+    source = """
+    int g;
+    void bump() { g = g + 1; g = g + 1; }
+    void load() { g = 0; }
+    void tick() { if (g == 0) { bump(); } print("@a", "white", "g=", g); }
+    """
+    assert run(source) == ["g=2", "g=2"]
+
+
+CALLS = """
+int g;
+int sq(int s) { return s * s; }
+int big(int a) { g = a; g = g + 1; g = g * 3; g = g - a; g = g + 7; g = g * a; g = g % 100; g = g + 2; return g; }
+int down(int n) { if (n <= 0) { return 7; } return down(n - 1); }
+void load() { g = 2; }
+void tick() { g = sq(g); print("@a", "white", g); g = big(g); print("@a", "white", g); print("@a", "white", down(g % 6)); }
+"""
+
+
+def calls(visitor, function):
+    return [instruction.function for instruction in visitor.igfunctions[function]["code"]
+            if hasattr(instruction, "function")]
+
+
+def test_small_functions_are_inlined(visit):
+    visitor = visit(CALLS)
+    saved = inliner.inline(visitor)
+    assert calls(visitor, "tick") == ["big", "down"]
+    assert saved["inlined call"] == 1
+
+
+def test_threshold_bounds_inlined_size(visit):
+    visitor = visit(CALLS)
+    inliner.inline(visitor, 100)
+    assert calls(visitor, "tick") == ["down"]
+    visitor = visit(CALLS)
+    inliner.inline(visitor, 0)
+    assert calls(visitor, "tick") == ["sq", "big", "down"]
+
+
+def test_private_argument_is_forwarded(visit):
+    visitor = visit(CALLS)
+    saved = inliner.inline(visitor)
+    assert [repr(instruction) for instruction in visitor.igfunctions["tick"]["code"][:3]] == \
+        ["_f_sq = g", "_f_sq *= g", "g = _f_sq"]
+    assert saved["forwarded argument"] == 1
+
+
+def test_inlined_program_in_game(run):
+    expected = run(CALLS, inline=False)
+    assert expected[:3] == ["4", "74", "7"]
+    assert run(CALLS) == expected
+    assert run(CALLS, inline_threshold=100) == expected
@@ -0,0 +1,85 @@
+import backend
+import ir
+
+
+def conditioned(instruction, *conditions):
+    instruction.conditions = list(conditions)
+    return instruction
+
+
+def test_reads_and_writes():
+    operation = conditioned(ir.Operation("x", "+=", "y"), ir.Matches("g", 1, 1))
+    assert operation.reads() == {"x", "y", "g"}
+    assert operation.writes() == {"x"}
+    assert ir.Operation("x", "=", "y").reads() == {"y"}
+    assert ir.Operation("x", "><", "y").writes() == {"x", "y"}
+    assert ir.StoreData("a.value[0]", "x").reads() == {"x"}
+    assert ir.LoadData("x", "a.value[0]").writes() == {"x"}
+
+
+def test_rename_reaches_conditions_and_operands():
+    test = conditioned(ir.Test("t", ir.Compare("x", "<", "y")), ir.Matches("x", 0, None, negate=True))
+    test.rename({"x": "a", "t": "b"})
+    assert test.writes() == {"b"}
+    assert test.reads() == {"a", "y"}
+    assert test.conditions == [ir.Matches("a", 0, None, negate=True)]
+
+
+def test_render_scores_and_conditions():
+    renderer = backend.Backend("p")
+    commands, _ = renderer.render_code([
+        ir.Set("x", 3),
+        ir.Add("x", -2),
+        conditioned(ir.Operation("x", "*=", ir.constant(4)), ir.Compare("x", ">", "y", negate=True)),
+        conditioned(ir.Call("_loop0"), ir.Matches("x", None, 5)),
+    ])
+    assert commands == [
+        "scoreboard players set #MineScript x 3",
+        "scoreboard players remove #MineScript x 2",
+        "execute unless score #MineScript x > #MineScript y run "
+        "scoreboard players operation #MineScript x *= #4 _const",
+        "execute if score #MineScript x matches ..5 run function p:_loop0",
+    ]
+
+
+def test_render_test_sets_both_values():
+    commands = backend.Backend("p").render(ir.Test("t", ir.Matches("x", 1, 3)))
+    assert commands == ["scoreboard players set #MineScript t 0",
+                        "execute if score #MineScript x matches 1..3 run scoreboard players set #MineScript t 1"]
+
+
+def test_render_storage():
+    renderer = backend.Backend("p")
+    assert renderer.render(ir.LoadData("x", "a.value[2]")) == \
+        ["execute store result score #MineScript x run data get storage p:minescript a.value[2]"]
+    assert renderer.render(ir.StoreData("a.value[2]", "x")) == \
+        ["execute store result storage p:minescript a.value[2] int 1 run scoreboard players get #MineScript x"]
+    assert renderer.render(ir.DataModify("b", "set", source="a")) == \
+        ["data modify storage p:minescript b set from storage p:minescript a"]
+
+
+def test_render_macro_and_print():
+    commands, sources = backend.Backend("p").render_code([
+        ir.LoadData("x", "a.value[$(index)]"),
+        ir.Print("@a", [ir.Text("x=", "red"), ir.Score("x")]),
+    ])
+    assert commands[0].startswith("$execute store result score #MineScript x")
+    assert commands[1] == 'tellraw @a [{"text":"x=", "color":"red"},' \
+                          '{"score":{"name":"#MineScript","objective":"x"}}]'
+    assert sources == [None, None]
+
+
+def test_program_through_ir(run):
+    source = """
+    int x;
+    int arr[];
+    void load() { x = 7; arr = {1, 2, 3}; }
+    void tick() {
+        arr[1] = arr[1] + x;
+        if (arr[1] > 10) { print("@a", "white", "big ", arr[1]); } else { print("@a", "white", "small"); }
+    }
+    """
+    expected = ["small", "big 16"]
+    assert run(source) == expected
+    assert run(source, inline=False, pass_by_reference=False, eliminate_dead_code=False,
+               eliminate_redundancy=False, allocate_temps=False, deduplicate=False, peephole=False) == expected
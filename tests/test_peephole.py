@@ -0,0 +1,83 @@
+from peephole import PeepholeOptimizer
+
+PROGRAM = """
+int a;
+int b;
+int n;
+void load() { a = 0; b = 5; n = 3; }
+void tick() {
+    int i = 0;
+    while (i < n) {
+        a = a + b * 2 - 1;
+        if (a > 20) { a = a - 20; b = b + 1; }
+        i++;
+    }
+    print("@a", "white", "a=", a, " b=", b);
+}
+"""
+
+
+def optimize(functions, threshold=0):
+    # Optimized commands of functions ({name: [command]}) in namespace p
+    optimizer = PeepholeOptimizer("p", {name: [(command, None) for command in code]
+                                        for name, code in functions.items()}, threshold)
+    saved = optimizer.optimize()
+    return {name: [command.text() for command in code] for name, code in optimizer.functions.items()}, saved
+
+
+def test_adds_are_combined_and_noops_dropped():
+    functions, _ = optimize({"f": ["scoreboard players add x v 0",
+                                   "scoreboard players add x v 3",
+                                   "scoreboard players remove x v 1"]})
+    assert functions["f"] == ["scoreboard players add x v 2"]
+
+
+def test_dead_temp_store_is_dropped():
+    functions, saved = optimize({"f": ["scoreboard players set _var0 v 5",
+                                       "scoreboard players set x v 1"]})
+    assert functions["f"] == ["scoreboard players set x v 1"]
+    assert saved["dead store"] == 1
+
+
+def test_temp_read_by_callee_is_kept():
+    code = ["scoreboard players set _var0 v 5", "function p:g"]
+    functions, _ = optimize({"f": code, "g": ["scoreboard players operation x v = _var0 v"]})
+    assert functions["f"] == code
+
+
+def test_copy_through_temp_is_coalesced():
+    functions, _ = optimize({"f": ["scoreboard players operation _var0 v = a v",
+                                   "scoreboard players operation _var0 v += b v",
+                                   "scoreboard players operation c v = _var0 v"]})
+    assert functions["f"] == ["scoreboard players operation c v = a v",
+                              "scoreboard players operation c v += b v"]
+
+
+PREFIXED = ["execute if score x v matches 1 run scoreboard players add a v 1",
+            "execute if score x v matches 1 run scoreboard players add b v 1",
+            "execute if score x v matches 1 run scoreboard players add c v 1"]
+
+
+def test_prefix_runs_merge_from_threshold():
+    functions, saved = optimize({"f": PREFIXED}, threshold=3)
+    assert functions["f"] == ["execute if score x v matches 1 run function p:_block0"]
+    assert functions["_block0"] == ["scoreboard players add a v 1",
+                                    "scoreboard players add b v 1",
+                                    "scoreboard players add c v 1"]
+    assert saved["merged prefix checks"] == 2
+
+
+def test_prefix_runs_below_threshold_stay():
+    assert optimize({"f": PREFIXED}, threshold=4)[0] == {"f": PREFIXED}
+    assert optimize({"f": PREFIXED})[0] == {"f": PREFIXED}
+
+
+def test_prefix_run_stops_at_write_to_its_guard():
+    code = [PREFIXED[0], "execute if score x v matches 1 run scoreboard players set x v 2", PREFIXED[2]]
+    assert optimize({"f": code}, threshold=2)[0] == {"f": code}
+
+
+def test_program_output_is_unchanged(run):
+    expected = run(PROGRAM, peephole=False)
+    assert run(PROGRAM) == expected
+    assert run(PROGRAM, merge_threshold=2) == expected
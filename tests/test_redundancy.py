@@ -0,0 +1,66 @@
+import redundancy
+
+
+def code(visitor, name):
+    body = visitor.igfunctions[name]["code"] if name in visitor.igfunctions else visitor.igloops[name]
+    return [repr(instruction) for instruction in body]
+
+
+def test_invariant_is_hoisted_out_of_loop(visit):
+    visitor = visit("""
+    int a; int b; int g; int n;
+    void f() { int i = 0; while (i < n) { g = g + a * b; i++; } }
+    """)
+    saved = redundancy.eliminate(visitor)
+    assert code(visitor, "f") == ["i+local = 0", "[if i+local < n] _var1 = a", "[if i+local < n] _var1 *= b",
+                                  "[if i+local < n] call _loop0"]
+    assert code(visitor, "_loop0")[0] == "_var0 = _var1"
+    assert saved["hoisted instruction"] == 2
+
+
+def test_operand_written_by_a_call_in_the_loop_stays(visit):
+    visitor = visit("""
+    int a; int b; int g; int n;
+    int h(int v) { return v + 1; }
+    void f() { int i = 0; while (i < n) { g = g + a * b; b = h(b); i++; } }
+    """)
+    saved = redundancy.eliminate(visitor)
+    assert code(visitor, "_loop0")[:2] == ["_var0 = a", "_var0 *= b"]
+    assert saved["hoisted instruction"] == 0
+
+
+def test_call_leaving_operands_alone_doesnt_stop_hoisting(visit):
+    visitor = visit("""
+    int a; int b; int g; int n; int m;
+    int h(int v) { m = v; return v + 1; }
+    void f() { int i = 0; while (i < n) { g = g + a * b; g = h(g); i++; } }
+    """)
+    saved = redundancy.eliminate(visitor)
+    assert code(visitor, "_loop0")[0] == "_var0 = _var1"
+    assert saved["hoisted instruction"] == 2
+
+
+def test_repeated_expression_is_copied(visit):
+    visitor = visit("int a; int b; int g; int n; void f() { g = a * b; n = a * b; b = 2; n = a * b; }")
+    saved = redundancy.eliminate(visitor)
+    assert code(visitor, "f") == ["g = a", "g *= b", "n = g", "b = 2", "n = a", "n *= b"]
+    assert saved["common subexpression"] == 1
+
+
+def test_program_in_game(run):
+    source = """
+    int a; int b; int g; int n; int m;
+    int h(int v) { m = m + v; return v + 1; }
+    void load() { a = 3; b = 4; g = 0; n = 3; m = 0; }
+    void tick() {
+        int i = 0;
+        while (i < n) { g = g + a * b; b = h(b); i++; }
+        i = 0;
+        while (i < n) { g = g + a * b; m = h(m); i++; }
+        int c = a * b;
+        print("@a", "white", g, " ", b, " ", m, " ", c, " ", a * b);
+    }
+    """
+    expected = run(source, eliminate_redundancy=False)
+    assert run(source) == expected
+    assert run(source, inline=False) == expected
@@ -0,0 +1,62 @@
+import inliner
+import references
+
+SOURCE = """
+int data[];
+int other[];
+int g;
+int total(int arr[]) { return arr[0] + arr[1]; }
+int bump(int brr[]) { brr[0] = 5; return brr[0]; }
+int first(int crr[]) { return crr[0]; }
+void load() { data = {1, 2, 3}; other = {7, 8, 9}; }
+void tick() {
+    g = total(data);
+    g = g + bump(data);
+    g = g + first(data) + first(other);
+    print("@a", "white", g, " ", data[0]);
+}
+"""
+
+
+def code(visitor, function):
+    return [repr(instruction) for instruction in visitor.igfunctions[function]["code"]]
+
+
+def test_unwritten_argument_reads_the_passed_array(visit):
+    visitor = visit(SOURCE)
+    saved = references.pass_arrays(visitor)
+    assert code(visitor, "total")[0] == "_f_total = storage data.value[0]"
+    assert "storage arr+local set storage data" not in code(visitor, "tick")
+    assert saved["array copy"] == 1
+
+
+def test_written_argument_is_still_copied(visit):
+    visitor = visit(SOURCE)
+    references.pass_arrays(visitor)
+    assert "storage brr+local set storage data" in code(visitor, "tick")
+    assert code(visitor, "bump")[0] == "storage brr+local.value[0] set 5"
+
+
+def test_argument_passed_different_arrays_is_still_copied(visit):
+    visitor = visit(SOURCE)
+    references.pass_arrays(visitor)
+    tick = code(visitor, "tick")
+    assert "storage crr+local set storage data" in tick
+    assert "storage crr+local set storage other" in tick
+
+
+def test_inlined_copies_are_forwarded(visit):
+    visitor = visit(SOURCE)
+    inliner.inline(visitor)
+    saved = references.pass_arrays(visitor)
+    tick = code(visitor, "tick")
+    assert not any(line.startswith("storage crr+local set") for line in tick)
+    assert "storage brr+local set storage data" in tick
+    assert saved["array copy"] == 3
+
+
+def test_arrays_by_reference_in_game(run):
+    expected = run(SOURCE, pass_by_reference=False)
+    assert expected == ["16 1", "16 1"]
+    assert run(SOURCE) == expected
+    assert run(SOURCE, inline=False) == expected
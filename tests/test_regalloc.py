@@ -0,0 +1,22 @@
+# A call only clobbers the temps of what it runs: a temp the caller still
+# needs after the call isn't shared with one the callee writes
+CALL_IN_GUARD = """
+int g;
+int arr[];
+int f(int i) { return arr[i] + arr[i + 1]; }
+void load() { arr = {5, 7, 9}; g = 1; }
+void tick() {
+    if (arr[g] == 7) {
+        print("@a", "white", "f=", f(0));
+        print("@a", "white", "after");
+    }
+}
+"""
+
+
+def test_call_keeps_caller_guard(run):
+    assert run(CALL_IN_GUARD) == ["f=12", "after"] * 2
+
+
+def test_call_keeps_caller_guard_without_inlining(run):
+    assert run(CALL_IN_GUARD, inline=False) == ["f=12", "after"] * 2
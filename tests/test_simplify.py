@@ -0,0 +1,48 @@
+def code(visitor, function="f"):
+    return [repr(instruction) for instruction in visitor.igfunctions[function]["code"]]
+
+
+def simplified(visit, expression):
+    # IR computing y = expression, x a variable
+    source = f"int x; int y; void f() {{ y = {expression}; }}"
+    return code(visit(source))
+
+
+def test_identity_operands_leave_a_copy(visit):
+    assert simplified(visit, "x + 0") == ["y = x"]
+    assert simplified(visit, "x * 1") == ["y = x"]
+    assert simplified(visit, "x + 3 - 3") == ["y = x"]
+
+
+def test_absorbing_operands_give_a_literal(visit):
+    assert simplified(visit, "x * 0") == ["y = 0"]
+    assert simplified(visit, "x % 1") == ["y = 0"]
+    assert simplified(visit, "0 / x") == ["y = 0"]
+    assert simplified(visit, "x - x") == ["y = 0"]
+    assert simplified(visit, "x == x") == ["y = 1"]
+    assert simplified(visit, "x < x") == ["y = 0"]
+
+
+def test_constant_operations_merge(visit):
+    assert simplified(visit, "x * 2") == ["y = x", "y += y"]
+    assert simplified(visit, "x * 3 * 4") == ["y = x", "y *= _const12"]
+    assert simplified(visit, "x + 2 + 5") == ["y = x", "y += 7"]
+
+
+def test_literals_fold_like_the_scoreboard(visit):
+    assert simplified(visit, "2147483647 + 1") == ["y = -2147483648"]
+    assert simplified(visit, "(0 - 7) / 2") == ["y = -4"]
+    assert simplified(visit, "(0 - 7) % 2") == ["y = 1"]
+    assert simplified(visit, "7 / 0") == ["y = 7"]
+
+
+def test_simplified_program_computes_the_same(run):
+    source = """
+    int x;
+    void load() { x = 0 - 7; }
+    void tick() {
+        print("@a", "white", x * 0, " ", x + 3 - 3, " ", x * 2, " ", x * 3 * 4, " ", x / 2, " ", x % 3);
+        x = x + 5;
+    }
+    """
+    assert run(source) == ["0 -7 -14 -84 -4 2", "0 -2 -4 -24 -1 1"]
@@ -0,0 +1,37 @@
+def test_zero_trip_loop_skips_body(run):
+    source = """
+    int g;
+    void load() {
+        g = 0;
+        for (int i = 0; i < 0; i++) g++;
+        for (int k = 5; k < 3; k++) g = g + 10;
+        print("@a", "white", "g=", g);
+    }
+    """
+    assert run(source) == ["g=0"]
+
+
+def test_zero_trip_loop_with_large_body(run):
+    source = """
+    int g;
+    void load() {
+        g = 0;
+        for (int i = 0; i < 0; i++) {
+            g = g + 1; g = g + 2; g = g + 3; g = g + 4;
+        }
+        print("@a", "white", "g=", g);
+    }
+    """
+    assert run(source, unroll_threshold=2) == ["g=0"]
+
+
+def test_partly_unrolled_loop(run):
+    source = """
+    int g;
+    void load() {
+        g = 0;
+        for (int i = 0; i < 7; i++) g = g + i;
+        print("@a", "white", "g=", g);
+    }
+    """
+    assert run(source, unroll_threshold=6) == ["g=21"]
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import pickle
+import sys
+
+from antlr4 import ParserRuleContext
+from antlr4.Token import CommonToken, Token
+from antlr4.tree.Tree import TerminalNodeImpl
+
+from MineScriptLexer import MineScriptLexer
+from MineScriptParser import MineScriptParser
+
+# Bump whenever the layout of the cached data changes
+CACHE_FORMAT = 1
+
+_grammar_version = None
+
+def grammar_version():
+    global _grammar_version
+    if _grammar_version is None:
+        digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+        for cls in (MineScriptLexer, MineScriptParser):
+            digest.update(str(sys.modules[cls.__module__].serializedATN()).encode())
+        _grammar_version = digest.hexdigest()[:16]
+    return _grammar_version
+
+def cache_key(file):
+    with open(file, "rb") as source:
+        digest = hashlib.sha256(source.read()).hexdigest()
+    return f"{digest}-{grammar_version()}"
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.tree")
+
+def dump_tree(tokens, tree):
+    token_data = [(token.type, token.text, token.line, token.column,
+                   token.start, token.stop, token.channel) for token in tokens]
+    # The tree is stored as a flat pre-order list so deeply nested
+    # expressions don't hit the recursion limit when pickling
+    nodes = []
+    stack = [(tree, -1)]
+    while stack:
+        node, parent = stack.pop()
+        index = len(nodes)
+        if isinstance(node, TerminalNodeImpl):
+            nodes.append((parent, node.symbol.tokenIndex))
+            continue
+        labels = {}
+        for attr, value in vars(node).items():
+            if attr not in ("start", "stop") and isinstance(value, Token):
+                labels[attr] = value.tokenIndex
+        start = node.start.tokenIndex if node.start is not None else -1
+        stop = node.stop.tokenIndex if node.stop is not None else -1
+        nodes.append((parent, type(node).__name__, node.invokingState, start, stop, labels))
+        for child in reversed(node.children or []):
+            stack.append((child, index))
+    return token_data, nodes
+
+def load_tree(token_data, nodes):
+    tokens = []
+    for index, (type_, text, line, column, start, stop, channel) in enumerate(token_data):
+        token = CommonToken(type=type_, channel=channel, start=start, stop=stop)
+        token.text = text
+        token.line = line
+        token.column = column
+        token.tokenIndex = index
+        tokens.append(token)
+
+    built = []
+    for node in nodes:
+        parent = built[node[0]] if node[0] != -1 else None
+        if len(node) == 2:
+            obj = TerminalNodeImpl(tokens[node[1]])
+        else:
+            _, cls_name, invoking_state, start, stop, labels = node
+            cls = getattr(MineScriptParser, cls_name)
+            obj = cls.__new__(cls)
+            ParserRuleContext.__init__(obj, parent, invoking_state)
+            obj.parser = None
+            obj.start = tokens[start] if start != -1 else None
+            obj.stop = tokens[stop] if stop != -1 else None
+            for attr, token_index in labels.items():
+                setattr(obj, attr, tokens[token_index])
+        if parent is not None:
+            obj.parentCtx = parent
+            parent.addChild(obj)
+        built.append(obj)
+    return built[0]
+
+def load(cache_dir, key):
+    try:
+        with open(cache_path(cache_dir, key), "rb") as file:
+            token_data, nodes = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+    return load_tree(token_data, nodes)
+
+def store(cache_dir, key, tokens, tree):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, key)
+    # Write to a temporary file first so a concurrent build never reads
+    # a half-written entry
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        pickle.dump(dump_tree(tokens, tree), file, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)